@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+import pytest
+from zipfile import ZipFile
+from tmproject import encoder, decoder, create_output, read_input
+
+
+def test_earlier_reference_round_trip_with_gif_names(tmp_path):
+    rng = np.random.default_rng(0)
+    scene = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    other = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    # La imagen P del segundo GOP solo coincide con la referencia del primero
+    images = {f'clip_{index}.gif': image.copy() for index, image in enumerate([scene, scene, other, scene])}
+    metadata = {"encoder_parameters": {"n_tiles_x": 2, "n_tiles_y": 2, "gop": 2, "references": 2}, "frames": []}
+    encoder.main(images, (2, 2), 0, 2, 0.9, metadata, backend='serial', references=2)
+    ref_frames = {tile["ref_frame"] for frame in metadata["frames"] for tile in frame.get("tiles", []) if "ref_frame" in tile}
+    assert ref_frames == {'clip_0.gif'}
+    assert len(metadata["frames"][3]["tiles"]) == 4
+
+    zip_path = tmp_path / 'encoded.zip'
+    create_output.create_zip(zip_path, images, metadata, False)
+    decoded, decoded_metadata = {}, {}
+    read_input.open_zip(zip_path, decoded, decoded_metadata)
+    decoder.main(decoded, decoded_metadata)
+    assert list(decoded) == [f'clip_{index}.jpeg' for index in range(4)]
+    # Todas las teselas de la imagen P se copian de la referencia del primer GOP ya descodificada
+    assert np.array_equal(decoded['clip_3.jpeg'], decoded['clip_0.jpeg'])
+
+
+@pytest.mark.parametrize('dedup, noise', [('exact', 0), ('perceptual', 2)])
+def test_duplicate_frames_round_trip(tmp_path, dedup, noise):
+    rng = np.random.default_rng(24)
+    first = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    second = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    # La segunda y la cuarta imagen repiten la primera (con un poco de ruido en el modo perceptivo)
+    repeated = np.clip(first.astype(int) + rng.integers(-noise, noise + 1, first.shape), 0, 255).astype(np.uint8)
+    images = {f'clip_{index}.png': image.copy() for index, image in enumerate([first, repeated, second, repeated])}
+    metadata = {"encoder_parameters": {"n_tiles_x": 2, "n_tiles_y": 2, "gop": 2}, "frames": []}
+    stats = encoder.main(images, (2, 2), 0, 2, 0.9, metadata, backend='serial', dedup=dedup, dedupdistance=4)
+    assert stats["duplicate_frames"] == 2
+
+    zip_path = tmp_path / 'encoded.zip'
+    create_output.create_zip(zip_path, images, metadata, False)
+    with ZipFile(zip_path) as zip_file:
+        assert sorted(zip_file.namelist()) == ['clip_0.jpeg', 'clip_2.jpeg', 'encoder_metadata.json']
+    duplicates = {frame["file_name"]: frame["duplicate_of"] for frame in metadata["frames"] if "duplicate_of" in frame}
+    assert duplicates == {'clip_1.jpeg': 'clip_0.jpeg', 'clip_3.jpeg': 'clip_0.jpeg'}
+
+    decoded, decoded_metadata = {}, {}
+    read_input.open_zip(zip_path, decoded, decoded_metadata)
+    decoder.main(decoded, decoded_metadata)
+    assert list(decoded) == [f'clip_{index}.jpeg' for index in range(4)]
+    assert decoded['clip_1.jpeg'] is decoded['clip_0.jpeg']
+    assert decoded['clip_3.jpeg'] is decoded['clip_0.jpeg']
+
+
+def encode_round_trip(tmp_path, images, ntiles, tileatlas):
+    encoded = {file_name: image.copy() for file_name, image in images.items()}
+    metadata = {"encoder_parameters": {"n_tiles_x": ntiles[0], "n_tiles_y": ntiles[1], "gop": len(images)}, "frames": []}
+    encoder.main(encoded, ntiles, 0, len(images), 0.9, metadata, backend='serial', tileatlas=tileatlas)
+    zip_path = tmp_path / f'encoded_{tileatlas}.zip'
+    create_output.create_zip(zip_path, encoded, metadata, False)
+    decoded, decoded_metadata = {}, {}
+    read_input.open_zip(zip_path, decoded, decoded_metadata)
+    decoder.main(decoded, decoded_metadata)
+    return decoded, {frame["file_name"]: frame for frame in decoded_metadata["frames"]}
+
+
+@pytest.mark.parametrize('shape', [(48, 100, 3), (48, 100)])
+def test_tile_atlas_round_trip(tmp_path, shape):
+    rng = np.random.default_rng(25)
+    ntiles = (6, 3)
+    # Teselas de 16x16 con un margen de 4 columnas a la derecha
+    reference = cv2.GaussianBlur(rng.integers(0, 256, shape, dtype=np.uint8), (0, 0), 2)
+    partial = reference.copy()
+    partial[:16, :16] = rng.integers(0, 256, partial[:16, :16].shape, dtype=np.uint8)
+    images = {
+        'clip_0.png': reference,
+        'clip_1.png': reference.copy(),  # todas las teselas se sustituyen
+        'clip_2.png': partial,  # todas menos una
+        'clip_3.png': rng.integers(0, 256, shape, dtype=np.uint8),  # ninguna
+    }
+    plain, plain_frames = encode_round_trip(tmp_path, images, ntiles, False)
+    atlas, atlas_frames = encode_round_trip(tmp_path, images, ntiles, True)
+
+    assert [("atlas" in atlas_frames[f'clip_{index}.jpeg']) for index in range(4)] == [False, True, True, False]
+    assert list(atlas) == list(plain)
+    for file_name in atlas:
+        assert atlas[file_name].shape == plain[file_name].shape == shape
+    # Las imágenes guardadas enteras son idénticas, y las teselas copiadas vienen de la misma referencia
+    assert np.array_equal(atlas['clip_0.jpeg'], plain['clip_0.jpeg'])
+    assert np.array_equal(atlas['clip_3.jpeg'], plain['clip_3.jpeg'])
+    assert np.array_equal(atlas['clip_1.jpeg'][:, :96], plain['clip_1.jpeg'][:, :96])
+    assert np.array_equal(atlas['clip_2.jpeg'][16:, :96], plain['clip_2.jpeg'][16:, :96])
+    # Las celdas del atlas (la tesela no sustituida y el margen) solo difieren por la compresión JPEG
+    for file_name in ('clip_1.jpeg', 'clip_2.jpeg'):
+        psnr = encoder.calculate_frame_psnr(plain[file_name].astype(float), atlas[file_name].astype(float))
+        assert psnr is None or psnr > 30
+
+
+@pytest.mark.parametrize('shape, ntiles', [((36, 50, 3), (3, 2)), ((40, 40), (4, 5)), ((64, 48, 3), (2, 4))])
+@pytest.mark.parametrize('replaced', ['all', 'none', 'random'])
+def test_pack_unpack_tile_atlas(shape, ntiles, replaced):
+    rng = np.random.default_rng(sum(shape))
+    image = rng.integers(0, 256, shape, dtype=np.uint8)
+    mask = {'all': np.ones, 'none': np.zeros}.get(replaced, lambda size, dtype: rng.random(size) < 0.7)((ntiles[1], ntiles[0]), dtype=bool)
+    average_value = encoder.calculate_average_value(image)
+    encoder.apply_replacements({'frame': image}, {'frame': (mask, average_value)}, ntiles)
+    atlas = encoder.tile_atlas_layout(image.shape, mask, ntiles, average_value)
+    if atlas is None:
+        # Sin bastantes teselas sustituidas la imagen se guarda entera
+        assert replaced != 'all'
+        return
+    packed = encoder.pack_tile_atlas(image, atlas)
+    assert packed.size <= encoder.ATLAS_MAX_RATIO * image.size
+    assert np.array_equal(encoder.unpack_tile_atlas(packed, atlas), image)
@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+import pytest
+from collections import Counter, OrderedDict
+from tmproject import encoder
+
+
+def scene_images(levels):
+    # Una imagen plana por nivel: imágenes de niveles distintos son escenas distintas
+    return {f'f{index}.png': np.full((16, 16, 3), level, dtype=np.uint8) for index, level in enumerate(levels)}
+
+
+def test_scene_cut_on_gop_boundary_does_not_yield_empty_group():
+    images = scene_images([0, 0, 255, 255])
+    groups = encoder.split_images_into_groups(images, gop=2, scenecut=0.5)
+    assert [list(group) for group in groups] == [['f0.png', 'f1.png'], ['f2.png', 'f3.png']]
+
+
+def test_scene_cut_inside_gop_starts_new_group():
+    images = scene_images([0, 255, 255, 255])
+    groups = encoder.split_images_into_groups(images, gop=3, scenecut=0.5)
+    assert [list(group) for group in groups] == [['f0.png'], ['f1.png', 'f2.png', 'f3.png']]
+
+
+def test_main_with_scene_cut_on_gop_boundary():
+    images = scene_images([0, 0, 255, 255])
+    metadata = {"frames": []}
+    stats = encoder.main(images, (2, 2), 0, 2, 0.9, metadata, backend='serial', scenecut=0.5, references=2)
+    assert isinstance(stats, Counter)
+    assert metadata["groups"] == [['f0.png', 'f1.png'], ['f2.png', 'f3.png']]
+
+
+def test_realtime_does_not_downscale_tiles_below_one_pixel():
+    rng = np.random.default_rng(20)
+    frames = [(f'f{index}.png', rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)) for index in range(8)]
+    metadata = {"frames": []}
+    # Con un tiempo por imagen imposible, la degradación llega al nivel máximo: teselas de 8 píxeles reducidas 8 veces
+    groups = list(encoder.encode_realtime(iter(frames), (4, 4), 2, 8, 0.9, metadata, 1e9, matchscale=8))
+    assert sum(len(image_group) for image_group, _, _ in groups) == len(frames)
+    assert encoder.realtime_max_level((32, 32, 3), (4, 4), 8) == encoder.REALTIME_MAX_LEVEL - 1
+    assert encoder.realtime_max_level((32, 32, 3), (4, 4), 4) == encoder.REALTIME_MAX_LEVEL
+
+
+def test_ann_recall_cache_depends_on_quality(tmp_path):
+    rng = np.random.default_rng(18)
+    reference = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    image = np.roll(reference, 1, axis=1)
+    stack = encoder.reference_tile_stack(reference, (4, 4))
+    parameters = dict(ntiles=(4, 4), seekrange=1, matcher='gemm', anncandidates=2, annrecall=True, cachedir=tmp_path)
+    # Con el recall del índice cada calidad tiene su propia entrada en la caché
+    encoder.process_predicted_frame('f1.png', image, stack, quality=0.5, **parameters)
+    encoder.process_predicted_frame('f1.png', image, stack, quality=0.9, **parameters)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+@pytest.mark.parametrize('references, motionsearch', [(1, 'full'), (3, 'full'), (3, 'predictive')])
+def test_stream_backends_match_serial(references, motionsearch):
+    rng = np.random.default_rng(13)
+    base = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    frames = [(f'f{index}.png', np.roll(base, index, axis=1)) for index in range(10)]
+    results = []
+    for backend in ('serial', 'thread', 'process'):
+        metadata = {"frames": []}
+        groups = list(encoder.encode_stream(iter((name, image.copy()) for name, image in frames), (4, 4), 1, 3, 0.8, metadata,
+                                            backend=backend, references=references, motionsearch=motionsearch))
+        results.append((metadata, [list(image_group) for image_group, _, _ in groups]))
+    assert results[0] == results[1] == results[2]
+
+
+def test_group_tile_stacks_reuses_recent_references():
+    rng = np.random.default_rng(23)
+    images = {f'r{index}.png': rng.integers(0, 256, (16, 16, 3), dtype=np.uint8) for index in range(4)}
+    stack_cache = OrderedDict()
+    first_stack, _ = encoder.group_tile_stacks(stack_cache, 'r0.png', images['r0.png'], {}, (2, 2))
+    second_stack, earlier_stacks = encoder.group_tile_stacks(stack_cache, 'r1.png', images['r1.png'], {'r0.png': images['r0.png']}, (2, 2))
+    assert earlier_stacks == [('r0.png', first_stack)]
+    earlier = {'r1.png': images['r1.png'], 'r2.png': images['r2.png']}
+    _, earlier_stacks = encoder.group_tile_stacks(stack_cache, 'r3.png', images['r3.png'], earlier, (2, 2))
+    # Las teselas de r1 se reutilizan; r0 ya no la usa ningún GOP y se olvida
+    assert [name for name, _ in earlier_stacks] == ['r2.png', 'r1.png']
+    assert earlier_stacks[1][1] is second_stack
+    assert list(stack_cache) == ['r1.png', 'r2.png', 'r3.png']
+
+
+@pytest.mark.parametrize('quality', [0.5, 0.8, 0.9, 0.99])
+def test_prefilter_does_not_change_output(quality):
+    rng = np.random.default_rng(9)
+    noise = cv2.GaussianBlur(rng.random((48, 48, 3)), (0, 0), 3)
+    base = np.rint(255 * (noise - noise.min()) / np.ptp(noise)).astype(np.uint8)
+    images = {f'f{index}.png': np.roll(base, (index, -index), axis=(0, 1)) for index in range(3)}
+    # Una imagen sin relación con la referencia, para que el prefiltro descarte parejas
+    images['f3.png'] = rng.integers(0, 256, (48, 48, 3), dtype=np.uint8)
+    results = []
+    for prefilter in (False, True):
+        metadata = {"frames": []}
+        encoded = {file_name: image.copy() for file_name, image in images.items()}
+        stats = encoder.main(encoded, (4, 4), 2, 4, quality, metadata, backend='serial', prefilter=prefilter)
+        results.append(metadata)
+    assert results[0] == results[1]
+    if quality == 0.99:
+        assert stats["prefilter_skipped"] > 0
+
+
+def test_correlation_cache_is_compact_and_consistent(tmp_path):
+    rng = np.random.default_rng(18)
+    images = {f'f{index}.png': rng.integers(0, 256, (32, 32, 3), dtype=np.uint8) for index in range(3)}
+    results = []
+    for _ in range(2):
+        # La primera pasada llena la caché y la segunda la lee: el resultado debe ser el mismo
+        metadata = {"frames": []}
+        stats = encoder.main({file_name: image.copy() for file_name, image in images.items()}, (4, 4), 3, 3, 0.1, metadata,
+                             backend='serial', cachedir=tmp_path)
+        results.append(metadata)
+    assert results[0] == results[1]
+    assert stats["cache_hits"] == 2
+    with np.load(next(tmp_path.iterdir())) as cached:
+        assert cached["scores"].dtype == np.float32
+        assert cached["shifts"].dtype == np.int8
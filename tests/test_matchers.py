@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from tmproject import encoder, matchers
+
+SEEKRANGE = 2
+TILE_SHAPE = (12, 12)
+# Paquetes opcionales de cada motor
+ENGINE_PACKAGES = {'opencv': 'cv2', 'numba': 'numba'}
+
+
+def tile_pairs():
+    rng = np.random.default_rng(1)
+    pairs = []
+    for _ in range(4):
+        # Parejas aleatorias, sin relación entre ellas
+        pairs.append((rng.integers(0, 256, TILE_SHAPE + (3,), dtype=np.uint8),
+                      rng.integers(0, 256, TILE_SHAPE + (3,), dtype=np.uint8)))
+    for dy, dx in ((0, 0), (1, -2), (-2, 1), (2, 2)):
+        # Parejas desplazadas, con una coincidencia clara
+        reference = rng.integers(0, 256, TILE_SHAPE + (3,), dtype=np.uint8)
+        pairs.append((np.roll(reference, (-dy, -dx), axis=(0, 1)), reference))
+    return pairs
+
+
+@pytest.mark.parametrize('engine', ['auto', 'roll', 'fft', 'opencv', 'numba'])
+def test_pair_engines_match_roll(engine):
+    if engine in ENGINE_PACKAGES:
+        pytest.importorskip(ENGINE_PACKAGES[engine])
+    correlation = encoder.get_matcher(engine, TILE_SHAPE, SEEKRANGE)
+    for current_tile, reference_tile in tile_pairs():
+        score, shift = correlation(current_tile, reference_tile, SEEKRANGE)
+        roll_score, roll_shift = encoder.calculate_correlation(current_tile, reference_tile, SEEKRANGE)
+        assert score == pytest.approx(roll_score, abs=1e-6)
+        assert tuple(shift) == tuple(roll_shift)
+
+
+@pytest.mark.parametrize('engine', ['gemm', 'fft'])
+def test_stacked_engines_match_roll(engine):
+    rng = np.random.default_rng(2)
+    reference = rng.integers(0, 256, (36, 36, 3), dtype=np.uint8)
+    current = np.roll(reference, (1, -2), axis=(0, 1))
+    current[:12, :12] = rng.integers(0, 256, (12, 12, 3), dtype=np.uint8)
+    current_stack = matchers.TileStack(encoder.matching_tiles(current, (3, 3)))
+    reference_stack = matchers.TileStack(encoder.matching_tiles(reference, (3, 3)))
+    scores, shifts = encoder.match_tiles(current_stack, reference_stack, SEEKRANGE, engine)
+    roll_scores, roll_shifts = encoder.match_tiles(current_stack, reference_stack, SEEKRANGE, 'roll')
+    np.testing.assert_allclose(scores, roll_scores, atol=1e-6)
+    assert np.array_equal(shifts, roll_shifts)
@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+import pytest
+from tmproject import encoder, matchers
+
+NTILES = (3, 3)
+SEEKRANGE = 2
+# Diferencia máxima admitida entre las correlaciones de precisión reducida y las de float64
+SCORE_TOLERANCE = 1e-5
+
+
+@pytest.fixture(scope='module')
+def images():
+    rng = np.random.default_rng(22)
+    # Ruido suavizado, para que las búsquedas por patrones converjan hacia el máximo
+    noise = cv2.GaussianBlur(rng.random((36, 36, 3)), (0, 0), 2)
+    reference = np.rint(255 * (noise - noise.min()) / np.ptp(noise)).astype(np.uint8)
+    # La imagen actual es la de referencia desplazada, con ruido: cada tesela tiene una coincidencia clara
+    current = np.roll(reference, (1, -1), axis=(0, 1)).astype(int) + rng.integers(-4, 5, reference.shape)
+    return np.clip(current, 0, 255).astype(np.uint8), reference
+
+
+def search(images, precision, matcher, motionsearch):
+    current, reference = images
+    current_stack = matchers.TileStack(encoder.matching_tiles(current, NTILES), precision)
+    reference_stack = matchers.TileStack(encoder.matching_tiles(reference, NTILES), precision)
+    return encoder.match_tiles(current_stack, reference_stack, SEEKRANGE, matcher, motionsearch=motionsearch)
+
+
+@pytest.mark.parametrize('precision', ['float32', 'uint8'])
+@pytest.mark.parametrize('matcher, motionsearch', [('gemm', 'full'), ('fft', 'full'), ('roll', 'full'),
+                                                   ('gemm', 'threestep'), ('gemm', 'diamond')])
+def test_reduced_precision_scores_match_float64(images, precision, matcher, motionsearch):
+    scores, shifts = search(images, 'float64', matcher, motionsearch)
+    reduced_scores, reduced_shifts = search(images, precision, matcher, motionsearch)
+    assert np.abs(reduced_scores - scores).max() < SCORE_TOLERANCE
+    # Sin empates, el mejor desplazamiento de las parejas que coinciden es el mismo
+    matched = scores > 0.5
+    assert matched.sum() >= len(scores)
+    assert np.array_equal(reduced_shifts[matched], shifts[matched])
+
+
+@pytest.mark.parametrize('precision', ['float32', 'uint8'])
+def test_calculate_correlation_matches_float64(images, precision):
+    current, reference = images
+    current_tile, reference_tile = current[12:24, 12:24], reference[12:24, 12:24]
+    score, shift = encoder.calculate_correlation(current_tile, reference_tile, SEEKRANGE)
+    reduced_score, reduced_shift = encoder.calculate_correlation(current_tile, reference_tile, SEEKRANGE, precision)
+    assert abs(reduced_score - score) < SCORE_TOLERANCE
+    assert tuple(reduced_shift) == tuple(shift)
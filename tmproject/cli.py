@@ -1,12 +1,16 @@
 import os
 import time
 import click
+import numpy as np
+from collections import Counter, OrderedDict
 from tmproject import read_input
 from tmproject import filters
 from tmproject import reproduce_video
 from tmproject import create_output
 from tmproject import encoder
 from tmproject import decoder
+from tmproject import matchers
+from tmproject import sweep
 
 FILTER_HELP = """
 Filtres disponibles i els seus paràmetres:
@@ -29,13 +33,38 @@ Filtres disponibles i els seus paràmetres:
 @click.option('--fps', type=int, default=25, help='Nombre d’imatges per segon amb les quals és reproduirà el vídeo.')
 @click.option('--filter', help='Aplica filtres acumulatius amb sintaxi "filtre=valor".')
 @click.option('--filter-help', is_flag=True, help='Mostra informació sobre els filtres disponibles.')
-@click.option('--nTiles', type=(int, int), default=(4, 4), help='Nombre de tessel·les en els eixos vertical i horitzontal en les quals dividir la imatge.')
+@click.option('--nTiles', type=(int, int), default=(4, 4), help='Nombre de tessel·les en els eixos horitzontal i vertical en les quals dividir la imatge.')
 @click.option('--seekRange', type=int, default=0, help='Desplaçament màxim en la cerca de tessel·les coincidents.')
 @click.option('--GOP', type=int, default=10, help='Nombre d’imatges entre dos frames de referència.')
+@click.option('--sceneCut', type=float, default=None, help='Llindar (entre 0 i 1) de canvi d’escena entre dues imatges consecutives per començar un GOP nou. Amb aquesta opció, el GOP és la mida màxima dels grups.')
+@click.option('--references', type=click.IntRange(min=1), default=1, help='Nombre màxim d’imatges de referència de cada imatge P: la del seu GOP i les dels GOP anteriors més recents. Les tessel·les que reapareixen després d’un canvi de GOP es copien d’una referència anterior. La memòria de l’encoder i del decoder creix amb aquest nombre.')
+@click.option('--dedup', type=click.Choice(encoder.DEDUP_MODES), default=None, help='Detecta les imatges que repeteixen una imatge anterior, exactament o amb un hash perceptiu, i les guarda només com una referència a les metadades, sense imatge ni cerca de tessel·les.')
+@click.option('--dedupDistance', type=click.IntRange(0, 64), default=0, help='Amb --dedup perceptual, distància de Hamming màxima (en bits, de 64) entre els hash de dues imatges per considerar-les repetides.')
+@click.option('--tileAtlas', is_flag=True, default=False, help='Guarda cada imatge P només amb les tessel·les que no s’han substituït, juntes en una imatge més petita (un atles), i la seva posició a les metadades. El decoder torna a muntar la imatge sencera abans de copiar-hi les tessel·les.')
 @click.option('--quality', type=float, default=0.9, help='Factor de qualitat que determinarà quan dues tessel·les es consideren coincidents.')
+@click.option('--minGap', type=float, default=None, help='Diferència mínima entre la millor correlació d’una tessel·la i la segona per substituir-la. Si no es compleix, la tessel·la es manté.')
+@click.option('--changeThreshold', type=float, default=None, help='Diferència absoluta mitjana (0-255) amb la tessel·la de referència de la mateixa posició per sota de la qual una tessel·la es dona per coincident sense cercar-la.')
+@click.option('--matcher', type=click.Choice(matchers.MATCHER_NAMES), default='auto', help='Motor de correspondència de tessel·les. "gemm" compara totes les parelles d’una imatge amb un producte de matrius per desplaçament; "numba" fa servir un nucli compilat que allibera el GIL (o NumPy si Numba no està instal·lat); "auto" el tria segons la mida de tessel·la, el nombre de tessel·les i el seekRange.')
+@click.option('--searchTiles', type=click.IntRange(min=0), default=None, help='Distància màxima, en tessel·les, entre una tessel·la i les tessel·les de referència candidates. Per defecte la cerca és exhaustiva.')
+@click.option('--motionSearch', type=click.Choice(matchers.MOTION_SEARCH_NAMES), default='full', help='Estratègia de cerca del desplaçament: exhaustiva, en tres passos, en diamant, piramidal (de gruixut a fi) o predictiva (a partir del moviment de les tessel·les veïnes i de la imatge anterior).')
+@click.option('--zeroMotion', is_flag=True, help='Accepta directament la tessel·la coubicada sense desplaçament quan arriba a la qualitat.')
+@click.option('--preFilter', is_flag=True, help='Descarta, sense calcular-ne la correlació, les parelles de tessel·les que segur que no arriben a la qualitat.')
+@click.option('--matchPlane', type=click.Choice(encoder.MATCH_PLANES), default='rgb', help='Pla on es busquen les tessel·les coincidents: la imatge en color o només la seva luminància.')
+@click.option('--matchScale', type=click.IntRange(min=1), default=1, help='Redueix el pla de cerca aquest nombre de vegades (per exemple 2 o 4). Les coincidències s’apliquen a les imatges originals.')
+@click.option('--precision', type=click.Choice(matchers.PRECISION_NAMES), default='float64', help='Precisió de l’aritmètica de la cerca: "float32" fa els productes en precisió simple (la meitat de memòria i més ràpid) i "uint8" treballa amb tessel·les de 8 bits (arrodonint la luminància), amb estadístiques exactes en enters i, amb el motor "roll", productes acumulats en enters. Les correlacions poden diferir lleugerament de les de "float64".')
+@click.option('--annCandidates', type=click.IntRange(min=1), default=None, help='Compara cada tessel·la només amb les k tessel·les de referència de descriptor (tessel·la reduïda i normalitzada) més proper, segons un índex k-d construït una vegada per GOP.')
+@click.option('--annRecall', is_flag=True, help='Amb --annCandidates, fa també la cerca sense índex i mostra quantes de les millors coincidències hi ha entre les k candidates.')
+@click.option('--cacheDir', type=click.Path(file_okay=False), default=None, help='Directori on es guarden les correlacions calculades de cada imatge P. Una execució posterior que només canviï --quality o --minGap les hi recupera sense tornar a fer la cerca.')
+@click.option('--backend', type=click.Choice(encoder.BACKEND_NAMES), default='thread', help='Execució dels grups d’imatges: seqüencial, amb fils o amb processos que comparteixen les imatges en memòria. La sortida és la mateixa amb tots.')
+@click.option('--stream', is_flag=True, help='Codifica el vídeo en flux: llegeix, codifica i guarda les imatges GOP a GOP, sense tenir tot el vídeo en memòria. Només per a vídeos o GIF, amb fitxer de sortida i sense filtres.')
+@click.option('--realTime', is_flag=True, help='Codifica en flux amb un temps màxim per imatge de 1/fps segons: si una imatge arriba tard, les següents es busquen amb menys desplaçament, menys candidates o menys resolució, i si encara no hi arriben s’emet una imatge de referència. Només per a vídeos o GIF, amb fitxer de sortida i sense filtres.')
+@click.option('--sweepQuality', type=float, multiple=True, help='Barreig de paràmetres: codifica amb cada valor de qualitat (es pot repetir) i en mostra la mida, el PSNR i el temps, llegint l’entrada i fent la cerca una sola vegada (el temps de la cerca es mostra a part). Amb --zeroMotion, --preFilter o --annRecall la cerca depèn de la qualitat i es torna a fer per a cada qualitat. Amb -o, guarda només el ZIP del punt escollit.')
+@click.option('--sweepTiles', type=(int, int), multiple=True, help='Nombres de tessel·les a provar en el barreig (es pot repetir). Per defecte, el de --nTiles.')
+@click.option('--sweepReport', type=click.Path(dir_okay=False), default=None, help='Fitxer (.csv o .json) on guardar l’informe del barreig.')
+@click.option('--targetPSNR', type=float, default=None, help='PSNR mínim del punt escollit en el barreig: s’escull el ZIP més petit que hi arriba. Per defecte, el de més PSNR.')
 @click.option('--reproduce', is_flag=True, help='Reprodueix el vídeo de sortida. Encara que hi hagi un fitxer de sortida.')
 @click.help_option('--help', '-h')
-def main(input, output, fps, filter, filter_help, ntiles, seekrange, gop, quality, reproduce):
+def main(input, output, fps, filter, filter_help, ntiles, seekrange, gop, scenecut, references, dedup, dedupdistance, tileatlas, quality, mingap, changethreshold, matcher, searchtiles, motionsearch, zeromotion, prefilter, matchplane, matchscale, precision, anncandidates, annrecall, cachedir, backend, stream, realtime, sweepquality, sweeptiles, sweepreport, targetpsnr, reproduce):
     """
     Processa un fitxer de vídeo, aplicant codificació/descodificació i filtres especificats, i genera un fitxer ZIP amb el resultat.
 
@@ -45,10 +74,35 @@ def main(input, output, fps, filter, filter_help, ntiles, seekrange, gop, qualit
         fps (int): Nombre d'imatges per segon per a la reproducció del vídeo.
         filter (str): Filtres a aplicar amb la sintaxi "filtre=valor".
         filter_help (bool): Indica si es mostra informació sobre els filtres disponibles.
-        ntiles (tuple): Nombre de tessel·les en els eixos vertical i horitzontal.
+        ntiles (tuple): Nombre de tessel·les en els eixos horitzontal i vertical.
         seekrange (int): Desplaçament màxim en la cerca de tessel·les coincidents.
         gop (int): Nombre d'imatges entre dos frames de referència.
+        scenecut (float): Llindar de canvi d'escena per començar un GOP nou. None per a GOP de mida fixa.
+        references (int): Nombre màxim d'imatges de referència de cada imatge P.
+        dedup (str): Detecció d'imatges repetides ('exact' o 'perceptual'). None per no buscar-les.
+        dedupdistance (int): Distància de Hamming màxima entre els hash perceptius de dues imatges repetides.
+        tileatlas (bool): Indica si les imatges P es guarden com a atles de les tessel·les no substituïdes.
         quality (float): Factor de qualitat per determinar quan dues tessel·les es consideren coincidents.
+        mingap (float): Diferència mínima entre la millor correlació d'una tessel·la i la segona. None per no exigir-ne cap.
+        changethreshold (float): Diferència màxima amb la tessel·la de referència de la mateixa posició per acceptar-la sense cercar-la. None per cercar-les totes.
+        matcher (str): Motor de correspondència de tessel·les ('auto', 'roll', 'fft', 'opencv', 'gemm' o 'numba').
+        searchtiles (int): Distància màxima, en tessel·les, de les tessel·les de referència candidates. None per a una cerca exhaustiva.
+        motionsearch (str): Estratègia de cerca del desplaçament ('full', 'threestep', 'diamond', 'pyramid' o 'predictive').
+        zeromotion (bool): Indica si s'accepta directament la tessel·la coubicada quan arriba a la qualitat.
+        prefilter (bool): Indica si es descarten les parelles de tessel·les que no poden arribar a la qualitat.
+        matchplane (str): Pla on es busquen les tessel·les coincidents ('rgb' o 'luma').
+        matchscale (int): Factor de reducció del pla de cerca.
+        precision (str): Precisió de l'aritmètica de la cerca ('float64', 'float32' o 'uint8').
+        anncandidates (int): Nombre de tessel·les de referència candidates segons l'índex de descriptors. None per no fer-lo servir.
+        annrecall (bool): Indica si es mesura el recall de l'índex respecte a la cerca sense índex.
+        cachedir (str): Directori de la memòria cau de correlacions. None per no fer-la servir.
+        backend (str): Forma d'executar els grups d'imatges ('serial', 'thread' o 'process').
+        stream (bool): Indica si es codifica en flux, GOP a GOP, amb memòria acotada.
+        realtime (bool): Codifica en flux en temps real, amb un temps màxim per imatge de 1/fps segons.
+        sweepquality (tuple): Valors de qualitat del barreig de paràmetres. Buit per codificar una sola vegada.
+        sweeptiles (tuple): Nombres de tessel·les del barreig. Buit per fer servir ntiles.
+        sweepreport (str): Fitxer on guardar l'informe del barreig, o None.
+        targetpsnr (float): PSNR mínim del punt escollit en el barreig, o None.
         reproduce (bool): Indica si es reprodueix el vídeo de sortida. Encara que hi hagi un fitxer de sortida.
     """
     if filter_help:
@@ -65,13 +119,41 @@ def main(input, output, fps, filter, filter_help, ntiles, seekrange, gop, qualit
             "n_tiles_x": ntiles[0],
             "n_tiles_y": ntiles[1],
             "gop": gop,
+            "scene_cut": scenecut,
+            "references": references,
+            "dedup": dedup,
+            "dedup_distance": dedupdistance,
+            "tile_atlas": tileatlas,
             "quality": quality,
-            "seek_range": seekrange
+            "min_gap": mingap,
+            "change_threshold": changethreshold,
+            "seek_range": seekrange,
+            "matcher": matcher,
+            "search_tiles": searchtiles,
+            "motion_search": motionsearch,
+            "zero_motion": zeromotion,
+            "pre_filter": prefilter,
+            "match_plane": matchplane,
+            "match_scale": matchscale,
+            "precision": precision,
+            "ann_candidates": anncandidates,
+            "real_time_fps": fps if realtime else None
         },
         "frames": [],
         "filters": []
     }
     
+    if stream or realtime:
+        if filter or reproduce or dedup or not output or not input.endswith(('.gif', '.avi', '.mpeg', '.mp4')):
+            click.echo('La codificació en flux només accepta vídeos o GIF, amb fitxer de sortida i sense filtres, reproducció ni --dedup.')
+            return
+        stream_encode(input, output, metadata, ntiles, seekrange, gop, quality, matcher=matcher, searchtiles=searchtiles,
+                      motionsearch=motionsearch, zeromotion=zeromotion, backend=backend, scenecut=scenecut, prefilter=prefilter,
+                      matchplane=matchplane, matchscale=matchscale, mingap=mingap, changethreshold=changethreshold, cachedir=cachedir,
+                      anncandidates=anncandidates, annrecall=annrecall, realtime_fps=fps if realtime else None, precision=precision,
+                      references=references, tileatlas=tileatlas)
+        return
+
     if input.endswith('.zip'):
         click.echo('Obrint fitxer zip...')
         is_encoded, is_grayscale = read_input.open_zip(input, images, metadata)
@@ -97,19 +179,42 @@ def main(input, output, fps, filter, filter_help, ntiles, seekrange, gop, qualit
         filters_split = filter.split(';')
         filters.main(filters_split, images, metadata, click, is_encoded, is_grayscale)
 
+    if sweepquality:
+        if is_encoded:
+            click.echo('El barreig de paràmetres necessita un vídeo sense codificar.')
+            return
+        run_sweep(input, output, images, metadata, sweepquality, sweeptiles or (ntiles,), sweepreport, targetpsnr,
+                  dict(seekrange=seekrange, gop=gop, matcher=matcher, searchtiles=searchtiles, motionsearch=motionsearch,
+                       zeromotion=zeromotion, backend=backend, scenecut=scenecut, prefilter=prefilter, matchplane=matchplane,
+                       matchscale=matchscale, mingap=mingap, changethreshold=changethreshold, anncandidates=anncandidates,
+                       annrecall=annrecall, precision=precision, references=references, dedup=dedup, dedupdistance=dedupdistance,
+                       tileatlas=tileatlas),
+                  cachedir)
+        return
+
     if output:
         if not is_encoded:
             start_time = time.time()
-            original_images = images.copy()  # for psnr calculation
-            click.echo(f'Executant codificació: nTiles[{ntiles}], seekRange[{seekrange}], GOP[{gop}], quality[{quality}]...')
-            encoder.main(images, ntiles, seekrange, gop, quality, metadata)
+            # El encoder sustituye las teselas sobre las propias imágenes, así que se copian para el PSNR
+            original_images = {file_name: image.copy() for file_name, image in images.items()}
+            click.echo(f'Executant codificació: nTiles[{ntiles}], seekRange[{seekrange}], GOP[{gop}], sceneCut[{scenecut}], references[{references}], dedup[{dedup}], tileAtlas[{tileatlas}], quality[{quality}], minGap[{mingap}], changeThreshold[{changethreshold}], matcher[{matcher}], searchTiles[{searchtiles}], motionSearch[{motionsearch}], matchPlane[{matchplane}], matchScale[{matchscale}], precision[{precision}], annCandidates[{anncandidates}]...')
+            stats = encoder.main(images, ntiles, seekrange, gop, quality, metadata, matcher=matcher, searchtiles=searchtiles,
+                                 motionsearch=motionsearch, zeromotion=zeromotion, backend=backend, scenecut=scenecut, prefilter=prefilter,
+                                 matchplane=matchplane, matchscale=matchscale, mingap=mingap, changethreshold=changethreshold,
+                                 cachedir=cachedir, anncandidates=anncandidates, annrecall=annrecall, precision=precision,
+                                 references=references, dedup=dedup, dedupdistance=dedupdistance, tileatlas=tileatlas)
             end_time = time.time()
             total_time = end_time - start_time
+            # Descodificar una copia para medir la calidad de las teselas escogidas (antes de renombrar los metadatos)
+            decoded_images = {file_name: image.copy() for file_name, image in images.items()}
+            decoder.main(decoded_images, metadata)
             
             click.echo('Guardant video en zip...')
             create_output.create_zip(output, images, metadata, is_encoded)
 
-            encode_info(input, output, total_time, original_images, images)
+            psnr = encoder.calculate_psnr(original_images, images)
+            decoded_psnr = encoder.calculate_psnr(original_images, decoded_images)
+            encode_info(input, output, total_time, psnr, stats, decoded_psnr)
         else:
             click.echo('Guardant video en zip...')
             create_output.create_zip(output, images, metadata, is_encoded)
@@ -120,7 +225,139 @@ def main(input, output, fps, filter, filter_help, ntiles, seekrange, gop, qualit
         reproduce_video.show_video(fps, images)
 
 
-def encode_info(input, output, total_time, original_images, images):
+def stream_encode(input, output, metadata, ntiles, seekrange, gop, quality, matcher='auto', searchtiles=None, motionsearch='full', zeromotion=False, backend='thread', scenecut=None, prefilter=False, matchplane='rgb', matchscale=1, mingap=None, changethreshold=None, cachedir=None, anncandidates=None, annrecall=False, realtime_fps=None, precision='float64', references=1, tileatlas=False):
+    """
+    Codifica un vídeo o GIF en flux: les imatges es llegeixen, es codifiquen i s'escriuen al ZIP GOP a GOP, de
+    manera que la memòria necessària depèn de la mida del GOP i no de la durada del vídeo. El PSNR es calcula
+    imatge a imatge a mesura que es completen els grups.
+
+    Args:
+        input (str): Ruta al fitxer d'entrada.
+        output (str): Ruta al fitxer ZIP de sortida.
+        metadata (dict): Metadades de l'encoder, amb els paràmetres de codificació.
+        ntiles (tuple): Nombre de tessel·les en els eixos horitzontal i vertical.
+        seekrange (int): Desplaçament màxim en la cerca de tessel·les coincidents.
+        gop (int): Nombre d'imatges entre dos frames de referència.
+        quality (float): Factor de qualitat per determinar quan dues tessel·les es consideren coincidents.
+        matcher (str): Motor de correspondència de tessel·les.
+        searchtiles (int): Distància màxima, en tessel·les, de les tessel·les de referència candidates.
+        motionsearch (str): Estratègia de cerca del desplaçament.
+        zeromotion (bool): Indica si s'accepta directament la tessel·la coubicada quan arriba a la qualitat.
+        backend (str): Forma d'executar les imatges P de cada GOP.
+        scenecut (float): Llindar de canvi d'escena per començar un GOP nou.
+        prefilter (bool): Indica si es descarten les parelles de tessel·les que no poden arribar a la qualitat.
+        matchplane (str): Pla on es busquen les tessel·les coincidents.
+        matchscale (int): Factor de reducció del pla de cerca.
+        mingap (float): Diferència mínima entre la millor correlació d'una tessel·la i la segona.
+        changethreshold (float): Diferència màxima amb la tessel·la de referència de la mateixa posició per acceptar-la sense cercar-la.
+        cachedir (str): Directori de la memòria cau de correlacions.
+        anncandidates (int): Nombre de tessel·les de referència candidates segons l'índex de descriptors.
+        annrecall (bool): Indica si es mesura el recall de l'índex.
+        realtime_fps (float): Imatges per segon del mode en temps real, o None per codificar sense límit de temps.
+        precision (str): Precisió de l'aritmètica de la cerca.
+        references (int): Nombre màxim d'imatges de referència de cada imatge P.
+        tileatlas (bool): Indica si les imatges P es guarden com a atles de les tessel·les no substituïdes.
+    """
+    originals = {}
+    psnr_values = []
+    decoded_psnr_values = []
+    stats = Counter()
+    # Teselas de las últimas imágenes de referencia decodificadas, que se conservan de un grupo al siguiente
+    reference_cache = OrderedDict()
+
+    def frames():
+        for file_name, image in read_input.iter_frames(input):
+            # Copia del original para el PSNR, que se libera cuando el grupo se ha escrito
+            originals[file_name] = image.copy()
+            yield file_name, image
+
+    def encoded_groups():
+        if realtime_fps is None:
+            encoded = encoder.encode_stream(frames(), ntiles, seekrange, gop, quality, metadata, matcher=matcher, searchtiles=searchtiles,
+                                            motionsearch=motionsearch, zeromotion=zeromotion, backend=backend, scenecut=scenecut,
+                                            prefilter=prefilter, matchplane=matchplane, matchscale=matchscale, mingap=mingap,
+                                            changethreshold=changethreshold, cachedir=cachedir, anncandidates=anncandidates,
+                                            annrecall=annrecall, precision=precision, references=references, tileatlas=tileatlas)
+        else:
+            # En tiempo real cada imagen se codifica en cuanto llega, sin backend paralelo ni caché
+            encoded = encoder.encode_realtime(frames(), ntiles, seekrange, gop, quality, metadata, realtime_fps, matcher=matcher,
+                                              searchtiles=searchtiles, motionsearch=motionsearch, zeromotion=zeromotion, scenecut=scenecut,
+                                              prefilter=prefilter, matchplane=matchplane, matchscale=matchscale, mingap=mingap,
+                                              changethreshold=changethreshold, anncandidates=anncandidates, annrecall=annrecall,
+                                              precision=precision, references=references, tileatlas=tileatlas)
+        for image_group, frames_info, group_stats in encoded:
+            stats.update(group_stats)
+            # Descodificar una copia del grupo para medir la calidad de las teselas escogidas
+            decoded_group = {file_name: image.copy() for file_name, image in image_group.items()}
+            decoder.main(decoded_group, {"encoder_parameters": metadata["encoder_parameters"], "frames": frames_info, "groups": [list(image_group.keys())]},
+                         reference_cache)
+            for file_name, image in image_group.items():
+                original_image = originals.pop(file_name)
+                psnr_values.append(encoder.calculate_frame_psnr(original_image, image))
+                decoded_psnr_values.append(encoder.calculate_frame_psnr(original_image, decoded_group[file_name]))
+            yield image_group
+
+    start_time = time.time()
+    click.echo(f'Executant codificació en flux: nTiles[{ntiles}], seekRange[{seekrange}], GOP[{gop}], sceneCut[{scenecut}], references[{references}], tileAtlas[{tileatlas}], quality[{quality}], minGap[{mingap}], changeThreshold[{changethreshold}], matcher[{matcher}], searchTiles[{searchtiles}], motionSearch[{motionsearch}], matchPlane[{matchplane}], matchScale[{matchscale}], precision[{precision}], annCandidates[{anncandidates}], realTime[{realtime_fps}]...')
+    create_output.create_zip_stream(output, encoded_groups(), metadata)
+    total_time = time.time() - start_time
+
+    encode_info(input, output, total_time, mean_psnr(psnr_values), stats, mean_psnr(decoded_psnr_values))
+
+
+def run_sweep(input, output, images, metadata, qualities, tiles_list, report_path, target_psnr, parameters, cachedir):
+    """
+    Executa el barreig de paràmetres, en mostra la taula i, si s'indica, guarda l'informe i el ZIP del punt escollit.
+
+    Args:
+        input (str): Ruta al fitxer d'entrada.
+        output (str): Ruta al fitxer ZIP de sortida del punt escollit, o None.
+        images (dict): Imatges d'entrada.
+        metadata (dict): Metadades de l'encoder.
+        qualities (tuple): Valors de qualitat.
+        tiles_list (tuple): Nombres de tessel·les (horitzontal, vertical).
+        report_path (str): Fitxer de l'informe (.csv o .json), o None.
+        target_psnr (float): PSNR mínim del punt escollit, o None.
+        parameters (dict): La resta d'arguments de encoder.main.
+        cachedir (str): Directori de la memòria cau de correlacions, o None per fer-ne servir un de temporal.
+    """
+    click.echo(f'Executant barreig de paràmetres: nTiles{list(tiles_list)}, quality{list(qualities)}...')
+    rows, chosen_zip = sweep.main(images, os.path.getsize(input), qualities, tiles_list, metadata, parameters, target_psnr, cachedir)
+
+    click.echo("nTiles    quality  tessel·les  mida ZIP (bytes)  ràtio  PSNR (dB)  PSNR desc. (dB)  temps (s)  cerca (s)")
+    for row in rows:
+        psnr = "-" if row["psnr"] is None else f"{row['psnr']:.2f}"
+        decoded_psnr = "-" if row["decoded_psnr"] is None else f"{row['decoded_psnr']:.2f}"
+        search_time = "-" if row["search_time"] is None else f"{row['search_time']:.2f}"
+        click.echo(f"{row['n_tiles_x']}x{row['n_tiles_y']:<6} {row['quality']:<8} {row['replaced_tiles']:<11} {row['zip_size']:<17} "
+                   f"{row['compression_ratio']:<6.2f} {psnr:<10} {decoded_psnr:<16} {row['encode_time']:<10.2f} {search_time}")
+    if report_path:
+        sweep.write_report(rows, report_path)
+        click.echo(f"Informe del barreig guardat a {report_path}.")
+    if output:
+        if chosen_zip is None:
+            click.echo(f"Cap punt arriba al PSNR mínim de {target_psnr} dB: no es guarda cap ZIP.")
+            return
+        with open(output, 'wb') as file:
+            file.write(chosen_zip)
+        click.echo(f"ZIP del punt escollit guardat a {output}.")
+
+
+def mean_psnr(psnr_values) -> float or None:
+    """
+    Calcula el PSNR mitjà de les imatges, ignorant les que són iguals a l'original (PSNR None), com encoder.calculate_psnr.
+
+    Args:
+        psnr_values (list): PSNR de cada imatge.
+
+    Returns:
+        float: PSNR mitjà, o None si totes les imatges són iguals a l'original.
+    """
+    psnr_values = [psnr for psnr in psnr_values if psnr is not None]
+    return np.mean(psnr_values) if psnr_values else None
+
+
+def encode_info(input, output, total_time, psnr, stats=None, decoded_psnr=None):
     """
     Calcula i mostra informació sobre la compressió després de l'operació de codificació.
 
@@ -128,6 +365,9 @@ def encode_info(input, output, total_time, original_images, images):
         input (str): Ruta al fitxer d'entrada.
         output (str): Ruta al fitxer de sortida.
         total_time (float): Temps total de processament en segons.
+        psnr (float): PSNR de les imatges codificades respecte a les originals, o None si són iguals.
+        stats (Counter): Estadístiques retornades per encoder.main.
+        decoded_psnr (float): PSNR de les imatges codificades i descodificades de nou, que mesura la qualitat de les coincidències.
     """
     original_zip_size = os.path.getsize(input)
     compressed_zip_size = os.path.getsize(output)
@@ -142,9 +382,43 @@ def encode_info(input, output, total_time, original_images, images):
         click.echo(f"Temps total de processament: {str(round(total_time,2))} segons.")
     click.echo(f"Ratio de compressió: {str(round(compression_ratio,2))}.")
     click.echo(f"Millora en l'espai ocupat per l'arxiu ZIP final: {str(round(improvement,2))}%")
-    psnr = encoder.calculate_psnr(original_images, images)
     if psnr is not None:
         click.echo(f"PSNR del vídeo comprimit: {str(round(psnr,2))} dB.")
     else:
         click.echo("No s'ha pogut calcular el PSNR ja que les imatges són iguals.")
+    if decoded_psnr is not None:
+        click.echo(f"PSNR del vídeo descodificat: {str(round(decoded_psnr,2))} dB.")
+    if stats:
+        encode_stats_info(stats)
 
+
+def encode_stats_info(stats):
+    """
+    Mostra les estadístiques de la cerca de tessel·les recollides durant la codificació.
+
+    Args:
+        stats (Counter): Estadístiques retornades per encoder.main.
+    """
+    if stats["prefilter_skipped"] or stats["prefilter_evaluated"]:
+        total_pairs = stats["prefilter_skipped"] + stats["prefilter_evaluated"]
+        click.echo(f"Parelles de tessel·les descartades pel prefiltre: {stats['prefilter_skipped']} de {total_pairs} "
+                   f"({round(stats['prefilter_skipped'] / total_pairs * 100, 2)}%); avaluades: {stats['prefilter_evaluated']}.")
+    if stats["cache_hits"] or stats["cache_misses"]:
+        click.echo(f"Imatges P recuperades de la memòria cau de correlacions: {stats['cache_hits']} de {stats['cache_hits'] + stats['cache_misses']}.")
+    if stats["deadline_hits"] or stats["deadline_misses"]:
+        total_frames = stats["deadline_hits"] + stats["deadline_misses"]
+        click.echo(f"Imatges codificades dins del temps màxim: {stats['deadline_hits']} de {total_frames} "
+                   f"({round(stats['deadline_hits'] / total_frames * 100, 2)}%); fora de temps: {stats['deadline_misses']}.")
+        click.echo(f"Imatges P amb la cerca degradada: {stats['degraded_frames']}; imatges de referència per retard: {stats['late_references']}.")
+    if stats["ann_recall_total"]:
+        click.echo(f"Recall de l'índex de veïns més propers: {stats['ann_recall_hits']} de {stats['ann_recall_total']} millors coincidències "
+                   f"({round(stats['ann_recall_hits'] / stats['ann_recall_total'] * 100, 2)}%) entre les candidates.")
+    if stats["static_tiles"]:
+        click.echo(f"Tessel·les resoltes per diferència amb la referència: {stats['static_tiles']} de {stats['tiles']} "
+                   f"({round(stats['static_tiles'] / stats['tiles'] * 100, 2)}%).")
+    if stats["duplicate_frames"]:
+        click.echo(f"Imatges repetides guardades només com a referència a una imatge anterior: {stats['duplicate_frames']}.")
+    if stats["earlier_reference_tiles"]:
+        click.echo(f"Tessel·les copiades d'imatges de referència de GOP anteriors: {stats['earlier_reference_tiles']}.")
+    if stats["gap_rejected"]:
+        click.echo(f"Tessel·les no substituïdes per no arribar a la diferència mínima amb la segona coincidència: {stats['gap_rejected']}.")
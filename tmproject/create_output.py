@@ -3,10 +3,13 @@ from zipfile import ZipFile
 from PIL import Image
 import io
 import json
+from tmproject import encoder
 
 def create_zip(output_path, images, metadata, is_encoded):
     """
     Crea un fitxer ZIP a la ruta especificada, guardant les imatges del diccionari global convertides a JPEG.
+    Les imatges repetides d'un vídeo codificat ("duplicate_of" a les metadades) no es guarden, i les imatges P amb
+    atles de teselles ("atlas") es guarden com a atles.
 
     Args:
         output_path (str): Ruta al fitxer ZIP de sortida.
@@ -14,22 +17,88 @@ def create_zip(output_path, images, metadata, is_encoded):
         metadata (dict): Metadades associades a les imatges.
         is_encoded (bool): Indica si els noms dels arxius en els metadades ja estan codificats.
     """
+    # Las imágenes repetidas solo existen en los metadatos (antes de que write_metadata cambie los nombres)
+    duplicates = set() if is_encoded else {frame['file_name'] for frame in metadata['frames'] if 'duplicate_of' in frame}
+    atlases = {} if is_encoded else atlas_layouts(metadata['frames'])
     with ZipFile(output_path, 'w') as zip_file:
-        for file_name, image_data in images.items():
-            # Convertir la imagen a formato JPEG
-            jpeg_image = image_to_jpeg(image_data)
-            # Obtener el nombre del archivo sin la extensión
-            file_name_without_extension = Path(file_name).stem
-            # Guardar la imagen en el zip
-            zip_file.writestr(f'{file_name_without_extension}.jpeg', jpeg_image)
+        write_images(zip_file, images, duplicates, atlases)
 
         if not is_encoded:
-            # Actualizar los nombres de archivo en los metadatos (.jpeg)
-            updated_metadata = update_metadata_file_names(metadata)
-            # Convertir los metadatos del encoder a formato JSON
-            metadata_json = json.dumps(updated_metadata, indent=4)
-            # Guardar el JSON de los metadatos en el zip
-            zip_file.writestr('encoder_metadata.json', metadata_json)
+            write_metadata(zip_file, metadata)
+
+
+def create_zip_stream(output_path, image_groups, metadata):
+    """
+    Crea un fitxer ZIP escrivint les imatges grup a grup, a mesura que arriben, de manera que no cal tenir-les
+    totes en memòria. Les metadades s'escriuen al final, quan ja estan completes.
+
+    Args:
+        output_path (str): Ruta al fitxer ZIP de sortida.
+        image_groups (iterable): Diccionaris d'imatges (nom d'arxiu, dades d'imatge), en ordre.
+        metadata (dict): Metadades de l'encoder, que s'acaben de completar quan s'esgota image_groups.
+    """
+    with ZipFile(output_path, 'w') as zip_file:
+        written_frames = 0
+        for images in image_groups:
+            # Cada grupo ya ha añadido sus fotogramas a los metadatos (sin ordenar hasta el final)
+            atlases = atlas_layouts(metadata['frames'][written_frames:])
+            written_frames = len(metadata['frames'])
+            write_images(zip_file, images, atlases=atlases)
+        write_metadata(zip_file, metadata)
+
+
+def atlas_layouts(frames) -> dict:
+    """
+    Recull la disposició de l'atles de teselles de les imatges P que en tenen.
+
+    Args:
+        frames (list): Informació dels fotogrames.
+
+    Returns:
+        dict: Disposició de l'atles de cada imatge, pel seu nom de fitxer.
+    """
+    return {frame['file_name']: frame['atlas'] for frame in frames if 'atlas' in frame}
+
+
+def write_images(zip_file, images, skipped=(), atlases=None):
+    """
+    Guarda les imatges en un fitxer ZIP obert, convertides a JPEG.
+
+    Args:
+        zip_file (ZipFile): Fitxer ZIP obert en mode escriptura.
+        images (dict): Diccionari on les claus són noms d'arxiu i els valors són dades d'imatge.
+        skipped (set): Noms de les imatges que no s'han de guardar.
+        atlases (dict): Disposició de l'atles de teselles de les imatges que s'han de guardar com a atles.
+    """
+    atlases = atlases or {}
+    for file_name, image_data in images.items():
+        if file_name in skipped:
+            continue
+        if file_name in atlases:
+            # Guardar solo las teselas que no se han sustituido
+            image_data = encoder.pack_tile_atlas(image_data, atlases[file_name])
+        # Convertir la imagen a formato JPEG
+        jpeg_image = image_to_jpeg(image_data)
+        # Obtener el nombre del archivo sin la extensión
+        file_name_without_extension = Path(file_name).stem
+        # Guardar la imagen en el zip
+        zip_file.writestr(f'{file_name_without_extension}.jpeg', jpeg_image)
+
+
+def write_metadata(zip_file, metadata):
+    """
+    Guarda les metadades de l'encoder en un fitxer ZIP obert, amb els noms de fitxer actualitzats a .jpeg.
+
+    Args:
+        zip_file (ZipFile): Fitxer ZIP obert en mode escriptura.
+        metadata (dict): Metadades de l'encoder.
+    """
+    # Actualizar los nombres de archivo en los metadatos (.jpeg)
+    updated_metadata = update_metadata_file_names(metadata)
+    # Convertir los metadatos del encoder a formato JSON
+    metadata_json = json.dumps(updated_metadata, indent=4)
+    # Guardar el JSON de los metadatos en el zip
+    zip_file.writestr('encoder_metadata.json', metadata_json)
 
 
 def update_metadata_file_names(metadata) -> dict:
@@ -45,6 +114,15 @@ def update_metadata_file_names(metadata) -> dict:
     for frame in metadata['frames']:    
         file_name_without_extension = Path(frame['file_name']).stem
         frame['file_name'] = f'{file_name_without_extension}.jpeg'
+        if 'duplicate_of' in frame:
+            frame['duplicate_of'] = f"{Path(frame['duplicate_of']).stem}.jpeg"
+        # Las teselas copiadas de un GOP anterior nombran su imagen de referencia
+        for tile in frame.get('tiles', []):
+            if 'ref_frame' in tile:
+                tile['ref_frame'] = f"{Path(tile['ref_frame']).stem}.jpeg"
+    # Los grupos de imágenes también se guardan por nombre de archivo
+    if 'groups' in metadata:
+        metadata['groups'] = [[f'{Path(file_name).stem}.jpeg' for file_name in group] for group in metadata['groups']]
     return metadata
 
 
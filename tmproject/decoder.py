@@ -1,21 +1,36 @@
+from collections import OrderedDict
 from tqdm.auto import tqdm
 from tmproject import encoder
 
-def main(images, metadata):
+def main(images, metadata, reference_cache=None):
     """
-    Descodifica els grups d'imatges a partir de la informació de les metadades.
+    Descodifica els grups d'imatges a partir de la informació de les metadades. Les imatges repetides ("duplicate_of")
+    passen a ser la mateixa matriu que la imatge de la qual són còpia, sense copiar-la. Si no eren al diccionari
+    (perquè no es guarden al ZIP), s'hi afegeixen i el diccionari queda en l'ordre dels noms dels fitxers, com el
+    llegeix read_input.open_zip.
 
     Args:
         images (dict): Diccionari amb les imatges.
         metadata (dict): Metadades del encoder que contenen els paràmetres i la informació dels frames.
+        reference_cache (OrderedDict): Teselles de les darreres imatges de referència, per a les teselles que vénen d'un
+            GOP anterior ("ref_frame"). Es pot passar d'una crida a la següent per descodificar un vídeo GOP a GOP.
+            Si és None, se'n crea una de nova.
     """
     # Obtener los parámetros necesarios del metadata
     gop_size = metadata["encoder_parameters"]["gop"]
     ntiles = (metadata["encoder_parameters"]["n_tiles_x"], metadata["encoder_parameters"]["n_tiles_y"])
+    # Como en el encoder, solo se guardan las últimas imágenes de referencia
+    references = metadata["encoder_parameters"].get("references", 1)
     frames = metadata["frames"]
+    if reference_cache is None:
+        reference_cache = OrderedDict()
 
-    # Dividir las imágenes en grupos según el GOP
-    image_groups = encoder.split_images_into_groups(images, gop_size)
+    if "groups" in metadata:
+        # Usar los grupos que ha escogido el encoder
+        image_groups = [{file_name: images[file_name] for file_name in group} for group in metadata["groups"]]
+    else:
+        # Ficheros antiguos sin grupos: dividir las imágenes en grupos según el GOP
+        image_groups = encoder.split_images_into_groups(images, gop_size)
 
     # Inicializar la barra de progreso para los grupos de imágenes
     for image_group in tqdm(image_groups, desc="Descodificant grups d'imatges"):
@@ -29,7 +44,11 @@ def main(images, metadata):
 
             if frame["reference_frame"]:
                 reference_image = images[file_name]
-                ref_tiles = encoder.subdivide_image_into_tiles(reference_image, tile_height, tile_width, ntiles)
+                # Vista en cuadrícula de la imagen de referencia, sin copiarla
+                ref_tiles = encoder.tile_grid(reference_image, tile_height, tile_width, ntiles)
+                reference_cache[file_name] = ref_tiles
+                while len(reference_cache) > references:
+                    reference_cache.popitem(last=False)
             else:
                 for tile_info in frame["tiles"]:
                     # Obtener información de la tesela
@@ -41,10 +60,21 @@ def main(images, metadata):
                     ref_tile_height = tile_height if y + tile_height <= height else height - y
                     ref_tile_width = tile_width if x + tile_width <= width else width - x
 
-                    # Obtener la tesela de referencia
-                    reference_tile = ref_tiles[tb_id][:ref_tile_height, :ref_tile_width]
+                    # Obtener la tesela de referencia, de la imagen de referencia del grupo o de la que indique la tesela
+                    tiles = reference_cache[tile_info["ref_frame"]] if "ref_frame" in tile_info else ref_tiles
+                    reference_tile = tiles[tb_id][:ref_tile_height, :ref_tile_width]
                     images[file_name][y:y+ref_tile_height, x:x+ref_tile_width] = reference_tile
 
+    # Las imágenes repetidas no se guardan: apuntan a la imagen ya descodificada de la que son copia
+    duplicates = {frame["file_name"]: frame["duplicate_of"] for frame in frames if "duplicate_of" in frame}
+    missing = [file_name for file_name in duplicates if file_name not in images]
+    for file_name, original_name in duplicates.items():
+        images[file_name] = images[original_name]
+    if missing:
+        # Las imágenes leídas del ZIP están en el orden de los nombres de archivo: colocar las que faltaban en su sitio
+        for file_name in sorted(images):
+            images[file_name] = images.pop(file_name)
+
 def get_frame_by_file_name(frames, file_name) -> dict or None:
     """
     Obté la informació del fotograma corresponent al nom del fitxer donat.
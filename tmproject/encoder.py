@@ -1,133 +1,1463 @@
 import numpy as np
+import hashlib
+import json
 import multiprocessing
+import os
+import time
+import tempfile
+from collections import Counter, OrderedDict
+from contextlib import nullcontext
+from multiprocessing import shared_memory
 from numpy import ndarray
 from tqdm.auto import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from tmproject import matchers
 
-def main(images, ntiles, seekrange, gop, quality, metadata):
+BACKEND_NAMES = ('serial', 'thread', 'process')
+MATCH_PLANES = ('rgb', 'luma')
+# Detecció d'imatges repetides: còpia exacta o hash perceptiu dins d'una distància de Hamming
+DEDUP_MODES = ('exact', 'perceptual')
+# Nombre de bits a 1 de cada byte, per a la distància de Hamming sense np.bitwise_count
+POPCOUNT_TABLE = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+# Nivell màxim de degradació del mode en temps real (vegeu realtime_parameters)
+REALTIME_MAX_LEVEL = 3
+# Versió del format de la memòria cau de correlacions; canviar-la invalida les entrades anteriors
+CORRELATION_CACHE_VERSION = 2
+# Pesos de la luminancia (BT.601) de una imagen RGB
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+# Mida dels blocs del JPEG, a la qual s'arrodoneixen les cel·les dels atles de teselles
+ATLAS_BLOCK = 8
+# Fracció màxima dels píxels de la imatge que pot tenir un atles de teselles: amb més cel·les, les vores entre
+# teselles que no eren veïnes costen més bytes del JPEG que els que s'estalvien
+ATLAS_MAX_RATIO = 0.5
+
+
+def main(images, ntiles, seekrange, gop, quality, metadata, backend='thread', scenecut=None, references=1, dedup=None, dedupdistance=0, tileatlas=False, **search_options):
     """
     Processa les imatges per a la codificació, dividint-les en grups segons el GOP (Group of Pictures) 
     i aplicant els paràmetres especificats per a la codificació.
+    Com que cada imatge P només es compara amb la imatge de referència del seu grup, la feina es reparteix per
+    imatges P (i no per grups), i els resultats s'apliquen després en l'ordre de les imatges, de manera que la
+    sortida és la mateixa amb qualsevol backend.
 
     Args:
         images (dict): Diccionari amb les imatges.
-        ntiles (tuple): Nombre de teselles en els eixos vertical i horitzontal.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
         seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
         gop (int): Mida del GOP.
         quality (float): Factor de qualitat per determinar la coincidència de teselles.
         metadata (dict): Diccionari per emmagatzemar la informació dels fotogrames i els paràmetres de codificació.
+        backend (str): Forma d'executar la codificació: 'serial', 'thread' (fils) o 'process' (processos amb memòria compartida).
+        scenecut (float): Llindar de canvi d'escena per començar un GOP nou abans d'arribar a la mida màxima. Si és None, els GOP tenen mida fixa.
+        references (int): Nombre màxim d'imatges de referència de cada imatge P: la del seu GOP i, si és més d'1, les dels GOP anteriors més recents.
+        dedup (str): Detecció d'imatges repetides ('exact' o 'perceptual'). Les repeticions no es codifiquen: a les metadades
+            només porten el nom de la imatge anterior de la qual són còpia ("duplicate_of") i al diccionari passen a ser
+            la mateixa matriu. Si és None, no es busquen.
+        dedupdistance (int): Distància de Hamming màxima entre els hash perceptius de dues imatges per considerar-les repetides.
+        tileatlas (bool): Afegeix a la informació de les imatges P amb teselles substituïdes la disposició de l'atles de
+            teselles ("atlas"), perquè es guardin només amb les teselles que no s'han substituït (vegeu pack_tile_atlas).
+        search_options: Altres paràmetres de la cerca de teselles (matcher, motionsearch, precision...), amb els noms i
+            els valors per defecte de search_parameters.
+
+    Returns:
+        Counter: Estadístiques de la codificació (per exemple, les parelles descartades pel prefiltre).
     """
-    # Dividir las imágenes en grupos según el GOP
-    image_groups = split_images_into_groups(images, gop)
-    num_processors = multiprocessing.cpu_count()
-    thread_limit = num_processors
-    #thread_limit = num_processors // 2
-
-    with tqdm(total=len(image_groups), desc="Processant grups d'imatges") as pbar:
-        with ThreadPoolExecutor(max_workers=thread_limit) as executor:
-            futures = []
-            for index, image_group in enumerate(image_groups):
-                future = executor.submit(process_image_group, image_group, ntiles, seekrange, quality, images, metadata, index)
-                futures.append(future)
-                
-            for future in as_completed(futures):
-                future.result()
-                pbar.update(1)
-    pbar.close()
+    # Las imágenes repetidas no se buscan ni se guardan: apuntan a la imagen de la que son copia
+    duplicates = find_duplicate_frames(images, dedup, dedupdistance) if dedup is not None else {}
+    unique_images = {file_name: image for file_name, image in images.items() if file_name not in duplicates}
+    # Dividir las imágenes en grupos según el GOP y, si se pide, los cambios de escena
+    image_groups = split_images_into_groups(unique_images, gop, scenecut)
+    # Guardar los grupos para que el decoder no tenga que suponer su tamaño
+    metadata["groups"] = [list(image_group.keys()) for image_group in image_groups]
+    parameters = search_parameters(ntiles, seekrange, quality, **search_options)
+
+    results = encode_groups(image_groups, unique_images, parameters, backend, references=references)
+
+    # Fusionar los resultados en el orden de los grupos
+    stats = Counter()
+    for frames_info, replacements, group_stats in results:
+        metadata["frames"].extend(frames_info)
+        apply_replacements(images, replacements, ntiles)
+        if tileatlas:
+            add_tile_atlases(frames_info, images, replacements, ntiles)
+        stats.update(group_stats)
+    for file_name, original_name in duplicates.items():
+        images[file_name] = images[original_name]
+        metadata["frames"].append({"file_name": file_name, "duplicate_of": original_name})
+    stats["duplicate_frames"] += len(duplicates)
     # Ordenar los metadatos por nombre de archivo
     metadata["frames"].sort(key=lambda x: x["file_name"])
+    return stats
+
+
+def search_parameters(ntiles, seekrange, quality, matcher='auto', searchtiles=None, motionsearch='full', zeromotion=False, prefilter=False, matchplane='rgb', matchscale=1, mingap=None, changethreshold=None, cachedir=None, anncandidates=None, annrecall=False, precision='float64') -> dict:
+    """
+    Agrupa els paràmetres de la cerca de teselles de les imatges P, amb els seus valors per defecte. Els fan servir
+    main, encode_stream i encode_realtime, i es passen per nom a process_image_group i process_predicted_frame.
+
+    Args:
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        quality (float): Factor de qualitat per determinar la coincidència de teselles.
+        matcher (str): Motor de correspondència de teselles ('auto', 'roll', 'fft', 'opencv', 'gemm' o 'numba').
+        searchtiles (int): Distància màxima, en teselles, entre la tesela actual i les de referència candidates. Si és None, la cerca és exhaustiva.
+        motionsearch (str): Estratègia de cerca del desplaçament ('full', 'threestep', 'diamond', 'pyramid' o 'predictive').
+        zeromotion (bool): Accepta directament la tesela coubicada sense desplaçament quan arriba a la qualitat, sense cercar-ne d'altres.
+        prefilter (bool): Descarta, abans de calcular-ne la correlació, les parelles de teselles que segur que no arriben a la qualitat.
+        matchplane (str): Pla on es fa la cerca de teselles: la imatge en color ('rgb') o només la seva luminància ('luma').
+        matchscale (int): Factor de reducció del pla de cerca. Les coincidències s'apliquen igualment a les imatges originals.
+        mingap (float): Diferència mínima entre la millor correlació d'una tesela i la segona per acceptar-la. Si és None, n'hi ha prou amb la millor.
+        changethreshold (float): Diferència absoluta mitjana amb la tesela de la referència a la mateixa posició per sota de la qual es dona per coincident sense cercar-la. Si és None, no es fa servir.
+        cachedir (str): Directori de la memòria cau de correlacions. Si una imatge P ja s'hi troba, amb els mateixos paràmetres de cerca, no es torna a cercar. Si és None, no es fa servir.
+        anncandidates (int): Nombre de teselles de referència candidates per tesela, triades amb l'índex de veïns més propers dels descriptors. Si és None, no es fa servir.
+        annrecall (bool): Mesura quantes de les millors coincidències de la cerca sense índex hi ha entre les candidates de l'índex.
+        precision (str): Precisió de l'aritmètica de la cerca: 'float64', 'float32' o 'uint8' (teselles de 8 bits amb estadístiques enteres).
+
+    Returns:
+        dict: Paràmetres de la cerca, amb els noms dels arguments de process_predicted_frame.
+    """
+    return dict(ntiles=ntiles, seekrange=seekrange, quality=quality, matcher=matcher, searchtiles=searchtiles, motionsearch=motionsearch,
+                zeromotion=zeromotion, prefilter=prefilter, matchplane=matchplane, matchscale=matchscale, mingap=mingap,
+                changethreshold=changethreshold, cachedir=cachedir, anncandidates=anncandidates, annrecall=annrecall, precision=precision)
+
+
+def encode_stream(frames, ntiles, seekrange, gop, quality, metadata, backend='thread', scenecut=None, references=1, tileatlas=False, **search_options):
+    """
+    Versió en flux de main: consumeix les imatges d'un iterador i només en manté en memòria el GOP actual.
+    Cada vegada que acaba un GOP, en retorna les imatges ja codificades perquè es puguin escriure i alliberar.
+    Les metadades es completen a mesura que avancen els grups, i s'ordenen quan s'acaba el flux.
+
+    Args:
+        frames (iterable): Parelles (nom del fitxer, imatge), en ordre.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        gop (int): Mida (màxima) del GOP.
+        quality (float): Factor de qualitat per determinar la coincidència de teselles.
+        metadata (dict): Diccionari per emmagatzemar la informació dels fotogrames i els paràmetres de codificació.
+        backend (str): Forma d'executar les imatges P de cada GOP: 'serial', 'thread' (fils) o 'process' (processos amb memòria compartida, amb un sol pool per a tot el flux).
+        scenecut (float): Llindar de canvi d'escena per començar un GOP nou abans d'arribar a la mida màxima. Si és None, els GOP tenen mida fixa.
+        references (int): Nombre màxim d'imatges de referència de cada imatge P: la del seu GOP i, si és més d'1, les dels GOP anteriors més recents.
+        tileatlas (bool): Afegeix a la informació de les imatges P la disposició de l'atles de teselles (vegeu main).
+        search_options: Altres paràmetres de la cerca de teselles, com a search_parameters.
+
+    Yields:
+        dict: Imatges codificades del GOP, en ordre.
+        list: Informació dels fotogrames del GOP.
+        Counter: Estadístiques de la codificació del GOP.
+    """
+    parameters = search_parameters(ntiles, seekrange, quality, **search_options)
+    metadata.setdefault("groups", [])
+    # Imágenes de referencia de los GOP anteriores que aún pueden usarse, de la más antigua a la más reciente
+    earlier_references = {}
+    # Teselas de las últimas imágenes de referencia, que los GOP siguientes reutilizan
+    stack_cache = OrderedDict()
+    # Un solo pool de procesos para todo el flujo: crearlo en cada GOP costaría más que las pocas imágenes P del grupo
+    with ProcessPoolExecutor(max_workers=multiprocessing.cpu_count()) if backend == 'process' else nullcontext() as executor:
+        for index, image_group in enumerate(iter_image_groups(frames, gop, scenecut)):
+            [(frames_info, replacements, stats)] = encode_groups([image_group], {**earlier_references, **image_group}, parameters, backend, index,
+                                                                references, earlier_references, executor, stack_cache)
+            metadata["frames"].extend(frames_info)
+            metadata["groups"].append(list(image_group.keys()))
+            apply_replacements(image_group, replacements, ntiles)
+            if tileatlas:
+                add_tile_atlases(frames_info, image_group, replacements, ntiles)
+            remember_reference(earlier_references, image_group, references)
+            yield image_group, frames_info, stats
+    # Ordenar los metadatos por nombre de archivo, como main
+    metadata["frames"].sort(key=lambda x: x["file_name"])
+
+
+def encode_realtime(frames, ntiles, seekrange, gop, quality, metadata, fps, scenecut=None, references=1, tileatlas=False, **search_options):
+    """
+    Versió en temps real de encode_stream: les imatges es codifiquen una a una, en ordre, amb un temps màxim de
+    1/fps segons per imatge. Quan una imatge arriba tard, les següents es busquen amb un nivell de degradació més
+    alt (vegeu realtime_parameters), i quan van sobrades de temps se'n torna a baixar. Si una imatge arriba tard
+    fins i tot amb la màxima degradació, la següent s'emet com a imatge de referència, que no cal buscar.
+
+    Args:
+        frames (iterable): Parelles (nom del fitxer, imatge), en ordre.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents, sense degradació.
+        gop (int): Mida (màxima) del GOP.
+        quality (float): Factor de qualitat per determinar la coincidència de teselles.
+        metadata (dict): Diccionari per emmagatzemar la informació dels fotogrames i els paràmetres de codificació.
+        fps (float): Imatges per segon del flux, que fixen el temps màxim per imatge.
+        scenecut (float): Llindar de canvi d'escena per començar un GOP nou abans d'arribar a la mida màxima. Si és None, els GOP tenen mida fixa.
+        references (int): Nombre màxim d'imatges de referència de cada imatge P: la del seu GOP i, si és més d'1, les dels GOP anteriors més recents.
+        tileatlas (bool): Afegeix a la informació de les imatges P la disposició de l'atles de teselles (vegeu main).
+        search_options: Altres paràmetres de la cerca de teselles, com a search_parameters, sense degradació i sense
+            memòria cau (cachedir).
+
+    Yields:
+        dict: Imatges codificades del GOP, en ordre.
+        list: Informació dels fotogrames del GOP.
+        Counter: Estadístiques de la codificació del GOP, amb les imatges dins i fora de temps.
+    """
+    parameters = search_parameters(ntiles, seekrange, quality, **search_options)
+    if parameters["cachedir"] is not None:
+        raise ValueError("El mode en temps real no fa servir la memòria cau de correlacions")
+    motionsearch, matchplane, matchscale, precision = (parameters[name] for name in ("motionsearch", "matchplane", "matchscale", "precision"))
+    budget = 1 / fps
+    metadata.setdefault("groups", [])
+    image_group, frames_info, replacements, stats = {}, [], {}, Counter()
+    level = 0
+    late_reference = False
+    previous_signature = None
+    earlier_references = {}
+    # Teselas de las últimas imágenes de referencia, para cada resolución de búsqueda
+    stack_caches = {}
+
+    for file_name, image in frames:
+        start_time = time.perf_counter()
+        scene_change = False
+        if scenecut is not None:
+            signature = frame_signature(image)
+            scene_change = previous_signature is not None and signature_distance(previous_signature, signature) > scenecut
+            previous_signature = signature
+
+        if not image_group or len(image_group) == gop or scene_change or late_reference:
+            if image_group:
+                remember_reference(earlier_references, image_group, references)
+                suspended_time = time.perf_counter()
+                yield finish_realtime_group(image_group, frames_info, replacements, stats, metadata, ntiles, tileatlas)
+                # El tiempo que tarda el consumidor en guardar el grupo no cuenta para esta imagen
+                start_time += time.perf_counter() - suspended_time
+            image_group, frames_info, replacements, stats = {file_name: image}, [{"file_name": file_name, "reference_frame": True}], {}, Counter()
+            if late_reference:
+                stats["late_references"] += 1
+            # Teselas de referencia de cada resolución de búsqueda, calculadas la primera vez que se necesitan
+            reference_stacks, earlier_stacks = {}, {}
+            reference_stacks[matchscale], earlier_stacks[matchscale] = group_tile_stacks(stack_caches.setdefault(matchscale, OrderedDict()), file_name, image,
+                                                                                         earlier_references, ntiles, matchplane, matchscale, precision)
+            # La reducción del plano de búsqueda solo se aplica si las teselas reducidas tienen al menos un píxel
+            max_level = realtime_max_level(image.shape, ntiles, matchscale)
+            level = min(level, max_level)
+            motionfield = np.zeros((ntiles[1], ntiles[0], 2), dtype=int) if motionsearch == 'predictive' else None
+            late_reference = False
+        else:
+            frame_parameters = realtime_parameters(parameters, level)
+            frame_scale = frame_parameters["matchscale"]
+            if frame_scale not in reference_stacks:
+                reference_name, reference_image = next(iter(image_group.items()))
+                reference_stacks[frame_scale], earlier_stacks[frame_scale] = group_tile_stacks(stack_caches.setdefault(frame_scale, OrderedDict()), reference_name,
+                                                                                               reference_image, earlier_references, ntiles, matchplane, frame_scale, precision)
+            frame_info, replacement, frame_stats = process_predicted_frame(file_name, image, reference_stacks[frame_scale], motionfield=motionfield,
+                                                                           earlier_stacks=earlier_stacks[frame_scale], **frame_parameters)
+            image_group[file_name] = image
+            frames_info.append(frame_info)
+            if replacement is not None:
+                replacements[file_name] = replacement
+            stats.update(frame_stats)
+            if level > 0:
+                stats["degraded_frames"] += 1
+
+        # Ajustar la degradación de las siguientes imágenes según el tiempo de esta
+        elapsed = time.perf_counter() - start_time
+        if elapsed <= budget:
+            stats["deadline_hits"] += 1
+            if elapsed < budget / 2 and level > 0:
+                level -= 1
+        else:
+            stats["deadline_misses"] += 1
+            if level < max_level:
+                level += 1
+            else:
+                late_reference = True
+
+    if image_group:
+        yield finish_realtime_group(image_group, frames_info, replacements, stats, metadata, ntiles, tileatlas)
+    # Ordenar los metadatos por nombre de archivo, como main
+    metadata["frames"].sort(key=lambda x: x["file_name"])
+
+
+def finish_realtime_group(image_group, frames_info, replacements, stats, metadata, ntiles, tileatlas=False) -> tuple[dict, list, Counter]:
+    """
+    Tanca un GOP del mode en temps real: n'afegeix la informació a les metadades i en substitueix les teselles.
+
+    Args:
+        image_group (dict): Imatges del GOP, en ordre.
+        frames_info (list): Informació dels fotogrames del GOP.
+        replacements (dict): Teselles a substituir de cada imatge P.
+        stats (Counter): Estadístiques del GOP.
+        metadata (dict): Metadades de l'encoder.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        tileatlas (bool): Afegeix a la informació de les imatges P la disposició de l'atles de teselles.
+
+    Returns:
+        tuple: Imatges codificades, informació dels fotogrames i estadístiques del GOP.
+    """
+    metadata["frames"].extend(frames_info)
+    metadata["groups"].append(list(image_group.keys()))
+    apply_replacements(image_group, replacements, ntiles)
+    if tileatlas:
+        add_tile_atlases(frames_info, image_group, replacements, ntiles)
+    return image_group, frames_info, stats
+
+
+def realtime_parameters(parameters, level) -> dict:
+    """
+    Retorna els paràmetres de process_predicted_frame degradats fins al nivell indicat. Cada nivell afegeix una
+    degradació a les anteriors: 1 redueix el seekRange a la meitat, 2 limita les teselles de referència candidates
+    a les veïnes i 3 busca sobre un pla de cerca reduït el doble (si les teselles ho permeten, vegeu realtime_max_level).
+
+    Args:
+        parameters (dict): Paràmetres sense degradar.
+        level (int): Nivell de degradació, de 0 a REALTIME_MAX_LEVEL.
+
+    Returns:
+        dict: Paràmetres degradats.
+    """
+    degraded = dict(parameters)
+    if level >= 1:
+        degraded["seekrange"] = parameters["seekrange"] // 2
+    if level >= 2:
+        degraded["searchtiles"] = min(parameters["searchtiles"], 1) if parameters["searchtiles"] is not None else 1
+    if level >= 3:
+        degraded["matchscale"] = parameters["matchscale"] * 2
+    return degraded
+
+
+def realtime_max_level(shape, ntiles, matchscale) -> int:
+    """
+    Retorna el nivell de degradació màxim del mode en temps real per a unes imatges: REALTIME_MAX_LEVEL si les teselles
+    del pla de cerca es poden reduir el doble, i un nivell menys si no.
+
+    Args:
+        shape (tuple): Forma de les imatges.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        matchscale (int): Factor de reducció del pla de cerca, sense degradació.
+
+    Returns:
+        int: Nivell de degradació màxim.
+    """
+    height, width = shape[:2]
+    if height // ntiles[1] // (2 * matchscale) == 0 or width // ntiles[0] // (2 * matchscale) == 0:
+        return REALTIME_MAX_LEVEL - 1
+    return REALTIME_MAX_LEVEL
+
+
+def remember_reference(earlier_references, image_group, references):
+    """
+    Afegeix la imatge de referència d'un GOP a les dels GOP anteriors, i n'oblida les més antigues de manera que
+    no se'n guardin mai més de references - 1.
+
+    Args:
+        earlier_references (dict): Imatges de referència dels GOP anteriors, de la més antiga a la més recent. S'actualitza.
+        image_group (dict): Imatges del GOP, en ordre.
+        references (int): Nombre màxim d'imatges de referència de cada imatge P.
+    """
+    reference_name = next(iter(image_group))
+    earlier_references[reference_name] = image_group[reference_name]
+    while len(earlier_references) > references - 1:
+        del earlier_references[next(iter(earlier_references))]
+
+
+def group_references(image_groups, references, earlier_references=None) -> list:
+    """
+    Retorna, per a cada grup, les imatges de referència dels GOP anteriors que poden fer servir les seves imatges P.
+
+    Args:
+        image_groups (list): Grups d'imatges, en ordre.
+        references (int): Nombre màxim d'imatges de referència de cada imatge P.
+        earlier_references (dict): Imatges de referència dels GOP anteriors al primer grup, de la més antiga a la més recent.
+
+    Returns:
+        list: Per a cada grup, les imatges de referència anteriors (de la més antiga a la més recent).
+    """
+    history = dict(earlier_references or {})
+    group_earlier = []
+    for image_group in image_groups:
+        group_earlier.append(dict(history))
+        remember_reference(history, image_group, references)
+    return group_earlier
+
+
+def encode_groups(image_groups, images, parameters, backend, first_index=0, references=1, earlier_references=None, executor=None, stack_cache=None) -> list:
+    """
+    Codifica els grups d'imatges amb el backend indicat, sense modificar les imatges.
+
+    Args:
+        image_groups (list): Grups d'imatges.
+        images (dict): Diccionari amb totes les imatges dels grups i les imatges de referència anteriors.
+        parameters (dict): Paràmetres de codificació, amb els noms dels arguments de process_predicted_frame.
+        backend (str): Forma d'executar la codificació: 'serial', 'thread' (fils) o 'process' (processos amb memòria compartida).
+        first_index (int): Índex del primer grup, per a les barres de progrés.
+        references (int): Nombre màxim d'imatges de referència de cada imatge P.
+        earlier_references (dict): Imatges de referència dels GOP anteriors al primer grup, de la més antiga a la més recent.
+        executor (ProcessPoolExecutor): Pool de processos ja creat per al backend 'process', que es pot reutilitzar d'una
+            crida a la següent. Si és None, se'n crea un per a aquesta crida.
+        stack_cache (OrderedDict): Teselles de les darreres imatges de referència dels backends 'serial' i 'thread', que es
+            poden reutilitzar d'una crida a la següent (vegeu group_tile_stacks). Si és None, se'n crea una per a aquesta crida.
+
+    Returns:
+        list: Informació dels fotogrames, teselles a substituir i estadístiques de cada grup, en l'ordre dels grups.
+    """
+    group_earlier = group_references(image_groups, references, earlier_references)
+    if stack_cache is None:
+        stack_cache = OrderedDict()
+    if backend == 'serial':
+        return [process_image_group(image_group, group_index=index, earlier_references=earlier, stack_cache=stack_cache, **parameters)
+                for index, (image_group, earlier) in enumerate(zip(tqdm(image_groups, desc="Processant grups d'imatges"), group_earlier), first_index)]
+    elif backend == 'thread':
+        return process_frames_threads(image_groups, parameters, group_earlier, stack_cache)
+    elif backend == 'process':
+        return process_frames_processes(image_groups, images, parameters, group_earlier, executor)
+    else:
+        raise ValueError(f"Backend desconegut: {backend}")
 
 
-def process_image_group(image_group, ntiles, seekrange, quality, images, metadata, group_index):
+def process_image_group(image_group, ntiles, seekrange, quality, group_index, matcher='auto', searchtiles=None, motionsearch='full', zeromotion=False, prefilter=False, matchplane='rgb', matchscale=1, mingap=None, changethreshold=None, cachedir=None, anncandidates=None, annrecall=False, precision='float64', earlier_references=None, stack_cache=None) -> tuple[list, dict, Counter]:
     """
     Processa un grup d'imatges, dividint-les en teselles i aplicant l'algorisme de correlació per a la codificació.
+    No modifica les imatges: retorna la informació dels fotogrames i les teselles a substituir de cada imatge P.
 
     Args:
         image_group (dict): Grup d'imatges a processar.
-        ntiles (tuple): Nombre de teselles en els eixos vertical i horitzontal.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
         seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
         quality (float): Factor de qualitat per determinar la coincidència de teselles.
-        images (dict): Diccionari amb les imatges.
-        metadata (dict): Diccionari per emmagatzemar la informació dels fotogrames i els paràmetres de codificació.
         group_index (int): Índex del grup d'imatges.
+        matcher (str): Motor de correspondència de teselles ('auto', 'roll', 'fft', 'opencv', 'gemm' o 'numba').
+        searchtiles (int): Distància màxima, en teselles, entre la tesela actual i les de referència candidates. Si és None, la cerca és exhaustiva.
+        motionsearch (str): Estratègia de cerca del desplaçament ('full', 'threestep', 'diamond', 'pyramid' o 'predictive').
+        zeromotion (bool): Accepta directament la tesela coubicada sense desplaçament quan arriba a la qualitat, sense cercar-ne d'altres.
+        prefilter (bool): Descarta les parelles de teselles la cota de correlació de les quals no arriba a la qualitat.
+        matchplane (str): Pla on es fa la cerca de teselles ('rgb' o 'luma').
+        matchscale (int): Factor de reducció del pla de cerca.
+        mingap (float): Diferència mínima entre la millor correlació d'una tesela i la segona per acceptar-la. Si és None, n'hi ha prou amb la millor.
+        changethreshold (float): Diferència absoluta mitjana amb la tesela de la referència a la mateixa posició per sota de la qual es dona per coincident sense cercar-la. Si és None, no es fa servir.
+        cachedir (str): Directori de la memòria cau de correlacions. Si una imatge P ja s'hi troba, amb els mateixos paràmetres de cerca, no es torna a cercar. Si és None, no es fa servir.
+        anncandidates (int): Nombre de teselles de referència candidates per tesela, triades amb l'índex de veïns més propers dels descriptors. Si és None, no es fa servir.
+        annrecall (bool): Mesura quantes de les millors coincidències de la cerca sense índex hi ha entre les candidates de l'índex.
+        precision (str): Precisió de l'aritmètica de la cerca: 'float64', 'float32' o 'uint8' (teselles de 8 bits amb estadístiques enteres).
+        earlier_references (dict): Imatges de referència dels GOP anteriors que també poden fer servir les imatges P, de la més antiga a la més recent.
+        stack_cache (OrderedDict): Teselles de les darreres imatges de referència, per reutilitzar-les d'un GOP al
+            següent (vegeu group_tile_stacks). Si és None, es calculen totes.
+
+    Returns:
+        list: Informació de cada fotograma del grup, en ordre.
+        dict: Per a cada imatge P amb teselles eliminades, la màscara (files, columnes) de teselles eliminades i el valor mitjà de la imatge.
+        Counter: Estadístiques de la codificació del grup.
+    """
+    reference_name, *predicted_names = image_group.keys()
+    # Estadísticas de las teselas de referencia, compartidas por todas las imágenes P del GOP
+    reference_stack, earlier_stacks = group_tile_stacks(OrderedDict() if stack_cache is None else stack_cache, reference_name, image_group[reference_name],
+                                                        earlier_references or {}, ntiles, matchplane, matchscale, precision)
+    frames_info = [{"file_name": reference_name, "reference_frame": True}]
+    replacements = {}
+    stats = Counter()
+    # La búsqueda predictiva encadena las imágenes P del GOP a través del campo de movimiento de la anterior
+    motionfield = np.zeros((ntiles[1], ntiles[0], 2), dtype=int) if motionsearch == 'predictive' else None
+
+    for file_name in tqdm(predicted_names, desc=f"Processant grup {group_index}", leave=False):
+        frame_info, replacement, frame_stats = process_predicted_frame(
+            file_name, image_group[file_name], reference_stack, ntiles=ntiles, seekrange=seekrange, quality=quality,
+            matcher=matcher, searchtiles=searchtiles, motionsearch=motionsearch, zeromotion=zeromotion, prefilter=prefilter,
+            matchplane=matchplane, matchscale=matchscale, mingap=mingap, changethreshold=changethreshold, motionfield=motionfield,
+            cachedir=cachedir, anncandidates=anncandidates, annrecall=annrecall, precision=precision, earlier_stacks=earlier_stacks)
+        frames_info.append(frame_info)
+        if replacement is not None:
+            replacements[file_name] = replacement
+        stats.update(frame_stats)
+
+    return frames_info, replacements, stats
+
+
+def reference_tile_stack(reference_image, ntiles, matchplane='rgb', matchscale=1, precision='float64') -> matchers.TileStack:
+    """
+    Divideix el pla de cerca de la imatge de referència d'un GOP en teselles i en calcula les estadístiques.
+
+    Args:
+        reference_image (ndarray): Imatge de referència.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        matchplane (str): Pla on es fa la cerca de teselles ('rgb' o 'luma').
+        matchscale (int): Factor de reducció del pla de cerca.
+        precision (str): Precisió de l'aritmètica de la cerca ('float64', 'float32' o 'uint8').
+
+    Returns:
+        TileStack: Teselles del pla de cerca de la imatge de referència.
+    """
+    return matchers.TileStack(matching_tiles(reference_image, ntiles, matchplane, matchscale), precision)
+
+
+def group_tile_stacks(stack_cache, reference_name, reference_image, earlier_references, ntiles, matchplane='rgb', matchscale=1, precision='float64') -> tuple[matchers.TileStack, list]:
+    """
+    Retorna les teselles de la imatge de referència d'un GOP i les de les imatges de referència dels GOP anteriors.
+    Les teselles es guarden a stack_cache pel nom del fitxer, de manera que les imatges de referència que ja feia
+    servir el GOP anterior no es tornen a dividir; només s'hi conserven les de les darreres imatges de referència.
+
+    Args:
+        stack_cache (OrderedDict): Teselles de les darreres imatges de referència, de la menys a la més recentment
+            utilitzada, calculades amb els mateixos paràmetres. S'actualitza.
+        reference_name (str): Nom del fitxer de la imatge de referència del GOP.
+        reference_image (ndarray): Imatge de referència del GOP.
+        earlier_references (dict): Imatges de referència dels GOP anteriors, de la més antiga a la més recent.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        matchplane (str): Pla on es fa la cerca de teselles ('rgb' o 'luma').
+        matchscale (int): Factor de reducció del pla de cerca.
+        precision (str): Precisió de l'aritmètica de la cerca ('float64', 'float32' o 'uint8').
+
+    Returns:
+        TileStack: Teselles de la imatge de referència del GOP.
+        list: Parelles (nom del fitxer, TileStack) de les imatges de referència anteriors, de la més recent a la més antiga.
+    """
+    for file_name, image in (*earlier_references.items(), (reference_name, reference_image)):
+        if file_name in stack_cache:
+            stack_cache.move_to_end(file_name)
+        else:
+            stack_cache[file_name] = reference_tile_stack(image, ntiles, matchplane, matchscale, precision)
+    # Olvidar las que ya no usa este GOP, que son las que llevan más tiempo sin usarse
+    while len(stack_cache) > len(earlier_references) + 1:
+        stack_cache.popitem(last=False)
+    earlier_stacks = [(file_name, stack_cache[file_name]) for file_name in reversed(earlier_references)]
+    return stack_cache[reference_name], earlier_stacks
+
+
+def matching_plane(image, matchplane='rgb', matchscale=1) -> ndarray:
+    """
+    Calcula el pla sobre el qual es busquen les teselles coincidents: la imatge mateixa o la seva luminància,
+    reduïda fent la mitjana de blocs de matchscale x matchscale píxels.
+
+    Args:
+        image (ndarray): Imatge en escala de grisos o color.
+        matchplane (str): 'rgb' per fer servir tots els canals o 'luma' per fer servir només la luminància.
+        matchscale (int): Factor de reducció de la imatge (1 per no reduir-la).
+
+    Returns:
+        ndarray: Pla de cerca.
+    """
+    if matchplane == 'luma' and image.ndim == 3:
+        image = image[..., :3] @ LUMA_WEIGHTS
+    if matchscale > 1:
+        height = image.shape[0] // matchscale
+        width = image.shape[1] // matchscale
+        blocks = image[:height * matchscale, :width * matchscale].reshape(height, matchscale, width, matchscale, *image.shape[2:])
+        image = blocks.mean(axis=(1, 3))
+    return image
+
+
+def matching_tiles(image, ntiles, matchplane='rgb', matchscale=1) -> dict:
+    """
+    Divideix el pla de cerca d'una imatge en teselles, a les mateixes posicions de la graella que les teselles de la imatge.
+
+    Args:
+        image (ndarray): Imatge en escala de grisos o color.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        matchplane (str): Pla on es fa la cerca de teselles ('rgb' o 'luma').
+        matchscale (int): Factor de reducció del pla de cerca.
+
+    Returns:
+        dict: Teselles del pla de cerca, indexades per la seva posició (fila, columna).
+    """
+    height, width = image.shape[:2]
+    tile_height = height // ntiles[1] // matchscale
+    tile_width = width // ntiles[0] // matchscale
+    if tile_height == 0 or tile_width == 0:
+        raise ValueError(f"Les tessel·les són massa petites per reduir-les {matchscale} vegades.")
+    return subdivide_image_into_tiles(matching_plane(image, matchplane, matchscale), tile_height, tile_width, ntiles)
+
+
+def process_predicted_frame(file_name, image, reference_stack, ntiles, seekrange, quality, matcher='auto', searchtiles=None, motionsearch='full', zeromotion=False, prefilter=False, matchplane='rgb', matchscale=1, mingap=None, changethreshold=None, motionfield=None, cachedir=None, anncandidates=None, annrecall=False, precision='float64', earlier_stacks=None) -> tuple[dict, tuple or None, Counter]:
+    """
+    Busca les teselles d'una imatge P que coincideixen amb alguna tesela de la imatge de referència del seu GOP
+    (o de les imatges de referència dels GOP anteriors, si se n'indiquen). De cada tesela només es guarda la tesela
+    de referència amb més correlació; en cas d'empat, la de la imatge de referència més recent. No modifica la imatge.
+
+    Args:
+        file_name (str): Nom del fitxer de la imatge.
+        image (ndarray): Imatge P.
+        reference_stack (TileStack): Teselles de la imatge de referència del GOP.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        quality (float): Factor de qualitat per determinar la coincidència de teselles.
+        matcher (str): Motor de correspondència de teselles ('auto', 'roll', 'fft', 'opencv', 'gemm' o 'numba').
+        searchtiles (int): Distància màxima, en teselles, entre la tesela actual i les de referència candidates. Si és None, la cerca és exhaustiva.
+        motionsearch (str): Estratègia de cerca del desplaçament ('full', 'threestep', 'diamond', 'pyramid' o 'predictive').
+        zeromotion (bool): Accepta directament la tesela coubicada sense desplaçament quan arriba a la qualitat, sense cercar-ne d'altres.
+        prefilter (bool): Descarta les parelles de teselles la cota de correlació de les quals no arriba a la qualitat.
+        matchplane (str): Pla on es fa la cerca de teselles ('rgb' o 'luma').
+        matchscale (int): Factor de reducció del pla de cerca. El desplaçament màxim es redueix en la mateixa proporció.
+        mingap (float): Diferència mínima entre la millor correlació d'una tesela i la segona per acceptar-la. Si és None, n'hi ha prou amb la millor.
+        changethreshold (float): Diferència absoluta mitjana amb la tesela de la referència a la mateixa posició per sota de la qual es dona per coincident sense cercar-la. Si és None, no es fa servir.
+        motionfield (ndarray): Camp de moviment (files, columnes, 2) de la imatge P anterior del GOP, per a la cerca predictiva. S'actualitza amb el d'aquesta imatge.
+        cachedir (str): Directori de la memòria cau de correlacions. Si una imatge P ja s'hi troba, amb els mateixos paràmetres de cerca, no es torna a cercar. Si és None, no es fa servir.
+        anncandidates (int): Nombre de teselles de referència candidates per tesela, triades amb l'índex de veïns més propers dels descriptors. Si és None, no es fa servir.
+        annrecall (bool): Mesura quantes de les millors coincidències de la cerca sense índex hi ha entre les candidates de l'índex.
+        precision (str): Precisió de l'aritmètica de la cerca: 'float64', 'float32' o 'uint8' (teselles de 8 bits amb estadístiques enteres).
+        earlier_stacks (list): Parelles (nom del fitxer, TileStack) de les imatges de referència dels GOP anteriors, de la més recent a la més antiga.
+            Les teselles que en provenen porten el nom de la seva imatge a "ref_frame".
+
+    Returns:
+        dict: Informació del fotograma per a les metadades.
+        tuple: Màscara (files, columnes) de teselles eliminades i valor mitjà de la imatge, o None si no se n'elimina cap.
+        Counter: Estadístiques de la codificació de la imatge.
     """
-    reference_image = None
     tiles_to_remove = {}
+    stats = Counter()
+    height, width = image.shape[:2]
+    tile_height = height // ntiles[1]
+    tile_width = width // ntiles[0]
+    tiles = subdivide_image_into_tiles(image, tile_height, tile_width, ntiles)
+    frame_info = {
+        "file_name": file_name,
+        "reference_frame": False,
+        "tiles": []
+    }
 
-    for file_name, image in tqdm(image_group.items(), desc=f"Processant grup {group_index}", leave=False):
-        height, width = image.shape[:2]
-        tile_height = height // ntiles[1]
-        tile_width = width // ntiles[0]
-        tiles = subdivide_image_into_tiles(image, tile_height, tile_width, ntiles)
-
-        if reference_image is not None:
-            frame_info = {
-                "file_name": file_name,
-                "reference_frame": False,
-                "tiles": []
-            }
-
-            for tile_index, current_tile in tqdm(tiles.items(), desc=f"Processant tessel·les del grup {group_index}", leave=False):
-                for previous_index, previous_tile in reference_tiles.items():
-                    # Aplicar el algoritmo de correlación
-                    correlation_score, (dx, dy) = calculate_correlation(current_tile, previous_tile, seekrange)
-                    # Comparar el resultado con el umbral de calidad
-                    if correlation_score >= quality:
-                        # Marcar la tesela para ser eliminada
-                        mark_tile_for_removal(tiles_to_remove, tile_index, current_tile)
-                        # Guardar la información de la tesela en el diccionario de metadatos
-                        x = tile_index[1] * tile_width + dx
-                        y = tile_index[0] * tile_height + dy
-                        if x < 0:
-                            x = 0
-                        if y < 0:
-                            y = 0
-                        frame_info["tiles"].append({"tb_id": previous_index, "td_position": (x, y)})
-
-            if tiles_to_remove:
-                # Calcular el valor medio de la imagen
-                average_value = calculate_average_value(image)
-                # Procesar las teselas marcadas para eliminación
-                tmp_tiles = tiles.copy()
-                replace_tile_with_average(tmp_tiles, tiles_to_remove, average_value)
-                tiles_to_remove.clear()
-                # Reconstruir la imagen desde las teselas modificadas
-                reconstructed_image = reconstruct_image_from_tiles(list(tmp_tiles.values()), ntiles, image.shape, tile_height, tile_width)
-                # Actualizar la imagen original en el diccionario con la imagen reconstruida
-                images[file_name] = reconstructed_image
+    def search(stack):
+        # Calcular la correlación de todas las parejas de teselas, o recuperarla de la caché si ya se había calculado
+        search_arguments = dict(ntiles=ntiles, seekrange=seekrange, quality=quality, matcher=matcher, searchtiles=searchtiles,
+                                motionsearch=motionsearch, zeromotion=zeromotion, prefilter=prefilter, matchplane=matchplane,
+                                matchscale=matchscale, changethreshold=changethreshold, motionfield=motionfield,
+                                anncandidates=anncandidates, annrecall=annrecall, precision=precision)
+        if cachedir is None:
+            return search_predicted_frame(image, stack, **search_arguments)
+        key = correlation_cache_key(image, stack, motionfield, ntiles=ntiles, seekrange=seekrange, matcher=matcher,
+                                    searchtiles=searchtiles, motionsearch=motionsearch, zeromotion=zeromotion, prefilter=prefilter,
+                                    matchplane=matchplane, matchscale=matchscale, changethreshold=changethreshold,
+                                    anncandidates=anncandidates, annrecall=annrecall, precision=precision,
+                                    # Con estos atajos la correlación guardada depende de la calidad, y el recall del índice se mide con ella
+                                    quality=quality if zeromotion or prefilter or annrecall else None)
+        cached = load_correlation_cache(cachedir, key)
+        if cached is None:
+            # Usar lo que queda guardado, para que la primera búsqueda dé lo mismo que las que se recuperan de la caché
+            cached = save_correlation_cache(cachedir, key, *search_predicted_frame(image, stack, **search_arguments))
+            stats["cache_misses"] += 1
+        else:
+            stats["cache_hits"] += 1
+        return cached
+
+    scores, shifts, search_stats = search(reference_stack)
+    # Las estadísticas de la búsqueda son las de la referencia del GOP, para no contar varias veces cada tesela
+    stats.update(search_stats)
+    # Las teselas actuales están en las mismas posiciones de la cuadrícula que las de referencia
+    tile_indices = reference_stack.positions
+    reference_indices = list(reference_stack.positions)
+    # Imagen de referencia de cada columna de la matriz de correlaciones (None para la del GOP)
+    reference_frames = [None] * len(reference_stack)
+    if earlier_stacks:
+        # Las columnas de las referencias anteriores van detrás, de la más reciente a la más antigua
+        all_scores, all_shifts = [scores], [shifts]
+        for reference_name, stack in earlier_stacks:
+            earlier_scores, earlier_shifts, _ = search(stack)
+            all_scores.append(earlier_scores)
+            all_shifts.append(earlier_shifts)
+            reference_indices += stack.positions
+            reference_frames += [reference_name] * len(stack)
+        scores = np.concatenate(all_scores, axis=1)
+        shifts = np.concatenate(all_shifts, axis=1)
+
+    # Quedarse solo con la tesela de referencia de mayor correlación de cada tesela (la primera, si empatan)
+    best_references = np.argmax(scores, axis=1)
+    best_scores = scores[np.arange(len(scores)), best_references]
+    selected = best_scores >= quality
+    if motionfield is not None:
+        # El movimiento de cada tesela (el de su mejor pareja) predice el de la siguiente imagen P
+        motionfield[tuple(np.array(tile_indices).T)] = shifts[np.arange(len(scores)), best_references]
+    if mingap is not None and scores.shape[1] > 1:
+        # Descartar las teselas cuya mejor coincidencia no se distingue lo suficiente de la segunda de la misma imagen
+        # de referencia: la misma tesela repetida en otra imagen de referencia no es ambigua
+        if earlier_stacks:
+            frame_of_column = np.repeat(np.arange(len(earlier_stacks) + 1), [len(reference_stack)] + [len(stack) for _, stack in earlier_stacks])
+            same_frame = frame_of_column[None, :] == frame_of_column[best_references][:, None]
+            second_scores = np.partition(np.where(same_frame, scores, -np.inf), -2, axis=1)[:, -2]
         else:
-            reference_image = image
-            reference_tiles = tiles
-            frame_info = {
-                "file_name": file_name,
-                "reference_frame": True
-            }
+            second_scores = np.partition(scores, -2, axis=1)[:, -2]
+        ambiguous = selected & (best_scores - second_scores < mingap)
+        stats["gap_rejected"] += int(np.count_nonzero(ambiguous))
+        selected &= ~ambiguous
+
+    # Recorrer solo las teselas seleccionadas, en el orden de las teselas
+    for current_position in np.flatnonzero(selected):
+        reference_position = best_references[current_position]
+        tile_index = tile_indices[current_position]
+        previous_index = reference_indices[reference_position]
+        # Llevar el desplazamiento a la resolución original, sin salir del rango de búsqueda
+        dx, dy = (int(np.clip(shift * matchscale, -seekrange, seekrange)) for shift in shifts[current_position, reference_position])
+        # Marcar la tesela para ser eliminada
+        mark_tile_for_removal(tiles_to_remove, tile_index, tiles[tile_index])
+        # Guardar la información de la tesela en el diccionario de metadatos
+        x = tile_index[1] * tile_width + dx
+        y = tile_index[0] * tile_height + dy
+        if x < 0:
+            x = 0
+        if y < 0:
+            y = 0
+        tile_info = {"tb_id": previous_index, "td_position": (x, y)}
+        if reference_frames[reference_position] is not None:
+            tile_info["ref_frame"] = reference_frames[reference_position]
+            stats["earlier_reference_tiles"] += 1
+        frame_info["tiles"].append(tile_info)
+
+    if not tiles_to_remove:
+        return frame_info, None, stats
+    # Guardar qué teselas se sustituyen y por qué valor medio; la imagen se modifica al fusionar los resultados
+    mask = np.zeros((ntiles[1], ntiles[0]), dtype=bool)
+    mask[tuple(np.array(list(tiles_to_remove.keys())).T)] = True
+    return frame_info, (mask, calculate_average_value(image)), stats
+
+
+def search_predicted_frame(image, reference_stack, ntiles, seekrange, quality, matcher='auto', searchtiles=None, motionsearch='full', zeromotion=False, prefilter=False, matchplane='rgb', matchscale=1, changethreshold=None, motionfield=None, anncandidates=None, annrecall=False, precision='float64') -> tuple[ndarray, ndarray, Counter]:
+    """
+    Calcula, sobre el pla de cerca, la correlació i el desplaçament de cada parella (tesela actual, tesela de
+    referència) d'una imatge P amb el motor i l'estratègia escollits. Les teselles acceptades sense cercar-les
+    (per diferència amb la referència o per moviment nul) tenen el desplaçament nul.
+
+    Args:
+        image (ndarray): Imatge P.
+        reference_stack (TileStack): Teselles de la imatge de referència del GOP.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        quality (float): Factor de qualitat, per a zeromotion i prefilter.
+        matcher (str): Motor de correspondència de teselles.
+        searchtiles (int): Distància màxima, en teselles, entre la tesela actual i les de referència candidates. Si és None, la cerca és exhaustiva.
+        motionsearch (str): Estratègia de cerca del desplaçament.
+        zeromotion (bool): Accepta directament la tesela coubicada sense desplaçament quan arriba a la qualitat.
+        prefilter (bool): Descarta les parelles de teselles la cota de correlació de les quals no arriba a la qualitat.
+        matchplane (str): Pla on es fa la cerca de teselles ('rgb' o 'luma').
+        matchscale (int): Factor de reducció del pla de cerca. El desplaçament màxim es redueix en la mateixa proporció.
+        changethreshold (float): Diferència absoluta mitjana per acceptar una tesela sense cercar-la. Si és None, no es fa servir.
+        motionfield (ndarray): Camp de moviment de la imatge P anterior del GOP, per a la cerca predictiva.
+        anncandidates (int): Nombre de teselles de referència candidates per tesela, segons l'índex de descriptors. Si és None, no es fa servir.
+        annrecall (bool): Mesura el recall de l'índex respecte a la cerca sense índex.
+        precision (str): Precisió de l'aritmètica de la cerca ('float64', 'float32' o 'uint8').
+
+    Returns:
+        ndarray: Matriu (teselles actuals, teselles de referència) amb la correlació de cada parella.
+        ndarray: Matriu (teselles actuals, teselles de referència, 2) amb el desplaçament (dx, dy) de cada parella, en el pla de cerca.
+        Counter: Estadístiques de la cerca.
+    """
+    stats = Counter()
+    current_stack = matchers.TileStack(matching_tiles(image, ntiles, matchplane, matchscale), precision)
+    # En el plano reducido el desplazamiento máximo se reduce en la misma proporción (redondeando hacia arriba)
+    match_seekrange = -(-seekrange // matchscale)
+    candidates = candidate_tiles(current_stack, reference_stack, searchtiles)
+    stats["tiles"] += len(current_stack)
+    if anncandidates is not None:
+        # Comparar cada tesela solo con las de referencia de descriptor más cercano
+        nearest = matchers.ann_candidates(current_stack, reference_stack, anncandidates)
+        if annrecall:
+            # Comprobar, con la búsqueda sin índice, si la mejor coincidencia de cada tesela está entre las candidatas
+            exhaustive_scores, _ = match_tiles(current_stack, reference_stack, match_seekrange, matcher, candidates, motionsearch, motionfield)
+            exhaustive_best = np.argmax(exhaustive_scores, axis=1)
+            matched = exhaustive_scores[np.arange(len(current_stack)), exhaustive_best] >= quality
+            stats["ann_recall_total"] += int(np.count_nonzero(matched))
+            stats["ann_recall_hits"] += int(np.count_nonzero(matched & nearest[np.arange(len(current_stack)), exhaustive_best]))
+        candidates = nearest if candidates is None else candidates & nearest
+    if changethreshold is not None:
+        # Las teselas que casi no cambian respecto a la tesela coubicada se aceptan sin desplazamiento y no se buscan
+        static = static_tiles(current_stack, reference_stack, changethreshold)
+        stats["static_tiles"] += int(np.count_nonzero(static))
+        if candidates is None:
+            candidates = np.ones((len(current_stack), len(reference_stack)), dtype=bool)
+        candidates[static] = False
+    if zeromotion:
+        # Las teselas que ya coinciden con su tesela coubicada sin desplazamiento no se buscan
+        colocated_scores = zero_motion_scores(current_stack, reference_stack)
+        accepted = colocated_scores >= quality
+        if candidates is None:
+            candidates = np.ones((len(current_stack), len(reference_stack)), dtype=bool)
+        candidates[accepted] = False
+    if prefilter:
+        # Descartar las parejas cuya cota de correlación no llega a la calidad
+        if candidates is None:
+            candidates = np.ones((len(current_stack), len(reference_stack)), dtype=bool)
+        reachable = matchers.correlation_bound(current_stack, reference_stack) >= quality
+        stats["prefilter_skipped"] += int(np.count_nonzero(candidates & ~reachable))
+        candidates &= reachable
+        stats["prefilter_evaluated"] += int(np.count_nonzero(candidates))
+    scores, shifts = match_tiles(current_stack, reference_stack, match_seekrange, matcher, candidates, motionsearch, motionfield)
+    if zeromotion:
+        accepted_positions = np.nonzero(accepted)[0]
+        scores[accepted_positions, accepted_positions] = colocated_scores[accepted_positions]
+        shifts[accepted_positions, accepted_positions] = 0
+    if changethreshold is not None:
+        # Aceptadas sin calcular la correlación: por encima de cualquier calidad
+        static_positions = np.nonzero(static)[0]
+        scores[static_positions, static_positions] = np.inf
+        shifts[static_positions, static_positions] = 0
+    return scores, shifts, stats
+
+
+def correlation_cache_key(image, reference_stack, motionfield=None, **parameters) -> str:
+    """
+    Calcula la clau de la memòria cau de correlacions d'una imatge P: un resum del contingut de la imatge, de les
+    teselles de referència del seu GOP, del camp de moviment previst (si n'hi ha) i dels paràmetres de la cerca.
+
+    Args:
+        image (ndarray): Imatge P.
+        reference_stack (TileStack): Teselles de la imatge de referència del GOP.
+        motionfield (ndarray): Camp de moviment de la imatge P anterior del GOP, o None.
+        **parameters: Paràmetres que afecten el resultat de la cerca.
+
+    Returns:
+        str: Clau hexadecimal.
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([CORRELATION_CACHE_VERSION, parameters], sort_keys=True, default=str).encode())
+    digest.update(reference_stack.digest.encode())
+    for array in (image, motionfield):
+        if array is not None:
+            digest.update(f"{array.shape}{array.dtype.str}".encode())
+            digest.update(np.ascontiguousarray(array))
+    return digest.hexdigest()
+
+
+def load_correlation_cache(cachedir, key) -> tuple[ndarray, ndarray, Counter] or None:
+    """
+    Llegeix de la memòria cau el resultat de search_predicted_frame d'una imatge P.
+
+    Args:
+        cachedir (str): Directori de la memòria cau.
+        key (str): Clau de la imatge P.
+
+    Returns:
+        tuple: Correlacions, desplaçaments i estadístiques de la cerca, o None si no hi són.
+    """
+    path = os.path.join(cachedir, f"{key}.npz")
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as cached:
+        stats = Counter(dict(zip(cached["stats_keys"].tolist(), cached["stats_values"].tolist())))
+        return cached["scores"].astype(float), cached["shifts"].astype(int), stats
+
+
+def save_correlation_cache(cachedir, key, scores, shifts, stats) -> tuple[ndarray, ndarray, Counter]:
+    """
+    Guarda a la memòria cau el resultat de search_predicted_frame d'una imatge P, comprimit: les correlacions en
+    float32 i els desplaçaments amb el tipus enter més petit que els conté. El fitxer s'escriu amb un nom
+    temporal i després es reanomena, perquè els altres fils o processos no en llegeixin mai un d'incomplet.
+
+    Args:
+        cachedir (str): Directori de la memòria cau. Es crea si no existeix.
+        key (str): Clau de la imatge P.
+        scores (ndarray): Correlació de cada parella de teselles.
+        shifts (ndarray): Desplaçament de cada parella de teselles.
+        stats (Counter): Estadístiques de la cerca.
+
+    Returns:
+        tuple: El resultat tal com el retorna load_correlation_cache (amb les correlacions arrodonides a float32).
+    """
+    scores = scores.astype(np.float32)
+    shift_dtype = next(dtype for dtype in (np.int8, np.int16, np.int32) if np.iinfo(dtype).max >= np.abs(shifts).max(initial=0))
+    os.makedirs(cachedir, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=cachedir, suffix=".tmp")
+    with os.fdopen(descriptor, "wb") as file:
+        np.savez_compressed(file, scores=scores, shifts=shifts.astype(shift_dtype),
+                            stats_keys=np.array(list(stats.keys()), dtype=str), stats_values=np.array(list(stats.values()), dtype=int))
+    os.replace(temporary_path, os.path.join(cachedir, f"{key}.npz"))
+    return scores.astype(float), shifts.astype(int), stats
+
+
+def process_frames_threads(image_groups, parameters, group_earlier=None, stack_cache=None) -> list:
+    """
+    Processa les imatges P de tots els grups en paral·lel amb fils, una tasca per imatge P.
+    Les teselles de referència de cada grup es calculen una sola vegada i les comparteixen totes les seves tasques.
+    Amb la cerca predictiva, cada imatge P depèn de l'anterior i la tasca és el grup sencer.
+
+    Args:
+        image_groups (list): Grups d'imatges.
+        parameters (dict): Paràmetres de codificació, amb els noms dels arguments de process_predicted_frame.
+        group_earlier (list): Per a cada grup, les imatges de referència dels GOP anteriors que pot fer servir. Si és None, cap.
+        stack_cache (OrderedDict): Teselles de les darreres imatges de referència (vegeu group_tile_stacks). Si és None, se'n crea una.
+
+    Returns:
+        list: Informació dels fotogrames, teselles a substituir i estadístiques de cada grup, en l'ordre dels grups.
+    """
+    workers = multiprocessing.cpu_count()
+    stack_cache = OrderedDict() if stack_cache is None else stack_cache
+    group_earlier = group_earlier or [{}] * len(image_groups)
+    if parameters["motionsearch"] == 'predictive':
+        # Cada imagen P se predice a partir de la anterior del GOP: una tarea por grupo
+        group_tasks = ((partial(process_image_group, group_index=index, earlier_references=earlier, **parameters), (image_group,))
+                       for index, (image_group, earlier) in enumerate(zip(image_groups, group_earlier)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return run_in_order(executor, group_tasks, len(image_groups), workers)
+
+    def tasks():
+        for image_group, earlier in zip(image_groups, group_earlier):
+            reference_name = next(iter(image_group))
+            # Las tareas se generan en este hilo, en orden: la caché de teselas no se comparte entre hilos
+            reference_stack, earlier_stacks = group_tile_stacks(stack_cache, reference_name, image_group[reference_name], earlier, parameters["ntiles"],
+                                                                parameters["matchplane"], parameters["matchscale"], parameters["precision"])
+            encode_frame = partial(process_predicted_frame, earlier_stacks=earlier_stacks, **parameters)
+            for file_name in list(image_group)[1:]:
+                yield encode_frame, (file_name, image_group[file_name], reference_stack)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        frame_results = run_in_order(executor, tasks(), count_predicted_frames(image_groups), workers)
+    return merge_frame_results(image_groups, frame_results)
+
+
+def process_frames_processes(image_groups, images, parameters, group_earlier=None, executor=None) -> list:
+    """
+    Processa les imatges P de tots els grups en paral·lel amb processos, una tasca per imatge P. Les imatges es
+    copien una sola vegada a un bloc de memòria compartida i cada procés hi accedeix sense còpies; només es
+    retornen les metadades i les màscares. Amb la cerca predictiva, la tasca és el grup sencer.
+
+    Args:
+        image_groups (list): Grups d'imatges.
+        images (dict): Diccionari amb totes les imatges, incloses les imatges de referència anteriors.
+        parameters (dict): Paràmetres de codificació, amb els noms dels arguments de process_predicted_frame.
+        group_earlier (list): Per a cada grup, les imatges de referència dels GOP anteriors que pot fer servir. Si és None, cap.
+        executor (ProcessPoolExecutor): Pool de processos que es reutilitza i no es tanca. Si és None, se'n crea un.
+
+    Returns:
+        list: Informació dels fotogrames, teselles a substituir i estadístiques de cada grup, en l'ordre dels grups.
+    """
+    shared, layout = share_images(images)
+    group_earlier = group_earlier or [{}] * len(image_groups)
+
+    def tasks():
+        for image_group, earlier in zip(image_groups, group_earlier):
+            reference_name, *predicted_names = image_group.keys()
+            for file_name in predicted_names:
+                yield process_shared_frame, (shared.name, layout, reference_name, file_name, parameters, tuple(earlier))
+
+    def group_tasks():
+        for index, (image_group, earlier) in enumerate(zip(image_groups, group_earlier)):
+            yield process_shared_group, (shared.name, layout, list(image_group), index, parameters, tuple(earlier))
+
+    workers = multiprocessing.cpu_count()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) if executor is None else nullcontext(executor) as executor:
+            if parameters["motionsearch"] == 'predictive':
+                # Cada imagen P se predice a partir de la anterior del GOP: una tarea por grupo
+                return run_in_order(executor, group_tasks(), len(image_groups), workers)
+            frame_results = run_in_order(executor, tasks(), count_predicted_frames(image_groups), workers)
+    finally:
+        shared.close()
+        shared.unlink()
+    return merge_frame_results(image_groups, frame_results)
+
+
+def run_in_order(executor, tasks, total, workers) -> list:
+    """
+    Executa les tasques amb l'executor i en retorna els resultats en l'ordre de les tasques. Només se'n mantenen
+    en curs unes quantes per treballador, perquè les dades de cada tasca (com les teselles de referència)
+    no s'hagin de tenir totes en memòria alhora.
+
+    Args:
+        executor (Executor): Pool de fils o de processos.
+        tasks (iterable): Tasques (funció, arguments).
+        total (int): Nombre de tasques, per a la barra de progrés.
+        workers (int): Nombre de treballadors de l'executor.
+
+    Returns:
+        list: Resultat de cada tasca, en ordre.
+    """
+    in_flight = 2 * workers
+    futures = []
+    results = []
+    with tqdm(total=total, desc="Processant imatges") as pbar:
+        for function, arguments in tasks:
+            futures.append(executor.submit(function, *arguments))
+            if len(futures) - len(results) >= in_flight:
+                results.append(futures[len(results)].result())
+                pbar.update(1)
+        for future in futures[len(results):]:
+            results.append(future.result())
+            pbar.update(1)
+    return results
+
+
+def count_predicted_frames(image_groups) -> int:
+    """
+    Compta les imatges P (totes menys la primera de cada grup).
+
+    Args:
+        image_groups (list): Grups d'imatges.
+
+    Returns:
+        int: Nombre d'imatges P.
+    """
+    return sum(len(image_group) - 1 for image_group in image_groups)
+
+
+def merge_frame_results(image_groups, frame_results) -> list:
+    """
+    Agrupa els resultats de les imatges P per grups, amb el mateix format que process_image_group.
+
+    Args:
+        image_groups (list): Grups d'imatges.
+        frame_results (list): Resultat de process_predicted_frame per a cada imatge P, en ordre.
 
-        metadata["frames"].append(frame_info)
+    Returns:
+        list: Informació dels fotogrames, teselles a substituir i estadístiques de cada grup, en l'ordre dels grups.
+    """
+    results = []
+    frame_results = iter(frame_results)
+    for image_group in image_groups:
+        reference_name, *predicted_names = image_group.keys()
+        frames_info = [{"file_name": reference_name, "reference_frame": True}]
+        replacements = {}
+        stats = Counter()
+        for file_name in predicted_names:
+            frame_info, replacement, frame_stats = next(frame_results)
+            frames_info.append(frame_info)
+            if replacement is not None:
+                replacements[file_name] = replacement
+            stats.update(frame_stats)
+        results.append((frames_info, replacements, stats))
+    return results
+
+
+def share_images(images) -> tuple[shared_memory.SharedMemory, dict]:
+    """
+    Copia les imatges, una darrere l'altra, a un bloc de memòria compartida.
+
+    Args:
+        images (dict): Diccionari amb les imatges.
+
+    Returns:
+        SharedMemory: Bloc de memòria compartida amb les imatges. Qui el crea l'ha de tancar i alliberar (unlink).
+        dict: Posició (offset, forma, tipus) de cada imatge dins del bloc, indexada pel nom del fitxer.
+    """
+    layout = {}
+    offset = 0
+    for file_name, image in images.items():
+        layout[file_name] = (offset, image.shape, image.dtype.str)
+        offset += image.nbytes
+    shared = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for file_name, view in shared_image_views(shared, layout, images.keys()).items():
+        view[...] = images[file_name]
+    return shared, layout
+
+
+def shared_image_views(shared, layout, file_names) -> dict:
+    """
+    Crea vistes (sense còpia) de les imatges indicades dins d'un bloc de memòria compartida.
+
+    Args:
+        shared (SharedMemory): Bloc de memòria compartida.
+        layout (dict): Posició (offset, forma, tipus) de cada imatge dins del bloc.
+        file_names (list): Noms dels fitxers de les imatges.
+
+    Returns:
+        dict: Vistes de les imatges, indexades pel nom del fitxer.
+    """
+    views = {}
+    for file_name in file_names:
+        offset, shape, dtype = layout[file_name]
+        views[file_name] = np.ndarray(shape, dtype=dtype, buffer=shared.buf, offset=offset)
+    return views
+
+
+# Teselas de las últimas imágenes de referencia usadas en este proceso, por nombre de archivo, para no recalcularlas
+# en cada imagen P ni en cada GOP (vegeu group_tile_stacks)
+_reference_cache = OrderedDict()
+
+
+def process_shared_frame(shared_name, layout, reference_name, file_name, parameters, earlier_names=()) -> tuple[dict, tuple or None, Counter]:
+    """
+    Processa una imatge P llegint-la, juntament amb la seva imatge de referència, del bloc de memòria compartida.
+    S'executa en un procés del pool, que conserva les teselles de les darreres imatges de referència utilitzades.
+
+    Args:
+        shared_name (str): Nom del bloc de memòria compartida.
+        layout (dict): Posició (offset, forma, tipus) de cada imatge dins del bloc.
+        reference_name (str): Nom del fitxer de la imatge de referència del GOP.
+        file_name (str): Nom del fitxer de la imatge P.
+        parameters (dict): Paràmetres de codificació, amb els noms dels arguments de process_predicted_frame.
+        earlier_names (tuple): Noms dels fitxers de les imatges de referència dels GOP anteriors, de la més antiga a la més recent.
+
+    Returns:
+        tuple: Resultat de process_predicted_frame.
+    """
+    shared = shared_memory.SharedMemory(name=shared_name)
+    try:
+        views = shared_image_views(shared, layout, (reference_name, file_name, *earlier_names))
+        # TileStack copia las teselas, así que la caché no retiene vistas del bloque compartido
+        reference_stack, earlier_stacks = group_tile_stacks(_reference_cache, reference_name, views[reference_name], {name: views[name] for name in earlier_names},
+                                                            parameters["ntiles"], parameters["matchplane"], parameters["matchscale"], parameters["precision"])
+        result = process_predicted_frame(file_name, views[file_name], reference_stack, earlier_stacks=earlier_stacks, **parameters)
+        # Las vistas deben liberarse antes de cerrar el bloque
+        del views
+        return result
+    finally:
+        shared.close()
+
+
+def process_shared_group(shared_name, layout, file_names, group_index, parameters, earlier_names=()) -> tuple[list, dict, Counter]:
+    """
+    Processa un grup d'imatges sencer llegint-lo del bloc de memòria compartida. S'executa en un procés del pool
+    quan les imatges P del grup no es poden processar per separat (cerca predictiva).
+
+    Args:
+        shared_name (str): Nom del bloc de memòria compartida.
+        layout (dict): Posició (offset, forma, tipus) de cada imatge dins del bloc.
+        file_names (list): Noms dels fitxers del grup, en ordre (el primer és la imatge de referència).
+        group_index (int): Índex del grup d'imatges.
+        parameters (dict): Paràmetres de codificació, amb els noms dels arguments de process_predicted_frame.
+        earlier_names (tuple): Noms dels fitxers de les imatges de referència dels GOP anteriors, de la més antiga a la més recent.
+
+    Returns:
+        tuple: Resultat de process_image_group.
+    """
+    shared = shared_memory.SharedMemory(name=shared_name)
+    try:
+        views = shared_image_views(shared, layout, file_names)
+        earlier_views = shared_image_views(shared, layout, earlier_names)
+        result = process_image_group(views, group_index=group_index, earlier_references=earlier_views, stack_cache=_reference_cache, **parameters)
+        # Las vistas deben liberarse antes de cerrar el bloque
+        del views, earlier_views
+        return result
+    finally:
+        shared.close()
+
+
+def apply_replacements(images, replacements, ntiles):
+    """
+    Substitueix, a cada imatge, les teselles marcades per eliminació pel valor mitjà de la imatge.
+    La substitució es fa directament sobre la imatge, amb una assignació emmascarada sobre la seva vista en graella.
+
+    Args:
+        images (dict): Diccionari amb les imatges.
+        replacements (dict): Per a cada nom de fitxer, la màscara (files, columnes) de teselles eliminades i el valor mitjà de la imatge.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+    """
+    for file_name, (mask, average_value) in replacements.items():
+        image = images[file_name]
+        if not image.flags.writeable:
+            image = images[file_name] = image.copy()
+        height, width = image.shape[:2]
+        grid = tile_grid(image, height // ntiles[1], width // ntiles[0], ntiles)
+        # Procesar las teselas marcadas para eliminación sin copiar la imagen
+        grid[mask] = average_value
+
+
+def add_tile_atlases(frames_info, images, replacements, ntiles):
+    """
+    Afegeix a la informació de cada imatge P amb teselles substituïdes la disposició del seu atles de teselles ("atlas"),
+    si l'atles és prou més petit que la imatge (vegeu tile_atlas_layout).
+
+    Args:
+        frames_info (list): Informació dels fotogrames.
+        images (dict): Diccionari amb les imatges.
+        replacements (dict): Per a cada nom de fitxer, la màscara de teselles eliminades i el valor mitjà de la imatge.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+    """
+    for frame_info in frames_info:
+        file_name = frame_info["file_name"]
+        if file_name not in replacements:
+            continue
+        mask, average_value = replacements[file_name]
+        atlas = tile_atlas_layout(images[file_name].shape, mask, ntiles, average_value)
+        if atlas is not None:
+            frame_info["atlas"] = atlas
+
+
+def tile_atlas_layout(shape, mask, ntiles, average_value) -> dict or None:
+    """
+    Calcula la disposició de l'atles de teselles d'una imatge P: una imatge més petita amb només les cel·les que no
+    s'han substituït, una darrere l'altra en files de "columns" cel·les. Les cel·les són les teselles de la graella i,
+    si la mida de la imatge no és múltiple de la de les teselles, els trossos dels marges, que no se substitueixen mai.
+    A l'atles, cada cel·la ocupa un nombre enter de blocs del JPEG (ATLAS_BLOCK), perquè cap bloc barregi dues cel·les.
+
+    Args:
+        shape (tuple): Forma de la imatge.
+        mask (ndarray): Màscara (files, columnes) de teselles substituïdes.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        average_value (float or ndarray): Valor de les teselles substituïdes.
+
+    Returns:
+        dict: Forma de la imatge ("shape"), nombre de teselles ("n_tiles"), teselles substituïdes ("replaced", la
+            màscara en bits, en hexadecimal), cel·les per fila de l'atles ("columns") i valor de les teselles
+            substituïdes ("fill"). None si l'atles tindria més de ATLAS_MAX_RATIO dels píxels de la imatge.
+    """
+    height, width = shape[:2]
+    atlas = {"shape": [height, width], "n_tiles": list(ntiles), "replaced": np.packbits(mask).tobytes().hex()}
+    cells = atlas_cells(atlas)
+    cell_height, cell_width = atlas_cell_size(atlas)
+    # Atlas aproximadamente cuadrado (en celdas), con al menos una celda
+    columns = max(1, int(np.ceil(np.sqrt(len(cells)))))
+    rows = max(1, -(-len(cells) // columns))
+    if rows * cell_height * columns * cell_width > ATLAS_MAX_RATIO * height * width:
+        return None
+    return {**atlas, "columns": columns, "fill": np.asarray(average_value).tolist()}
+
+
+def atlas_cells(atlas) -> ndarray:
+    """
+    Retorna les cel·les d'un atles de teselles: la posició (fila, columna) a la imatge de les teselles no substituïdes
+    i de les cel·les dels marges, en l'ordre en què es guarden a l'atles.
+
+    Args:
+        atlas (dict): Disposició de l'atles.
+
+    Returns:
+        ndarray: Posicions de les cel·les, de forma (cel·les, 2).
+    """
+    height, width = atlas["shape"]
+    n_tiles_x, n_tiles_y = atlas["n_tiles"]
+    tile_height, tile_width = height // n_tiles_y, width // n_tiles_x
+    mask = np.unpackbits(np.frombuffer(bytes.fromhex(atlas["replaced"]), dtype=np.uint8), count=n_tiles_y * n_tiles_x)
+    # Los márgenes forman una fila y una columna más de celdas, más pequeñas
+    kept = np.ones((-(-height // tile_height), -(-width // tile_width)), dtype=bool)
+    kept[:n_tiles_y, :n_tiles_x] = mask.reshape(n_tiles_y, n_tiles_x) == 0
+    return np.argwhere(kept)
+
+
+def atlas_cell_size(atlas) -> tuple[int, int]:
+    """
+    Retorna la mida de les cel·les d'un atles de teselles: la de les teselles, arrodonida a blocs del JPEG.
+
+    Args:
+        atlas (dict): Disposició de l'atles.
+
+    Returns:
+        tuple: Alçada i amplada de les cel·les.
+    """
+    height, width = atlas["shape"]
+    tile_height, tile_width = height // atlas["n_tiles"][1], width // atlas["n_tiles"][0]
+    return -(-tile_height // ATLAS_BLOCK) * ATLAS_BLOCK, -(-tile_width // ATLAS_BLOCK) * ATLAS_BLOCK
+
+
+def pack_tile_atlas(image, atlas) -> ndarray:
+    """
+    Construeix l'atles de teselles d'una imatge P amb la disposició de tile_atlas_layout. Les cel·les s'omplen fins a
+    la seva mida a l'atles repetint-ne la vora, i les cel·les sobrants de la darrera fila, amb el valor de les teselles
+    substituïdes.
+
+    Args:
+        image (ndarray): Imatge P codificada.
+        atlas (dict): Disposició de l'atles.
 
+    Returns:
+        ndarray: Atles de teselles.
+    """
+    tile_height, tile_width = image.shape[0] // atlas["n_tiles"][1], image.shape[1] // atlas["n_tiles"][0]
+    cell_height, cell_width = atlas_cell_size(atlas)
+    cells, columns = atlas_cells(atlas), atlas["columns"]
+    rows = max(1, -(-len(cells) // columns))
+    packed = np.empty((rows * cell_height, columns * cell_width) + image.shape[2:], dtype=image.dtype)
+    packed[...] = atlas["fill"]
+    for index, (row, column) in enumerate(cells):
+        cell = image[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width]
+        # Repetir el borde hasta completar los bloques del JPEG evita saltos bruscos dentro de ellos
+        padding = ((0, cell_height - cell.shape[0]), (0, cell_width - cell.shape[1])) + ((0, 0),) * (image.ndim - 2)
+        atlas_row, atlas_column = divmod(index, columns)
+        packed[atlas_row * cell_height:(atlas_row + 1) * cell_height,
+               atlas_column * cell_width:(atlas_column + 1) * cell_width] = np.pad(cell, padding, mode='edge')
+    return packed
+
+
+def unpack_tile_atlas(packed, atlas) -> ndarray:
+    """
+    Torna a muntar la imatge P sencera a partir del seu atles de teselles: les cel·les de l'atles tornen al seu lloc i
+    la resta de teselles prenen el valor de les teselles substituïdes, com les deixa apply_replacements.
+
+    Args:
+        packed (ndarray): Atles de teselles.
+        atlas (dict): Disposició de l'atles.
 
-def split_images_into_groups(images, gop) -> list:
+    Returns:
+        ndarray: Imatge P sencera.
+    """
+    height, width = atlas["shape"]
+    tile_height, tile_width = height // atlas["n_tiles"][1], width // atlas["n_tiles"][0]
+    cell_height, cell_width = atlas_cell_size(atlas)
+    columns = atlas["columns"]
+    image = np.empty((height, width) + packed.shape[2:], dtype=packed.dtype)
+    image[...] = atlas["fill"]
+    for index, (row, column) in enumerate(atlas_cells(atlas)):
+        atlas_row, atlas_column = divmod(index, columns)
+        target = image[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width]
+        target[...] = packed[atlas_row * cell_height:atlas_row * cell_height + target.shape[0],
+                             atlas_column * cell_width:atlas_column * cell_width + target.shape[1]]
+    return image
+
+
+def split_images_into_groups(images, gop, scenecut=None) -> list:
     """
     Divideix la llista d'imatges en conjunts consecutius segons el GOP (Grup de Fotogrames).
+    Si s'indica un llindar de canvi d'escena, també comença un grup nou a cada canvi d'escena, i el GOP
+    passa a ser la mida màxima dels grups.
 
     Args:
         images (dict): Diccionari d'imatges.
-        gop (int): Mida del GOP.
+        gop (int): Mida (màxima) del GOP.
+        scenecut (float): Distància mínima entre les signatures de dues imatges consecutives per considerar que hi ha un canvi d'escena. Si és None, els grups tenen mida fixa.
+
+    Returns:
+        list: Llista de diccionaris, on cada diccionari conté imatges consecutives de mida gop com a màxim.
+    """
+    return list(iter_image_groups(images.items(), gop, scenecut))
+
+
+def iter_image_groups(frames, gop, scenecut=None):
+    """
+    Agrupa les imatges d'un iterador en GOP a mesura que arriben, com split_images_into_groups, sense llegir
+    més imatges de les que calen per completar el grup actual.
+
+    Args:
+        frames (iterable): Parelles (nom del fitxer, imatge), en ordre.
+        gop (int): Mida (màxima) del GOP.
+        scenecut (float): Llindar de canvi d'escena. Si és None, els grups tenen mida fixa.
+
+    Yields:
+        dict: Imatges consecutives d'un grup.
+    """
+    group_images = {}
+    previous_signature = None
+    for key, image in frames:
+        if scenecut is not None:
+            signature = frame_signature(image)
+            # Empezar un grupo nuevo si la imagen cambia de escena respecto a la anterior, salvo si el grupo
+            # anterior acaba de completarse con el GOP
+            if previous_signature is not None and signature_distance(previous_signature, signature) > scenecut and group_images:
+                yield group_images
+                group_images = {}
+            previous_signature = signature
+        group_images[key] = image
+        if len(group_images) == gop:
+            yield group_images
+            group_images = {}
+    if group_images:
+        yield group_images
+
+
+def find_duplicate_frames(images, mode='exact', distance=0) -> dict:
+    """
+    Busca les imatges que repeteixen una imatge anterior. Amb 'exact', les que tenen exactament el mateix contingut;
+    amb 'perceptual', les que tenen el hash perceptiu a una distància de Hamming no més gran que distance del d'una
+    imatge anterior no repetida (la més propera, i la primera si n'hi ha diverses).
+
+    Args:
+        images (dict): Diccionari amb les imatges, en ordre.
+        mode (str): 'exact' o 'perceptual'.
+        distance (int): Distància de Hamming màxima entre hash perceptius (de 0 a 64).
 
     Returns:
-        list: Llista de diccionaris, on cada diccionari conté imatges consecutives de mida gop.
+        dict: Per a cada imatge repetida, el nom de la imatge no repetida de la qual és còpia.
     """
-    image_groups = []
-    for i in range(0, len(images), gop):
-        # Obtener el conjunto de claves (índices) de las imágenes consecutivas de tamaño gop
-        group_keys = list(images.keys())[i:i+gop]
-        
-        # Crear un diccionario para almacenar las imágenes en este grupo
-        group_images = {key: images[key] for key in group_keys}
-        
-        # Agregar este diccionario al grupo de imágenes
-        image_groups.append(group_images)
-    return image_groups
+    duplicates = {}
+    if mode == 'exact':
+        seen = {}
+        for file_name, image in images.items():
+            digest = frame_hash(image)
+            if digest in seen:
+                duplicates[file_name] = seen[digest]
+            else:
+                seen[digest] = file_name
+        return duplicates
+    # Hash de las imágenes no repetidas, en un vector para calcular todas las distancias a la vez
+    names, hashes = [], np.empty(len(images), dtype=np.uint64)
+    for file_name, image in images.items():
+        value = frame_hash(image, 'perceptual')
+        if names:
+            distances = hamming_distances(hashes[:len(names)], value)
+            closest = int(np.argmin(distances))
+            if distances[closest] <= distance and images[names[closest]].shape == image.shape:
+                duplicates[file_name] = names[closest]
+                continue
+        hashes[len(names)] = value
+        names.append(file_name)
+    return duplicates
+
+
+def hamming_distances(hashes, value) -> ndarray:
+    """
+    Calcula la distància de Hamming (bits diferents) entre un hash de 64 bits i cadascun dels d'un vector.
+
+    Args:
+        hashes (ndarray): Vector de hash (uint64).
+        value (int): Hash a comparar.
+
+    Returns:
+        ndarray: Distància de Hamming a cada hash del vector.
+    """
+    differences = hashes ^ np.uint64(value)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(differences)
+    # NumPy anterior a la 2.0: contar los bits de cada byte con una tabla
+    return POPCOUNT_TABLE[differences.view(np.uint8)].reshape(len(hashes), 8).sum(axis=1)
+
+
+def frame_hash(image, mode='exact') -> str or int:
+    """
+    Calcula el resum d'una imatge per detectar-ne les repeticions: l'SHA-1 del contingut ('exact') o un hash
+    perceptiu de 64 bits ('perceptual', dHash): la imatge en escala de grisos es redueix a 8x9 blocs i cada bit
+    indica si un bloc és més clar que el de la seva dreta, de manera que el hash no canvia amb el soroll.
+
+    Args:
+        image (ndarray): Imatge en escala de grisos o color.
+        mode (str): 'exact' o 'perceptual'.
+
+    Returns:
+        str or int: Resum hexadecimal ('exact') o hash de 64 bits ('perceptual').
+    """
+    if mode == 'exact':
+        digest = hashlib.sha1(f"{image.shape}{image.dtype.str}".encode())
+        digest.update(np.ascontiguousarray(image))
+        return digest.hexdigest()
+    gray = image.mean(axis=2) if image.ndim == 3 else image.astype(float)
+    height, width = gray.shape
+    # Media de cada bloque de una cuadrícula de 8x9 bloques
+    row_edges = np.linspace(0, height, 9).astype(int)
+    column_edges = np.linspace(0, width, 10).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(gray, row_edges[:-1], axis=0), column_edges[:-1], axis=1)
+    blocks = sums / np.outer(np.diff(row_edges), np.diff(column_edges))
+    bits = blocks[:, :-1] > blocks[:, 1:]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def frame_signature(image, size=32, bins=32) -> ndarray:
+    """
+    Calcula una signatura barata d'una imatge per detectar canvis d'escena: l'histograma normalitzat de la
+    intensitat d'una versió reduïda de la imatge.
+
+    Args:
+        image (ndarray): Imatge en escala de grisos o color.
+        size (int): Nombre aproximat de píxels per eix de la imatge reduïda.
+        bins (int): Nombre d'intervals de l'histograma.
+
+    Returns:
+        ndarray: Histograma normalitzat (suma 1).
+    """
+    height, width = image.shape[:2]
+    # Submuestrear sin interpolación; basta para comparar la distribución de intensidades
+    small = image[::max(height // size, 1), ::max(width // size, 1)]
+    if small.ndim == 3:
+        small = small.mean(axis=2)
+    histogram, _ = np.histogram(small, bins=bins, range=(0, 256))
+    return histogram / histogram.sum()
+
+
+def signature_distance(signature, other_signature) -> float:
+    """
+    Distància entre dues signatures d'imatge, entre 0 (histogrames iguals) i 1 (histogrames disjunts).
+
+    Args:
+        signature (ndarray): Signatura d'una imatge.
+        other_signature (ndarray): Signatura de l'altra imatge.
+
+    Returns:
+        float: Distància de variació total entre els dos histogrames.
+    """
+    return 0.5 * np.abs(signature - other_signature).sum()
+
+
+def tile_grid(image, tile_height, tile_width, n_tiles) -> ndarray:
+    """
+    Retorna la imatge vista com una graella de teselles de forma (files, columnes, alçada, amplada[, canals]), sense copiar-la.
+    Modificar la graella modifica la imatge. Els píxels que no caben a la graella (si la mida de la imatge no és
+    múltiple de la mida de les teselles) en queden fora.
+
+    Args:
+        image (ndarray): Matriu de dades de la imatge.
+        tile_height (int): Alçada de cada tesela.
+        tile_width (int): Amplada de cada tesela.
+        n_tiles (tuple): Nombre de teselas en els eixos horitzontal i vertical (n_tiles_x, n_tiles_y).
+
+    Returns:
+        ndarray: Vista de la imatge en forma de graella de teselles.
+    """
+    rows, columns = n_tiles[1], n_tiles[0]
+    region = image[:rows * tile_height, :columns * tile_width]
+    # Dividir cada eje en (teselas, píxeles) es siempre una vista; después se agrupan los ejes de las teselas
+    return region.reshape(rows, tile_height, columns, tile_width, *image.shape[2:]).swapaxes(1, 2)
 
 
 def subdivide_image_into_tiles(image, tile_height, tile_width, n_tiles) -> dict:
@@ -138,20 +1468,144 @@ def subdivide_image_into_tiles(image, tile_height, tile_width, n_tiles) -> dict:
         image (ndarray): Matriu de dades de la imatge.
         tile_height (int): Alçada de cada tesela.
         tile_width (int): Amplada de cada tesela.
-        n_tiles (tuple): Nombre de teselas en els eixos vertical i horitzontal.
+        n_tiles (tuple): Nombre de teselas en els eixos horitzontal i vertical (n_tiles_x, n_tiles_y).
 
     Returns:
-        dict: Diccionari on les claus són els índexos de les teselles i els valors són les subimatges (teselles).
+        dict: Diccionari on les claus són els índexos de les teselles i els valors són les subimatges (teselles), vistes de la imatge.
     """
-    tiles = {}
-    for i in range(n_tiles[0]):
-        for j in range(n_tiles[1]):
-            tile = image[i*tile_height:(i+1)*tile_height, j*tile_width:(j+1)*tile_width]
-            tiles[(i,j)] = tile
-    return tiles
+    grid = tile_grid(image, tile_height, tile_width, n_tiles)
+    # n_tiles[1] files de tile_height i n_tiles[0] columnes de tile_width
+    return {(i, j): grid[i, j] for i in range(n_tiles[1]) for j in range(n_tiles[0])}
 
 
-def calculate_correlation(current_tile, reference_tile, seekrange) -> tuple:
+def candidate_tiles(current_stack, reference_stack, searchtiles) -> ndarray or None:
+    """
+    Calcula quines teselles de referència són candidates per a cada tesela actual segons la seva posició a la graella.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+        searchtiles (int): Distància màxima (en teselles, en qualsevol dels dos eixos) entre les dues posicions.
+
+    Returns:
+        ndarray: Màscara booleana (teselles actuals, teselles de referència), o None si la cerca és exhaustiva.
+    """
+    if searchtiles is None:
+        return None
+    current_positions = np.array(current_stack.positions)
+    reference_positions = np.array(reference_stack.positions)
+    distance = np.abs(current_positions[:, None, :] - reference_positions[None, :, :]).max(axis=2)
+    return distance <= searchtiles
+
+
+def static_tiles(current_stack, reference_stack, changethreshold) -> ndarray:
+    """
+    Marca les teselles que gairebé no han canviat respecte a la tesela de referència de la mateixa posició:
+    la diferència absoluta mitjana entre les dues (en una sola operació per a tota la imatge) és menor que el llindar.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència, amb les mateixes posicions.
+        changethreshold (float): Diferència absoluta mitjana màxima, en nivells d'intensitat (0-255).
+
+    Returns:
+        ndarray: Màscara booleana de les teselles actuals sense canvis.
+    """
+    difference = np.abs(current_stack.tiles.astype(float) - reference_stack.tiles)
+    return difference.reshape(len(current_stack), -1).mean(axis=1) < changethreshold
+
+
+def zero_motion_scores(current_stack, reference_stack) -> ndarray:
+    """
+    Calcula la correlació de cada tesela amb la tesela de referència de la mateixa posició, sense desplaçament.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència, amb les mateixes posicions.
+
+    Returns:
+        ndarray: Correlació de cada tesela amb la seva tesela coubicada (-1 si no està definida).
+    """
+    current = current_stack.normalized.reshape(len(current_stack), -1)
+    reference = reference_stack.normalized.reshape(len(reference_stack), -1)
+    correlation = np.einsum('ij,ij->i', current, reference)
+    return np.where(current_stack.valid & reference_stack.valid, correlation, -1)
+
+
+def match_tiles(current_stack, reference_stack, seekrange, matcher, candidates=None, motionsearch='full', motionfield=None) -> tuple[ndarray, ndarray]:
+    """
+    Calcula la correlació de cada tesela de la imatge actual amb cada tesela de la imatge de referència.
+    Les estratègies de cerca ràpides ('threestep', 'diamond', 'pyramid' i 'predictive') treballen sempre amb les teselles apilades, sigui quin sigui el motor.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència, compartides per tot el GOP.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        matcher (str): Motor de correspondència de teselles.
+        candidates (ndarray): Màscara booleana de les parelles a avaluar. Si és None, s'avaluen totes.
+        motionsearch (str): Estratègia de cerca del desplaçament ('full', 'threestep', 'diamond', 'pyramid' o 'predictive').
+        motionfield (ndarray): Camp de moviment (files, columnes, 2) de la imatge P anterior, per a la cerca predictiva. Si és None, es prediu sense.
+
+    Returns:
+        ndarray: Matriu (teselles actuals, teselles de referència) amb la correlació màxima de cada parella (-inf si no s'ha avaluat).
+        ndarray: Matriu (teselles actuals, teselles de referència, 2) amb el desplaçament (dx, dy) de cada parella.
+    """
+    tile_shape = current_stack.tile_shape
+    if matcher == 'auto':
+        n_candidates = len(reference_stack) if candidates is None else candidates.sum(axis=1).mean()
+        matcher = matchers.select_matcher(tile_shape, seekrange, n_candidates)
+
+    if motionsearch == 'pyramid':
+        return matchers.pyramid_search(current_stack, reference_stack, seekrange, candidates)
+    if motionsearch == 'predictive':
+        if motionfield is None:
+            grid_shape = np.array(current_stack.positions).reshape(-1, 2).max(axis=0) + 1
+            motionfield = np.zeros((*grid_shape, 2), dtype=int)
+        return matchers.predictive_search(current_stack, reference_stack, seekrange, motionfield, candidates)
+    if motionsearch != 'full':
+        return matchers.pattern_search(current_stack, reference_stack, seekrange, motionsearch, candidates)
+    if matcher == 'gemm':
+        return matchers.correlation_matrix(current_stack, reference_stack, seekrange, candidates)
+    if matcher == 'fft':
+        return matchers.fft_correlation(current_stack, reference_stack, seekrange, candidates)
+
+    correlation = get_matcher(matcher, tile_shape, seekrange, current_stack.precision)
+    scores = np.full((len(current_stack), len(reference_stack)), -np.inf)
+    shifts = np.zeros((len(current_stack), len(reference_stack), 2), dtype=int)
+    for i, current_tile in enumerate(tqdm(current_stack.tiles, desc="Processant tessel·les", leave=False)):
+        for j, reference_tile in enumerate(reference_stack.tiles):
+            if candidates is not None and not candidates[i, j]:
+                continue
+            # Aplicar el algoritmo de correlación
+            scores[i, j], shifts[i, j] = correlation(current_tile, reference_tile, seekrange)
+    return scores, shifts
+
+
+def get_matcher(matcher, tile_shape, seekrange, precision='float64'):
+    """
+    Retorna la funció de correlació del motor indicat. Tots els motors segueixen el contracte de calculate_correlation,
+    que es manté com a implementació de referència ('roll').
+
+    Args:
+        matcher (str): Nom del motor per parelles ('auto', 'roll', 'fft', 'opencv' o 'numba').
+        tile_shape (tuple): Forma de les teselles a comparar (alçada, amplada).
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        precision (str): Precisió de l'aritmètica de 'roll' ('float64', 'float32' o 'uint8'). La resta de motors en tenen una de fixa.
+
+    Returns:
+        function: Funció (current_tile, reference_tile, seekrange) -> (correlació, (dx, dy)).
+    """
+    if matcher == 'auto':
+        matcher = matchers.select_pair_matcher(tile_shape, seekrange)
+    return {
+        'roll': partial(calculate_correlation, precision=precision),
+        'fft': matchers.correlation_fft,
+        'opencv': matchers.correlation_opencv,
+        'numba': matchers.correlation_numba,
+    }[matcher]
+
+
+def calculate_correlation(current_tile, reference_tile, seekrange, precision='float64') -> tuple:
     """
     Calcula la correlació entre dues teselles d'imatges consecutives amb un desplaçament màxim especificat. Algoritme de correspondencia de tesela.
 
@@ -159,14 +1613,17 @@ def calculate_correlation(current_tile, reference_tile, seekrange) -> tuple:
         current_tile (ndarray): Tesela de la imatge actual.
         reference_tile (ndarray): Tesela de la imatge de referència.
         seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        precision (str): Precisió de l'aritmètica: 'float64', 'float32' o 'uint8' (aritmètica entera, vegeu matchers.correlation_integer).
 
     Returns:
         float: Valor de correlació màxima entre les dues teselles considerant el desplaçament.
         tuple: Posició de desplaçament de la tesela actual (dx, dy).
     """
-    # Convertir las teselas a tipo de dato flotante
-    current_tile = current_tile.astype(float)
-    reference_tile = reference_tile.astype(float)
+    if precision == 'uint8':
+        return matchers.correlation_integer(current_tile, reference_tile, seekrange)
+    # Convertir las teselas al tipo de coma flotante de la precisión
+    current_tile = current_tile.astype(precision)
+    reference_tile = reference_tile.astype(precision)
 
     max_correlation = -1  # Inicializar con un valor mínimo de correlación
     max_dx = 0  # Inicializar el desplazamiento horizontal máximo
@@ -238,45 +1695,6 @@ def calculate_average_value(image) -> float:
         return mean_value
 
 
-def replace_tile_with_average(tiles, tiles_to_remove, average_value):
-    """
-    Reemplaça les teselles marcades per eliminació pel seu valor mitjà.
-
-    Args:
-        tiles (dict): Diccionari de teselles.
-        tiles_to_remove (dict): Diccionari que emmagatzema els índexs de les teselles a eliminar.
-        average_value (float): El valor mitjà que s'utilitzarà per reemplaçar les teselles marcades.
-    """
-    for tile_index in tiles_to_remove.keys():
-        if tile_index in tiles:
-            tiles[tile_index] = np.full_like(tiles[tile_index], average_value)
-
-
-def reconstruct_image_from_tiles(tiles, n_tiles, original_shape, tile_height, tile_width) -> ndarray:
-    """
-    Reconstrueix la imatge original a partir de les teselles.
-
-    Args:
-        tiles (dict): Diccionari de teselles.
-        n_tiles (tuple): Nombre de teselles en els eixos vertical i horitzontal (n_tiles_y, n_tiles_x).
-        original_shape (tuple): La forma original de la imatge (altura, amplada, canals).
-        tile_height (int): Alçada de cada tesela.
-        tile_width (int): Amplada de cada tesela.
-
-    Returns:
-        ndarray: La imatge reconstruïda com una matriu de numpy.
-    """
-    reconstructed_image = np.zeros(original_shape, dtype=tiles[0].dtype)
-    
-    count = 0
-    for i in range(n_tiles[0]):
-        for j in range(n_tiles[1]):
-            reconstructed_image[i*tile_height:(i+1)*tile_height, j*tile_width:(j+1)*tile_width] = tiles[count]
-            count += 1
-    
-    return reconstructed_image
-
-
 def calculate_psnr(original_images, compressed_images) -> float:
     """
     Calcula el PSNR (Peak Signal-to-Noise Ratio) entre imatges originals i comprimides.
@@ -297,10 +1715,8 @@ def calculate_psnr(original_images, compressed_images) -> float:
             print(f"Les dimensions de les imatges {title} són diferents.")
             continue
 
-        # Calcular PSNR
-        mse = np.mean((original_image - compressed_image) ** 2)
-        if mse != 0:
-            psnr = 10 * np.log10((255 ** 2) / mse)
+        psnr = calculate_frame_psnr(original_image, compressed_image)
+        if psnr is not None:
             psnr_values.append(psnr)
 
     # Calcular PSNR promedio
@@ -309,5 +1725,20 @@ def calculate_psnr(original_images, compressed_images) -> float:
         return avg_psnr
     else:
         return None
-    
-    
\ No newline at end of file
+
+
+def calculate_frame_psnr(original_image, compressed_image) -> float or None:
+    """
+    Calcula el PSNR entre una imatge original i la seva versió comprimida, de la mateixa mida.
+
+    Args:
+        original_image (ndarray): Imatge original.
+        compressed_image (ndarray): Imatge comprimida.
+
+    Returns:
+        float: PSNR de la imatge, o None si les dues imatges són iguals.
+    """
+    mse = np.mean((original_image - compressed_image) ** 2)
+    if mse != 0:
+        return 10 * np.log10((255 ** 2) / mse)
+    return None
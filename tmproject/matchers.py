@@ -0,0 +1,1007 @@
+import cv2
+import hashlib
+import numpy as np
+from numpy import ndarray
+from scipy.spatial import cKDTree
+
+try:
+    import numba
+except ImportError:
+    # Numba és opcional: sense ell, el motor 'numba' fa el mateix càlcul amb NumPy
+    numba = None
+
+# Noms dels motors de correspondència acceptats per l'encoder ('auto' tria segons la tesel·la i el seekRange)
+MATCHER_NAMES = ('auto', 'roll', 'fft', 'opencv', 'gemm', 'numba')
+
+# Estratègies de cerca del desplaçament: exhaustiva, en tres passos, en diamant, piramidal (de gruixut a fi)
+# o predictiva (a partir del moviment de les teselles veïnes i de la imatge P anterior)
+MOTION_SEARCH_NAMES = ('full', 'threestep', 'diamond', 'pyramid', 'predictive')
+
+# Patrons de la cerca en diamant (dx, dy): diamant gran i diamant petit
+LARGE_DIAMOND = ((0, -2), (-1, -1), (1, -1), (-2, 0), (2, 0), (-1, 1), (1, 1), (0, 2))
+SMALL_DIAMOND = ((0, -1), (-1, 0), (1, 0), (0, 1))
+
+# Veïns (dx, dy) d'un punt de la cerca en tres passos, per a un pas unitari
+THREE_STEP_NEIGHBOURS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+# Desplaçaments per tesel·la fins als quals el producte de matrius de totes les parelles surt més a compte que la FFT
+GEMM_SHIFTS_PER_TILE = 16
+
+# Diferència de correlació per sota de la qual dos desplaçaments es consideren empatats (soroll de coma flotant)
+TIE_TOLERANCE = 1e-9
+
+# El mateix per a cv2.matchTemplate, que treballa en precisió simple
+FLOAT32_TIE_TOLERANCE = 1e-6
+
+# Precisions de l'aritmètica de la cerca: coma flotant doble o simple, o teselles de 8 bits amb estadístiques enteres
+PRECISION_NAMES = ('float64', 'float32', 'uint8')
+
+# Fracció de parelles candidates a partir de la qual surt més a compte fer el producte de totes les parelles i descartar-ne
+GEMM_DENSE_FRACTION = 0.05
+
+# seekRange fins al qual la cerca piramidal ja no redueix més les teselles i hi fa una cerca exhaustiva
+PYRAMID_COARSE_SEEKRANGE = 2
+
+# Mida mínima (en píxels per eix) de les teselles del nivell més reduït de la piràmide
+PYRAMID_MIN_TILE_SIZE = 4
+
+# Mida mínima (en píxels per eix) de les teselles reduïdes que fan de descriptor a l'índex de veïns més propers
+ANN_DESCRIPTOR_SIZE = 4
+
+# seekRange a partir del qual la FFT (cost independent del desplaçament) surt més a compte que matchTemplate
+FFT_MIN_SEEKRANGE = 12
+
+
+def select_matcher(tile_shape, seekrange, n_candidates) -> str:
+    """
+    Tria el motor de correspondència segons la mida de la tesel·la, el rang de cerca i el nombre de teselles candidates.
+    El motor 'gemm' fa un producte de matrius per desplaçament amb totes les parelles, de manera que surt a compte
+    mentre el nombre de desplaçaments no sigui gran respecte al nombre de parelles.
+
+    Args:
+        tile_shape (tuple): Forma de la tesel·la (alçada, amplada[, canals]).
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        n_candidates (float): Nombre (mitjà) de teselles de referència amb què es compara cada tesel·la.
+
+    Returns:
+        str: Nom del motor ('roll', 'fft', 'opencv' o 'gemm').
+    """
+    if (2 * seekrange + 1) ** 2 <= GEMM_SHIFTS_PER_TILE * n_candidates:
+        return 'gemm'
+    return select_pair_matcher(tile_shape, seekrange)
+
+
+def select_pair_matcher(tile_shape, seekrange) -> str:
+    """
+    Tria el motor de correspondència per parelles més ràpid segons la mida de la tesel·la i el rang de cerca.
+
+    Args:
+        tile_shape (tuple): Forma de la tesel·la (alçada, amplada[, canals]).
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+
+    Returns:
+        str: Nom del motor ('roll', 'fft' o 'opencv').
+    """
+    if seekrange == 0:
+        # Sin desplazamientos basta con una única evaluación directa
+        return 'roll'
+    if seekrange >= FFT_MIN_SEEKRANGE or seekrange >= min(tile_shape[:2]):
+        # La ventana de búsqueda es grande respecto a la tesela: matchTemplate crece con los desplazamientos y la FFT no
+        return 'fft'
+    return 'opencv'
+
+
+def zero_mean_tile(tile) -> tuple[ndarray, float]:
+    """
+    Converteix una tesel·la a coma flotant, li resta la mitjana i en calcula la norma.
+
+    Args:
+        tile (ndarray): Tesel·la de la imatge.
+
+    Returns:
+        ndarray: Tesel·la de mitjana zero.
+        float: Norma euclidiana de la tesel·la de mitjana zero.
+    """
+    tile = tile.astype(float)
+    zero_mean = tile - np.mean(tile)
+    return zero_mean, np.sqrt(np.sum(zero_mean ** 2))
+
+
+def shift_window(seekrange, size) -> ndarray:
+    """
+    Retorna els índexs (mòdul la mida) dels desplaçaments de -seekrange a seekrange, en l'ordre de la cerca de referència.
+
+    Args:
+        seekrange (int): Desplaçament màxim.
+        size (int): Mida de l'eix de la tesel·la.
+
+    Returns:
+        ndarray: Índexs dels desplaçaments dins d'un mapa de correlació circular.
+    """
+    return np.arange(-seekrange, seekrange + 1) % size
+
+
+def best_shift(window, seekrange, tolerance=TIE_TOLERANCE) -> tuple:
+    """
+    Escull el millor desplaçament d'un mapa de correlacions indexat per (dy, dx).
+    En cas d'empat es queda el primer en l'ordre de recorregut de encoder.calculate_correlation.
+
+    Args:
+        window (ndarray): Mapa de correlacions de mida (2·seekrange+1, 2·seekrange+1).
+        seekrange (int): Desplaçament màxim.
+        tolerance (float): Diferència màxima per considerar dos valors empatats.
+
+    Returns:
+        float: Valor de correlació màxima.
+        tuple: Desplaçament (dx, dy) corresponent.
+    """
+    # Primer desplazamiento empatado con el máximo, para no depender del orden de las operaciones en coma flotante
+    index = int(np.argmax(window >= window.max() - tolerance))
+    dy, dx = divmod(index, window.shape[1])
+    return float(window.flat[index]), (dx - seekrange, dy - seekrange)
+
+
+def correlation_fft(current_tile, reference_tile, seekrange) -> tuple:
+    """
+    Correlació creuada normalitzada calculada amb la FFT. Com que np.roll fa un desplaçament circular,
+    la correlació de tots els desplaçaments és la correlació circular de les dues teselles de mitjana zero,
+    i la mitjana i la norma de la tesel·la desplaçada no canvien.
+
+    Args:
+        current_tile (ndarray): Tesela de la imatge actual.
+        reference_tile (ndarray): Tesela de la imatge de referència.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+
+    Returns:
+        float: Valor de correlació màxima entre les dues teselles considerant el desplaçament.
+        tuple: Posició de desplaçament de la tesela actual (dx, dy).
+    """
+    current, current_norm = zero_mean_tile(current_tile)
+    reference, reference_norm = zero_mean_tile(reference_tile)
+    denominator = current_norm * reference_norm
+    if denominator == 0 or np.isnan(denominator):
+        return -1, (0, 0)
+
+    height, width = reference.shape[:2]
+    # corr[dy, dx] = sum(roll(current, (dy, dx)) * reference)
+    spectrum = np.fft.rfft2(reference, axes=(0, 1)) * np.conj(np.fft.rfft2(current, axes=(0, 1)))
+    if spectrum.ndim == 3:
+        # Sumar la contribución de cada canal
+        spectrum = spectrum.sum(axis=2)
+    correlation_map = np.fft.irfft2(spectrum, s=(height, width))
+
+    window = correlation_map[np.ix_(shift_window(seekrange, height), shift_window(seekrange, width))]
+    return best_shift(window / denominator, seekrange)
+
+
+def correlation_opencv(current_tile, reference_tile, seekrange) -> tuple:
+    """
+    Correlació creuada normalitzada calculada amb cv2.matchTemplate (TM_CCOEFF_NORMED).
+    La tesel·la actual s'amplia de manera circular per reproduir el desplaçament de np.roll, i els canals
+    s'entrellacen en un únic pla perquè la mitjana sigui la de tota la tesel·la, com a la versió de referència.
+
+    Args:
+        current_tile (ndarray): Tesela de la imatge actual.
+        reference_tile (ndarray): Tesela de la imatge de referència.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+
+    Returns:
+        float: Valor de correlació màxima entre les dues teselles considerant el desplaçament.
+        tuple: Posició de desplaçament de la tesela actual (dx, dy).
+    """
+    height, width = reference_tile.shape[:2]
+    channels = reference_tile.shape[2] if reference_tile.ndim == 3 else 1
+    current = current_tile.astype(np.float32).reshape(height, width * channels)
+    reference = reference_tile.astype(np.float32).reshape(height, width * channels)
+    # Una tesela vacía o plana no tiene correlación definida
+    if current.size == 0 or current.min() == current.max() or reference.min() == reference.max():
+        return -1, (0, 0)
+
+    padded = np.pad(current, ((seekrange, seekrange), (seekrange * channels, seekrange * channels)), mode='wrap')
+    result = cv2.matchTemplate(padded, reference, cv2.TM_CCOEFF_NORMED)
+
+    # La posición (u, v) del resultado corresponde al desplazamiento (dy, dx) = (seekrange - u, seekrange - v / canales)
+    offsets = seekrange - np.arange(-seekrange, seekrange + 1)
+    window = result[np.ix_(offsets, offsets * channels)]
+    return best_shift(window, seekrange, FLOAT32_TIE_TOLERANCE)
+
+
+def ncc_window(current, reference, seekrange) -> tuple[ndarray, bool]:
+    """
+    Correlació creuada normalitzada de dues teselles per a tots els desplaçaments circulars de -seekrange a seekrange,
+    en una sola passada i sense arrays temporals: la tesel·la desplaçada es llegeix amb índexs mòdul la mida, en lloc
+    de copiar-la amb np.roll. Treballa en float32. Quan Numba està instal·lat, es compila sense el GIL, de manera que
+    els fils de l'encoder s'executen realment en paral·lel.
+
+    Args:
+        current (ndarray): Tesela de la imatge actual, de forma (alçada, amplada, canals).
+        reference (ndarray): Tesela de la imatge de referència, de la mateixa forma.
+        seekrange (int): Desplaçament màxim.
+
+    Returns:
+        ndarray: Mapa de correlacions de mida (2·seekrange+1, 2·seekrange+1), indexat per (dy, dx).
+        bool: Indica si la correlació està definida (cap de les dues teselles és plana).
+    """
+    height, width, channels = reference.shape
+    size = height * width * channels
+    current_mean = np.float32(0)
+    reference_mean = np.float32(0)
+    for y in range(height):
+        for x in range(width):
+            for c in range(channels):
+                current_mean += np.float32(current[y, x, c])
+                reference_mean += np.float32(reference[y, x, c])
+    current_mean /= np.float32(size)
+    reference_mean /= np.float32(size)
+    current_energy = np.float32(0)
+    reference_energy = np.float32(0)
+    for y in range(height):
+        for x in range(width):
+            for c in range(channels):
+                current_energy += (np.float32(current[y, x, c]) - current_mean) ** 2
+                reference_energy += (np.float32(reference[y, x, c]) - reference_mean) ** 2
+    window = np.zeros((2 * seekrange + 1, 2 * seekrange + 1), dtype=np.float32)
+    if current_energy == 0 or reference_energy == 0:
+        return window, False
+
+    denominator = np.sqrt(current_energy * reference_energy)
+    for dy in range(-seekrange, seekrange + 1):
+        for dx in range(-seekrange, seekrange + 1):
+            # np.roll(current, (dy, dx))[y, x] = current[y - dy, x - dx]
+            total = np.float32(0)
+            for y in range(height):
+                source_y = (y - dy) % height
+                for x in range(width):
+                    source_x = (x - dx) % width
+                    for c in range(channels):
+                        total += ((np.float32(current[source_y, source_x, c]) - current_mean)
+                                  * (np.float32(reference[y, x, c]) - reference_mean))
+            window[dy + seekrange, dx + seekrange] = total / denominator
+    return window, True
+
+
+def ncc_window_numpy(current, reference, seekrange) -> tuple[ndarray, bool]:
+    """
+    Versió NumPy de ncc_window, per quan Numba no està instal·lat: totes les finestres desplaçades es prenen com a
+    vistes d'una còpia circularment ampliada de la tesel·la actual i es multipliquen per la referència d'un sol cop.
+
+    Args:
+        current (ndarray): Tesela de la imatge actual, de forma (alçada, amplada, canals).
+        reference (ndarray): Tesela de la imatge de referència, de la mateixa forma.
+        seekrange (int): Desplaçament màxim.
+
+    Returns:
+        ndarray: Mapa de correlacions de mida (2·seekrange+1, 2·seekrange+1), indexat per (dy, dx).
+        bool: Indica si la correlació està definida (cap de les dues teselles és plana).
+    """
+    current = current.astype(np.float32)
+    reference = reference.astype(np.float32)
+    current -= current.mean()
+    reference -= reference.mean()
+    denominator = np.sqrt(np.sum(current ** 2) * np.sum(reference ** 2))
+    if denominator == 0:
+        return np.zeros((2 * seekrange + 1, 2 * seekrange + 1), dtype=np.float32), False
+
+    height, width = reference.shape[:2]
+    # Con la tesela ampliada circularmente, la ventana que empieza en (seekrange - dy, seekrange - dx) es roll(current, (dy, dx))
+    padded = np.pad(current, ((seekrange, seekrange), (seekrange, seekrange), (0, 0)), mode='wrap')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, (height, width), axis=(0, 1))
+    window = np.einsum('ijchw,hwc->ij', windows, reference)[::-1, ::-1]
+    return window / denominator, True
+
+
+if numba is not None:
+    ncc_window = numba.njit(nogil=True, cache=True)(ncc_window)
+
+
+def correlation_numba(current_tile, reference_tile, seekrange) -> tuple:
+    """
+    Correlació creuada normalitzada amb el nucli ncc_window compilat amb Numba, o amb la seva versió NumPy si
+    Numba no està instal·lat.
+
+    Args:
+        current_tile (ndarray): Tesela de la imatge actual.
+        reference_tile (ndarray): Tesela de la imatge de referència.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+
+    Returns:
+        float: Valor de correlació màxima entre les dues teselles considerant el desplaçament.
+        tuple: Posició de desplaçament de la tesela actual (dx, dy).
+    """
+    # El núcleo trabaja siempre con tres ejes (alto, ancho, canales)
+    current = current_tile.reshape(*current_tile.shape[:2], -1)
+    reference = reference_tile.reshape(*reference_tile.shape[:2], -1)
+    kernel = ncc_window if numba is not None else ncc_window_numpy
+    window, defined = kernel(current, reference, seekrange)
+    if not defined:
+        return -1, (0, 0)
+    return best_shift(window, seekrange, FLOAT32_TIE_TOLERANCE)
+
+
+def correlation_integer(current_tile, reference_tile, seekrange) -> tuple:
+    """
+    Fa la mateixa cerca que encoder.calculate_correlation amb aritmètica entera sobre teselles de 8 bits. Un
+    desplaçament circular no canvia la suma ni la suma dels quadrats de la tesel·la, de manera que per a cada
+    desplaçament només cal el producte escalar Σab, que s'acumula en int32 (o en int64 si la tesel·la és massa
+    gran). La correlació és (n·Σab - Σa·Σb) / sqrt((n·Σa² - (Σa)²)·(n·Σb² - (Σb)²)), exacta fins a la divisió final.
+
+    Args:
+        current_tile (ndarray): Tesel·la de la imatge actual, de 8 bits.
+        reference_tile (ndarray): Tesel·la de la imatge de referència, de 8 bits.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+
+    Returns:
+        float: Valor de correlació màxima entre les dues teselles considerant el desplaçament.
+        tuple: Posició de desplaçament de la tesel·la actual (dx, dy).
+    """
+    size = current_tile.size
+    accumulator = np.int32 if size * 255 ** 2 <= np.iinfo(np.int32).max else np.int64
+    current = current_tile.astype(accumulator)
+    reference = reference_tile.astype(accumulator)
+    # Los productos de enteros de Python no desbordan
+    current_sum = int(current.sum(dtype=np.int64))
+    reference_sum = int(reference.sum(dtype=np.int64))
+    current_energy = size * int(np.vdot(current.astype(np.int64), current)) - current_sum ** 2
+    reference_energy = size * int(np.vdot(reference.astype(np.int64), reference)) - reference_sum ** 2
+    if current_energy == 0 or reference_energy == 0:
+        return -1, (0, 0)
+    denominator = np.sqrt(float(current_energy)) * np.sqrt(float(reference_energy))
+
+    window = np.empty((2 * seekrange + 1, 2 * seekrange + 1))
+    for dy in range(-seekrange, seekrange + 1):
+        for dx in range(-seekrange, seekrange + 1):
+            shifted = np.roll(current, shift=(dy, dx), axis=(0, 1))
+            numerator = size * int(np.vdot(shifted, reference)) - current_sum * reference_sum
+            window[dy + seekrange, dx + seekrange] = numerator / denominator
+    # Los numeradores son exactos: dos desplazamientos solo empatan si su correlación es idéntica
+    return best_shift(window, seekrange, 0)
+
+
+def normalize_tiles(tiles, precision='float64') -> tuple[ndarray, ndarray]:
+    """
+    Resta la mitjana i normalitza a norma unitat cada tesel·la d'una pila de teselles.
+
+    Args:
+        tiles (ndarray): Pila de teselles de forma (n, alçada, amplada[, canals]).
+        precision (str): Precisió de la cerca ('float64', 'float32' o 'uint8'). Amb 'float32' les teselles normalitzades
+            es guarden en precisió simple; amb 'uint8', a més, la mitjana i la norma es calculen exactament amb enters.
+
+    Returns:
+        ndarray: Teselles de mitjana zero i norma 1 (les teselles planes queden a zero).
+        ndarray: Norma de cada tesel·la de mitjana zero (0 per a les teselles planes, sense correlació definida).
+    """
+    dtype = np.float64 if precision == 'float64' else np.float32
+    axes = tuple(range(1, tiles.ndim))
+    shape = (-1,) + (1,) * (tiles.ndim - 1)
+    if precision == 'uint8':
+        # n·Σx² - (Σx)² es n veces la energía de la tesela de media cero, sin error de redondeo
+        flat = tiles.reshape(len(tiles), -1).astype(np.int64)
+        size = flat.shape[1]
+        sums = flat.sum(axis=1)
+        energies = size * np.einsum('ij,ij->i', flat, flat) - sums ** 2
+        norms = np.sqrt(energies / size)
+        zero_mean = tiles.astype(dtype) - (sums / size).astype(dtype).reshape(shape)
+    else:
+        tiles = tiles.astype(dtype)
+        zero_mean = tiles - tiles.mean(axis=axes, keepdims=True)
+        norms = np.sqrt(np.sum(zero_mean ** 2, axis=axes))
+    # Evitar la división por cero en las teselas planas, que se quedan a cero
+    safe_norms = np.where(norms > 0, norms, 1).reshape(shape)
+    return (zero_mean / safe_norms).astype(dtype, copy=False), norms
+
+
+class TileStack:
+    """
+    Teselles d'una imatge apilades, amb les estadístiques que fan servir els motors de correspondència:
+    les teselles de mitjana zero i norma unitat, les seves normes i, quan el motor FFT les demana, les seves
+    transformades. Per a la imatge de referència d'un GOP es construeix una sola vegada i la reutilitzen
+    totes les imatges P del grup, en lloc de recalcular-ho per a cada comparació.
+
+    Attributes:
+        positions (list): Posició (fila, columna) de cada tesel·la, en l'ordre de la pila.
+        tiles (ndarray): Teselles originals, de forma (n, alçada, amplada[, canals]).
+        normalized (ndarray): Teselles de mitjana zero i norma 1.
+        norms (ndarray): Norma de cada tesel·la de mitjana zero.
+        precision (str): Precisió de la cerca ('float64', 'float32' o 'uint8').
+    """
+
+    def __init__(self, tiles, precision='float64'):
+        """
+        Args:
+            tiles (dict): Teselles de la imatge, indexades per la seva posició (fila, columna).
+            precision (str): Precisió de la cerca. Amb 'uint8', les teselles que no són de 8 bits (per exemple, les
+                de luminància o les reduïdes) s'arrodoneixen a 8 bits.
+        """
+        self.positions = list(tiles.keys())
+        self.tiles = np.stack(list(tiles.values()))
+        if precision == 'uint8' and self.tiles.dtype != np.uint8:
+            self.tiles = np.clip(np.rint(self.tiles), 0, 255).astype(np.uint8)
+        self.precision = precision
+        self.normalized, self.norms = normalize_tiles(self.tiles, precision)
+        self._spectra = None
+        self._sorted_values = None
+        self._downsampled = None
+        self._digest = None
+        self._ann_index = None
+
+    def __len__(self) -> int:
+        return len(self.tiles)
+
+    @property
+    def tile_shape(self) -> tuple:
+        """Forma (alçada, amplada) de les teselles."""
+        return self.tiles.shape[1:3]
+
+    @property
+    def tolerance(self) -> float:
+        """Diferència de correlació per sota de la qual dos valors es consideren empatats, segons la precisió."""
+        return TIE_TOLERANCE if self.precision == 'float64' else FLOAT32_TIE_TOLERANCE
+
+    @property
+    def valid(self) -> ndarray:
+        """Màscara de les teselles amb correlació definida (no planes)."""
+        return self.norms > 0
+
+    @property
+    def spectra(self) -> ndarray:
+        """Transformada de Fourier (rfft2) de les teselles normalitzades, calculada la primera vegada que es demana."""
+        if self._spectra is None:
+            self._spectra = np.fft.rfft2(self.normalized, axes=(1, 2))
+        return self._spectra
+
+    @property
+    def sorted_values(self) -> ndarray:
+        """Valors de cada tesel·la normalitzada ordenats de menor a major, de forma (n, píxels), calculats la primera vegada que es demanen."""
+        if self._sorted_values is None:
+            self._sorted_values = np.sort(self.normalized.reshape(len(self), -1), axis=1)
+        return self._sorted_values
+
+    @property
+    def digest(self) -> str:
+        """Resum (SHA-1) del contingut de les teselles, calculat la primera vegada que es demana."""
+        if self._digest is None:
+            digest = hashlib.sha1(f"{self.tiles.shape}{self.tiles.dtype.str}".encode())
+            digest.update(self.tiles)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    @property
+    def descriptors(self) -> ndarray:
+        """
+        Descriptor compacte de cada tesel·la, de forma (n, dimensions): la tesel·la reduïda amb la piràmide fins a
+        tenir uns ANN_DESCRIPTOR_SIZE píxels per eix, de mitjana zero i norma 1. La distància euclidiana entre dos
+        descriptors és sqrt(2 - 2·correlació) de les teselles reduïdes, i la reducció els fa poc sensibles a
+        desplaçaments petits.
+        """
+        level = 0
+        while min(self.tile_shape) // 2 ** (level + 1) >= ANN_DESCRIPTOR_SIZE:
+            level += 1
+        return self.pyramid_level(level).normalized.reshape(len(self), -1)
+
+    @property
+    def ann_index(self) -> cKDTree:
+        """Arbre k-d dels descriptors de les teselles, construït la primera vegada que es demana."""
+        if self._ann_index is None:
+            self._ann_index = cKDTree(self.descriptors)
+        return self._ann_index
+
+    def pyramid_level(self, level) -> 'TileStack':
+        """
+        Retorna les teselles reduïdes 2^level vegades (fent la mitjana de blocs de 2x2 píxels a cada nivell).
+        Cada nivell es calcula una sola vegada i es guarda amb el nivell anterior.
+
+        Args:
+            level (int): Nivell de la piràmide (0 per a les teselles originals).
+
+        Returns:
+            TileStack: Teselles del nivell indicat.
+        """
+        if level == 0:
+            return self
+        if self._downsampled is None:
+            height, width = self.tile_shape[0] // 2, self.tile_shape[1] // 2
+            blocks = self.tiles[:, :2 * height, :2 * width].astype(float)
+            blocks = blocks.reshape(len(self), height, 2, width, 2, *self.tiles.shape[3:])
+            # Las teselas reducidas ya no son de 8 bits: con 'uint8' se quedan en precisión simple
+            precision = 'float32' if self.precision == 'uint8' else self.precision
+            self._downsampled = TileStack(dict(zip(self.positions, blocks.mean(axis=(2, 4)))), precision)
+        return self._downsampled.pyramid_level(level - 1)
+
+
+def ann_candidates(current_stack, reference_stack, k) -> ndarray:
+    """
+    Tria, per a cada tesel·la actual, les k teselles de referència amb el descriptor més proper, consultant l'índex
+    de la imatge de referència (que es construeix una sola vegada per GOP). Només aquestes parelles es comparen
+    després amb la correlació completa.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+        k (int): Nombre de teselles de referència candidates per a cada tesel·la actual.
+
+    Returns:
+        ndarray: Màscara booleana (n_actuals, n_referència) de les parelles candidates.
+    """
+    k = min(k, len(reference_stack))
+    _, neighbours = reference_stack.ann_index.query(current_stack.descriptors, k=k)
+    candidates = np.zeros((len(current_stack), len(reference_stack)), dtype=bool)
+    candidates[np.arange(len(current_stack))[:, None], np.reshape(neighbours, (len(current_stack), k))] = True
+    return candidates
+
+
+def correlation_bound(current_stack, reference_stack) -> ndarray:
+    """
+    Cota superior de la correlació de cada parella de teselles per a qualsevol desplaçament. Un desplaçament
+    circular només reordena els píxels de la tesel·la, i per la desigualtat de reordenació el producte escalar
+    de dues teselles normalitzades és màxim quan tots dos tenen els valors ordenats. Si la cota no arriba a la
+    qualitat, la parella no cal avaluar-la. Les parelles amb alguna tesel·la plana valen -1, com la seva correlació.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) amb la cota de la correlació de cada parella.
+    """
+    bound = current_stack.sorted_values @ reference_stack.sorted_values.T
+    # Margen para el error de redondeo, de modo que la cota nunca quede por debajo de la correlación calculada
+    bound += max(current_stack.tolerance, reference_stack.tolerance)
+    bound[~np.outer(current_stack.valid, reference_stack.valid)] = -1
+    return bound
+
+
+def correlation_matrix(current_stack, reference_stack, seekrange, candidates=None) -> tuple[ndarray, ndarray]:
+    """
+    Calcula la correlació normalitzada de totes les parelles (tesel·la actual, tesel·la de referència) alhora.
+    Amb les teselles de mitjana zero i norma unitat aplanades, la correlació de totes les parelles per a un
+    desplaçament és el producte de matrius (actuals desplaçades) x (referència)^T, i només cal un producte per desplaçament.
+    Si només s'han d'avaluar poques parelles, es calculen només les candidates, de manera que el cost creix amb
+    el nombre de parelles candidates i no amb el quadrat del nombre de teselles.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        candidates (ndarray): Màscara booleana (n_actuals, n_referència) de les parelles a avaluar. Si és None, s'avaluen totes.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) amb la correlació màxima de cada parella (-1 si no està definida, -inf si no s'ha avaluat).
+        ndarray: Matriu (n_actuals, n_referència, 2) amb el desplaçament (dx, dy) de la correlació màxima.
+    """
+    current = current_stack.normalized
+    reference = reference_stack.normalized
+
+    if candidates is None:
+        scores, shifts = all_pairs_correlation(current, reference, seekrange)
+    else:
+        # Solo intervienen las teselas con alguna pareja candidata
+        scores = np.full(candidates.shape, -np.inf)
+        shifts = np.zeros(candidates.shape + (2,), dtype=int)
+        block_rows = np.nonzero(candidates.any(axis=1))[0]
+        block_columns = np.nonzero(candidates.any(axis=0))[0]
+        block = np.ix_(block_rows, block_columns)
+        block_candidates = candidates[block]
+        if block_candidates.size and block_candidates.mean() > GEMM_DENSE_FRACTION:
+            scores[block], shifts[block] = all_pairs_correlation(current[block_rows], reference[block_columns], seekrange)
+            scores[~candidates] = -np.inf
+            shifts[~candidates] = 0
+        elif block_candidates.size:
+            scores[block], shifts[block] = candidate_pairs_correlation(current[block_rows], reference[block_columns],
+                                                                       seekrange, block_candidates)
+
+    return mark_undefined(scores, shifts, current_stack, reference_stack)
+
+
+def mark_undefined(scores, shifts, current_stack, reference_stack) -> tuple[ndarray, ndarray]:
+    """
+    Posa a -1 (sense desplaçament) les parelles avaluades en què alguna de les dues teselles és plana,
+    com fa encoder.calculate_correlation quan la correlació no està definida.
+
+    Args:
+        scores (ndarray): Matriu de correlacions (n_actuals, n_referència).
+        shifts (ndarray): Matriu de desplaçaments (n_actuals, n_referència, 2).
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+
+    Returns:
+        ndarray: Matriu de correlacions corregida.
+        ndarray: Matriu de desplaçaments corregida.
+    """
+    undefined = ~np.outer(current_stack.valid, reference_stack.valid) & (scores > -np.inf)
+    scores[undefined] = -1
+    shifts[undefined] = 0
+    return scores, shifts
+
+
+def all_pairs_correlation(current, reference, seekrange) -> tuple[ndarray, ndarray]:
+    """
+    Correlació de totes les parelles de teselles normalitzades, amb un producte de matrius per desplaçament.
+
+    Args:
+        current (ndarray): Teselles actuals de mitjana zero i norma 1.
+        reference (ndarray): Teselles de referència de mitjana zero i norma 1.
+        seekrange (int): Desplaçament màxim.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) amb la correlació màxima de cada parella.
+        ndarray: Matriu (n_actuals, n_referència, 2) amb el desplaçament (dx, dy) de la correlació màxima.
+    """
+    reference_matrix = reference.reshape(len(reference), -1).T
+    scores = np.full((len(current), len(reference)), -1.0)
+    shifts = np.zeros((len(current), len(reference), 2), dtype=int)
+    # Mismo orden de recorrido que encoder.calculate_correlation para desempatar igual
+    for dy in range(-seekrange, seekrange + 1):
+        for dx in range(-seekrange, seekrange + 1):
+            # El desplazamiento circular conserva la media y la norma de cada tesela
+            shifted = np.roll(current, shift=(dy, dx), axis=(1, 2)).reshape(len(current), -1)
+            correlation = shifted @ reference_matrix
+            better = correlation > scores + TIE_TOLERANCE
+            scores[better] = correlation[better]
+            shifts[better] = (dx, dy)
+    return scores, shifts
+
+
+def candidate_pairs_correlation(current, reference, seekrange, candidates) -> tuple[ndarray, ndarray]:
+    """
+    Correlació només de les parelles candidates de teselles normalitzades. Les candidates de cada tesel·la actual
+    es reuneixen una sola vegada i, per a cada desplaçament, cada tesel·la actual es multiplica només per les seves
+    candidates (un producte matriu-vector per tesel·la). Necessita tanta memòria com el nombre màxim de candidates
+    per tesel·la multiplicat per la mida de la imatge.
+
+    Args:
+        current (ndarray): Teselles actuals de mitjana zero i norma 1.
+        reference (ndarray): Teselles de referència de mitjana zero i norma 1.
+        seekrange (int): Desplaçament màxim.
+        candidates (ndarray): Màscara booleana (n_actuals, n_referència) de les parelles a avaluar.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) amb la correlació màxima de cada parella (-inf si no s'ha avaluat).
+        ndarray: Matriu (n_actuals, n_referència, 2) amb el desplaçament (dx, dy) de la correlació màxima.
+    """
+    # Índices de las candidatas de cada tesela (en orden), completados hasta el máximo de candidatas por tesela
+    counts = candidates.sum(axis=1)
+    columns = np.argsort(~candidates, axis=1, kind='stable')[:, :max(counts.max(), 1)]
+    slots = np.arange(columns.shape[1]) < counts[:, None]
+    reference_candidates = reference.reshape(len(reference), -1)[columns]
+
+    candidate_scores = np.full(columns.shape, -1.0)
+    candidate_shifts = np.zeros(columns.shape + (2,), dtype=int)
+    # Mismo orden de recorrido que encoder.calculate_correlation para desempatar igual
+    for dy in range(-seekrange, seekrange + 1):
+        for dx in range(-seekrange, seekrange + 1):
+            shifted = np.roll(current, shift=(dy, dx), axis=(1, 2)).reshape(len(current), -1)
+            correlation = np.matmul(reference_candidates, shifted[:, :, None])[:, :, 0]
+            better = correlation > candidate_scores + TIE_TOLERANCE
+            candidate_scores[better] = correlation[better]
+            candidate_shifts[better] = (dx, dy)
+
+    # Volver a la forma de matriz, con las parejas no evaluadas a -inf
+    rows = np.broadcast_to(np.arange(len(current))[:, None], columns.shape)
+    scores = np.full((len(current), len(reference)), -np.inf)
+    shifts = np.zeros((len(current), len(reference), 2), dtype=int)
+    scores[rows[slots], columns[slots]] = candidate_scores[slots]
+    shifts[rows[slots], columns[slots]] = candidate_shifts[slots]
+    return scores, shifts
+
+
+def shift_correlation(current, reference, rows, columns, dxs, dys) -> ndarray:
+    """
+    Calcula la correlació de parelles de teselles normalitzades, cadascuna amb el seu propi desplaçament.
+    Les peticions s'agrupen per desplaçament: si un grup cobreix bona part del bloc (teselles actuals x teselles de
+    referència) que toca, es resol amb un producte de matrius; si no, amb el producte escalar de cada parella.
+
+    Args:
+        current (ndarray): Teselles actuals de mitjana zero i norma 1.
+        reference (ndarray): Teselles de referència de mitjana zero i norma 1.
+        rows (ndarray): Índex de la tesel·la actual de cada petició.
+        columns (ndarray): Índex de la tesel·la de referència de cada petició.
+        dxs (ndarray): Desplaçament horitzontal de cada petició.
+        dys (ndarray): Desplaçament vertical de cada petició.
+
+    Returns:
+        ndarray: Correlació de cada petició.
+    """
+    reference_matrix = reference.reshape(len(reference), -1)
+    correlation = np.empty(len(rows))
+    if len(rows) == 0:
+        return correlation
+    # Codificar cada desplazamiento como un entero para agrupar las peticiones
+    span = int(dxs.max() - dxs.min()) + 1
+    keys = (dys - dys.min()) * span + (dxs - dxs.min())
+    unique_keys, groups = np.unique(keys, return_inverse=True)
+    unique_shifts = np.stack([unique_keys // span + dys.min(), unique_keys % span + dxs.min()], axis=1)
+    # Ordenar las peticiones por grupo para recorrer cada grupo como un tramo contiguo
+    order = np.argsort(groups, kind='stable')
+    bounds = np.searchsorted(groups[order], np.arange(len(unique_shifts) + 1))
+    row_lookup = np.empty(len(current), dtype=int)
+    column_lookup = np.empty(len(reference), dtype=int)
+    for group, (dy, dx) in enumerate(unique_shifts):
+        members = order[bounds[group]:bounds[group + 1]]
+        block_rows = np.flatnonzero(np.bincount(rows[members], minlength=len(current)))
+        block_columns = np.flatnonzero(np.bincount(columns[members], minlength=len(reference)))
+        row_lookup[block_rows] = np.arange(len(block_rows))
+        column_lookup[block_columns] = np.arange(len(block_columns))
+        shifted = np.roll(current[block_rows], shift=(dy, dx), axis=(1, 2)).reshape(len(block_rows), -1)
+        if len(members) >= GEMM_DENSE_FRACTION * len(block_rows) * len(block_columns):
+            block = shifted @ reference_matrix[block_columns].T
+            correlation[members] = block[row_lookup[rows[members]], column_lookup[columns[members]]]
+        else:
+            correlation[members] = np.einsum('ij,ij->i', shifted[row_lookup[rows[members]]], reference_matrix[columns[members]])
+    return correlation
+
+
+def pattern_search(current_stack, reference_stack, seekrange, strategy, candidates=None) -> tuple[ndarray, ndarray]:
+    """
+    Cerca ràpida del desplaçament per a totes les parelles candidates alhora, amb la cerca en tres passos
+    ('threestep') o la cerca en diamant ('diamond'). En lloc d'avaluar els (2·seekrange+1)² desplaçaments,
+    cada parella parteix del desplaçament nul i es mou cap al veí amb més correlació.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        strategy (str): Estratègia de cerca ('threestep' o 'diamond').
+        candidates (ndarray): Màscara booleana (n_actuals, n_referència) de les parelles a avaluar. Si és None, s'avaluen totes.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) amb la millor correlació trobada (-1 si no està definida, -inf si no s'ha avaluat).
+        ndarray: Matriu (n_actuals, n_referència, 2) amb el desplaçament (dx, dy) de la millor correlació trobada.
+    """
+    current = current_stack.normalized
+    reference = reference_stack.normalized
+    if candidates is None:
+        candidates = np.ones((len(current), len(reference)), dtype=bool)
+    # Solo tiene sentido buscar en las parejas con correlación definida
+    rows, columns = np.nonzero(candidates & np.outer(current_stack.valid, reference_stack.valid))
+
+    centers = np.zeros((len(rows), 2), dtype=int)
+    best = shift_correlation(current, reference, rows, columns, centers[:, 0], centers[:, 1])
+
+    if strategy == 'threestep':
+        step = 1 << (seekrange.bit_length() - 1) if seekrange > 0 else 0
+        while step >= 1:
+            best, centers, _ = pattern_step(current, reference, rows, columns, best, centers,
+                                            np.array(THREE_STEP_NEIGHBOURS) * step, seekrange)
+            step //= 2
+    elif strategy == 'diamond':
+        active = np.ones(len(rows), dtype=bool)
+        # El diamante grande se repite mientras mejore; cada movimiento mejora la correlación, así que termina
+        while seekrange > 0 and active.any():
+            best[active], centers[active], moved = pattern_step(current, reference, rows[active], columns[active],
+                                                                best[active], centers[active], np.array(LARGE_DIAMOND), seekrange)
+            active[active] = moved
+        if seekrange > 0:
+            best, centers, _ = pattern_step(current, reference, rows, columns, best, centers, np.array(SMALL_DIAMOND), seekrange)
+    else:
+        raise ValueError(f"Estratègia de cerca desconeguda: {strategy}")
+
+    return pair_results(candidates, rows, columns, best, centers)
+
+
+def pyramid_search(current_stack, reference_stack, seekrange, candidates=None) -> tuple[ndarray, ndarray]:
+    """
+    Cerca del desplaçament de gruixut a fi. Les teselles es redueixen a la meitat tantes vegades com calgui perquè
+    el desplaçament màxim del nivell més reduït sigui petit; en aquest nivell es fa una cerca exhaustiva i, a cada
+    nivell més fi, el desplaçament trobat es duplica i es refina avaluant els seus 8 veïns. El cost creix amb el
+    logaritme del seekRange, en lloc del seu quadrat.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        candidates (ndarray): Màscara booleana (n_actuals, n_referència) de les parelles a avaluar. Si és None, s'avaluen totes.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) amb la millor correlació trobada (-1 si no està definida, -inf si no s'ha avaluat).
+        ndarray: Matriu (n_actuals, n_referència, 2) amb el desplaçament (dx, dy) de la millor correlació trobada.
+    """
+    if candidates is None:
+        candidates = np.ones((len(current_stack), len(reference_stack)), dtype=bool)
+    rows, columns = np.nonzero(candidates & np.outer(current_stack.valid, reference_stack.valid))
+
+    levels = pyramid_levels(current_stack.tile_shape, seekrange)
+    # Búsqueda exhaustiva en el nivel más reducido
+    level_seekrange = -(-seekrange // 2 ** levels)
+    scores, shifts = correlation_matrix(current_stack.pyramid_level(levels), reference_stack.pyramid_level(levels),
+                                        level_seekrange, candidates)
+    best = scores[rows, columns]
+    centers = shifts[rows, columns]
+
+    for level in range(levels - 1, -1, -1):
+        current = current_stack.pyramid_level(level).normalized
+        reference = reference_stack.pyramid_level(level).normalized
+        level_seekrange = -(-seekrange // 2 ** level)
+        # Llevar el desplazamiento al nivel más fino y refinarlo con sus vecinos
+        centers = np.clip(2 * centers, -level_seekrange, level_seekrange)
+        best = shift_correlation(current, reference, rows, columns, centers[:, 0], centers[:, 1])
+        best, centers, _ = pattern_step(current, reference, rows, columns, best, centers,
+                                        np.array(THREE_STEP_NEIGHBOURS), level_seekrange)
+
+    return pair_results(candidates, rows, columns, best, centers)
+
+
+def pyramid_levels(tile_shape, seekrange) -> int:
+    """
+    Calcula quantes vegades la cerca piramidal redueix les teselles: fins que el desplaçament màxim del nivell
+    és com a molt PYRAMID_COARSE_SEEKRANGE, sense que les teselles quedin més petites que PYRAMID_MIN_TILE_SIZE.
+
+    Args:
+        tile_shape (tuple): Forma de les teselles (alçada, amplada).
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+
+    Returns:
+        int: Nombre de nivells de reducció.
+    """
+    levels = 0
+    while (-(-seekrange // 2 ** levels) > PYRAMID_COARSE_SEEKRANGE
+           and min(tile_shape) // 2 ** (levels + 1) >= PYRAMID_MIN_TILE_SIZE):
+        levels += 1
+    return levels
+
+
+def predictive_search(current_stack, reference_stack, seekrange, previous_field, candidates=None) -> tuple[ndarray, ndarray]:
+    """
+    Cerca del desplaçament a partir del moviment previst. Les teselles es recorren per files de la graella i cada
+    parella prova primer el desplaçament nul, el de la tesel·la a la mateixa posició de la imatge P anterior
+    (predictor temporal) i la mediana dels de les teselles veïnes de la fila anterior, ja resoltes (predictor espacial).
+    Des del millor dels tres es refina una sola vegada, avaluant-ne els 8 veïns. Amb moviments suaus, com un pla de
+    càmera, el desplaçament es troba amb 11 avaluacions per parella, sigui quin sigui el seekRange.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        previous_field (ndarray): Camp de moviment (files, columnes, 2) de la imatge P anterior: el desplaçament (dx, dy)
+            de la millor coincidència de cada tesel·la. Zeros si no n'hi ha.
+        candidates (ndarray): Màscara booleana (n_actuals, n_referència) de les parelles a avaluar. Si és None, s'avaluen totes.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) amb la millor correlació trobada (-1 si no està definida, -inf si no s'ha avaluat).
+        ndarray: Matriu (n_actuals, n_referència, 2) amb el desplaçament (dx, dy) de la millor correlació trobada.
+    """
+    current = current_stack.normalized
+    reference = reference_stack.normalized
+    if candidates is None:
+        candidates = np.ones((len(current), len(reference)), dtype=bool)
+    rows, columns = np.nonzero(candidates & np.outer(current_stack.valid, reference_stack.valid))
+    positions = np.array(current_stack.positions).reshape(-1, 2)
+    best = np.full(len(rows), -np.inf)
+    centers = np.zeros((len(rows), 2), dtype=int)
+    # Campo de movimiento de la imagen actual, que se completa fila a fila
+    field = np.zeros_like(previous_field)
+
+    for grid_row in np.unique(positions[:, 0]):
+        tiles_in_row = np.flatnonzero(positions[:, 0] == grid_row)
+        pairs = np.flatnonzero(np.isin(rows, tiles_in_row))
+        tile_rows, tile_columns = positions[rows[pairs]].T
+        temporal = previous_field[tile_rows, tile_columns]
+        spatial = temporal
+        if grid_row > 0:
+            # Mediana de las vecinas de la fila anterior (arriba a la izquierda, arriba y arriba a la derecha)
+            neighbours = np.clip(tile_columns[:, None] + np.arange(-1, 2), 0, field.shape[1] - 1)
+            spatial = np.median(field[grid_row - 1][neighbours], axis=1).round().astype(int)
+        predictors = np.stack([np.zeros_like(temporal), temporal, spatial], axis=1)
+        predictors = np.clip(predictors, -seekrange, seekrange)
+
+        correlation = shift_correlation(current, reference, np.repeat(rows[pairs], 3), np.repeat(columns[pairs], 3),
+                                        predictors[:, :, 0].ravel(), predictors[:, :, 1].ravel()).reshape(-1, 3)
+        # Primer predictor empatado con el máximo de cada pareja
+        chosen = np.argmax(correlation >= correlation.max(axis=1, keepdims=True) - TIE_TOLERANCE, axis=1) if len(pairs) else np.zeros(0, dtype=int)
+        row_best = correlation[np.arange(len(pairs)), chosen]
+        row_centers = predictors[np.arange(len(pairs)), chosen]
+        if seekrange > 0:
+            # Refinar en una ventana de ±1 alrededor del predictor
+            row_best, row_centers, _ = pattern_step(current, reference, rows[pairs], columns[pairs], row_best, row_centers,
+                                                    np.array(THREE_STEP_NEIGHBOURS), seekrange)
+        best[pairs] = row_best
+        centers[pairs] = row_centers
+
+        # El movimiento de cada tesela es el de su mejor pareja (nulo si no se ha evaluado ninguna)
+        for tile in tiles_in_row:
+            tile_pairs = pairs[rows[pairs] == tile]
+            if len(tile_pairs):
+                field[tuple(positions[tile])] = centers[tile_pairs[np.argmax(best[tile_pairs])]]
+
+    return pair_results(candidates, rows, columns, best, centers)
+
+
+def pair_results(candidates, rows, columns, best, centers) -> tuple[ndarray, ndarray]:
+    """
+    Construeix les matrius de correlació i desplaçament a partir dels resultats de les parelles avaluades.
+
+    Args:
+        candidates (ndarray): Màscara booleana (n_actuals, n_referència) de les parelles candidates.
+        rows (ndarray): Índex de la tesel·la actual de cada parella avaluada.
+        columns (ndarray): Índex de la tesel·la de referència de cada parella avaluada.
+        best (ndarray): Millor correlació de cada parella avaluada.
+        centers (ndarray): Desplaçament (dx, dy) de la millor correlació de cada parella avaluada.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) de correlacions (-1 per a les candidates sense correlació definida, -inf per a la resta).
+        ndarray: Matriu (n_actuals, n_referència, 2) de desplaçaments.
+    """
+    scores = np.full(candidates.shape, -np.inf)
+    shifts = np.zeros(candidates.shape + (2,), dtype=int)
+    scores[candidates] = -1
+    scores[rows, columns] = best
+    shifts[rows, columns] = centers
+    return scores, shifts
+
+
+def pattern_step(current, reference, rows, columns, best, centers, pattern, seekrange) -> tuple[ndarray, ndarray, ndarray]:
+    """
+    Avalua un patró de desplaçaments al voltant del centre actual de cada parella i mou el centre al millor punt.
+
+    Args:
+        current (ndarray): Teselles actuals de mitjana zero i norma 1.
+        reference (ndarray): Teselles de referència de mitjana zero i norma 1.
+        rows (ndarray): Índex de la tesel·la actual de cada parella.
+        columns (ndarray): Índex de la tesel·la de referència de cada parella.
+        best (ndarray): Millor correlació trobada fins ara per a cada parella.
+        centers (ndarray): Desplaçament (dx, dy) de la millor correlació de cada parella.
+        pattern (ndarray): Desplaçaments relatius (dx, dy) a avaluar.
+        seekrange (int): Desplaçament màxim.
+
+    Returns:
+        ndarray: Millor correlació actualitzada.
+        ndarray: Centres actualitzats.
+        ndarray: Màscara de les parelles que s'han mogut.
+    """
+    points = centers[:, None, :] + pattern[None, :, :]
+    # Los puntos fuera de la ventana de búsqueda no se evalúan
+    inside = np.all(np.abs(points) <= seekrange, axis=2)
+    correlation = np.full(inside.shape, -np.inf)
+    pair_index = np.broadcast_to(np.arange(len(rows))[:, None], inside.shape)[inside]
+    correlation[inside] = shift_correlation(current, reference, rows[pair_index], columns[pair_index],
+                                            points[inside][:, 0], points[inside][:, 1])
+
+    # Primer punto del patrón empatado con el máximo de cada pareja
+    maxima = correlation.max(axis=1, keepdims=True) if len(rows) else correlation
+    chosen = np.argmax(correlation >= maxima - TIE_TOLERANCE, axis=1)
+    candidate = correlation[np.arange(len(rows)), chosen]
+    moved = candidate > best + TIE_TOLERANCE
+    best = np.where(moved, candidate, best)
+    centers = np.where(moved[:, None], points[np.arange(len(rows)), chosen], centers)
+    return best, centers, moved
+
+
+def fft_correlation(current_stack, reference_stack, seekrange, candidates=None) -> tuple[ndarray, ndarray]:
+    """
+    Versió per piles del motor FFT: les transformades de les teselles es calculen una sola vegada per imatge
+    (i les de referència, una vegada per GOP), i per a cada tesel·la actual es calculen alhora els mapes de
+    correlació circular amb totes les seves candidates.
+
+    Args:
+        current_stack (TileStack): Teselles de la imatge actual.
+        reference_stack (TileStack): Teselles de la imatge de referència.
+        seekrange (int): Desplaçament màxim en la cerca de teselles coincidents.
+        candidates (ndarray): Màscara booleana (n_actuals, n_referència) de les parelles a avaluar. Si és None, s'avaluen totes.
+
+    Returns:
+        ndarray: Matriu (n_actuals, n_referència) amb la correlació màxima de cada parella (-1 si no està definida, -inf si no s'ha avaluat).
+        ndarray: Matriu (n_actuals, n_referència, 2) amb el desplaçament (dx, dy) de la correlació màxima.
+    """
+    height, width = current_stack.tile_shape
+    window = np.ix_(shift_window(seekrange, height), shift_window(seekrange, width))
+    size = 2 * seekrange + 1
+    scores = np.full((len(current_stack), len(reference_stack)), -np.inf)
+    shifts = np.zeros(scores.shape + (2,), dtype=int)
+
+    for i in range(len(current_stack)):
+        columns = np.arange(len(reference_stack)) if candidates is None else np.flatnonzero(candidates[i])
+        if not len(columns):
+            continue
+        # corr[dy, dx] = sum(roll(current, (dy, dx)) * reference) para todas las candidatas a la vez
+        spectrum = reference_stack.spectra[columns] * np.conj(current_stack.spectra[i])
+        if spectrum.ndim == 4:
+            # Sumar la contribución de cada canal
+            spectrum = spectrum.sum(axis=3)
+        maps = np.fft.irfft2(spectrum, s=(height, width), axes=(1, 2))
+        windows = np.stack([correlation_map[window] for correlation_map in maps]).reshape(len(columns), -1)
+        # Primer desplazamiento empatado con el máximo, como best_shift
+        chosen = np.argmax(windows >= windows.max(axis=1, keepdims=True) - TIE_TOLERANCE, axis=1)
+        scores[i, columns] = windows[np.arange(len(columns)), chosen]
+        dy, dx = np.divmod(chosen, size)
+        shifts[i, columns] = np.stack([dx - seekrange, dy - seekrange], axis=1)
+
+    return mark_undefined(scores, shifts, current_stack, reference_stack)
@@ -4,12 +4,14 @@ import imageio.v2 as imageio
 import cv2
 import json
 from numpy import ndarray
+from tmproject import encoder
 
 is_grayscale = False
 
 def open_zip(zip_path, images, metadata) -> tuple[bool, bool]:
     """
-    Obre un fitxer ZIP especificat i carrega les imatges vàlides en un diccionari global.
+    Obre un fitxer ZIP especificat i carrega les imatges vàlides en un diccionari global. Les imatges P guardades com a
+    atles de teselles ("atlas" a les metadades) es tornen a muntar senceres.
 
     Args:
         zip_path (str): Ruta al fitxer ZIP que s'obrirà.
@@ -45,6 +47,10 @@ def open_zip(zip_path, images, metadata) -> tuple[bool, bool]:
                     is_grayscale = True
             else:  # error?
                 print(f'Error: {file_name} no es una imagen válida.')
+    # Volver a montar las imágenes P guardadas como atlas de teselas
+    for frame in metadata.get('frames', []):
+        if 'atlas' in frame and frame['file_name'] in images:
+            images[frame['file_name']] = encoder.unpack_tile_atlas(images[frame['file_name']], frame['atlas'])
     return is_encoded, is_grayscale
 
 
@@ -103,6 +109,23 @@ def read_video(file_path, images) -> bool:
     Returns:
         bool: True si el vídeo és en escala de grisos, False altrament.
     """
+    is_grayscale = False
+    for file_name, frame in iter_video(file_path):
+        images[file_name] = frame
+        is_grayscale = len(frame.shape) == 2
+    return is_grayscale
+
+
+def iter_video(file_path):
+    """
+    Llegeix un fitxer de vídeo (AVI, MPEG o MP4) fotograma a fotograma, sense carregar-lo sencer en memòria.
+
+    Args:
+        file_path (str): Ruta del fitxer de vídeo.
+
+    Yields:
+        tuple: Nom del fotograma ('frame_<i>.jpeg') i fotograma en RGB (o en escala de grisos si el vídeo ho és).
+    """
     video_capture = cv2.VideoCapture(file_path)
     if not video_capture.isOpened():
         raise ValueError(f"Unable to open video file: {file_path}")
@@ -121,16 +144,48 @@ def read_video(file_path, images) -> bool:
         while success and frame is not None:
             # If the video is in grayscale, save the frame without color conversion
             if is_grayscale:
-                images[f'frame_{frame_index}.jpeg'] = frame
+                yield f'frame_{frame_index}.jpeg', frame
             else:
                 # If the video is not in grayscale, convert to RGB before saving
-                images[f'frame_{frame_index}.jpeg'] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                yield f'frame_{frame_index}.jpeg', cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             frame_index += 1
             success, frame = video_capture.read()
 
     finally:
         video_capture.release()
 
-    return is_grayscale
 
-    
\ No newline at end of file
+def iter_gif(file_name):
+    """
+    Llegeix un fitxer GIF fotograma a fotograma, amb els mateixos noms que read_gif.
+
+    Args:
+        file_name (str): Nom del fitxer GIF.
+
+    Yields:
+        tuple: Nom del fotograma i fotograma.
+    """
+    file_name_without_extension = Path(file_name).stem
+    with imageio.get_reader(file_name) as reader:
+        for i, image_data in enumerate(reader):
+            yield f'{file_name_without_extension}_{i}.gif', image_data
+
+
+def iter_frames(file_path):
+    """
+    Llegeix fotograma a fotograma un fitxer de vídeo (AVI, MPEG o MP4) o GIF.
+
+    Args:
+        file_path (str): Ruta del fitxer.
+
+    Yields:
+        tuple: Nom del fotograma i fotograma.
+
+    Raises:
+        ValueError: Si el format del fitxer no es pot llegir en flux.
+    """
+    if file_path.endswith('.gif'):
+        return iter_gif(file_path)
+    if file_path.endswith(('.avi', '.mpeg', '.mp4')):
+        return iter_video(file_path)
+    raise ValueError(f"Format no vàlid per a la lectura en flux: {file_path}")
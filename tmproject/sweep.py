@@ -0,0 +1,160 @@
+import io
+import csv
+import copy
+import json
+import time
+import tempfile
+from pathlib import Path
+from tmproject import encoder
+from tmproject import decoder
+from tmproject import create_output
+
+# Columnes de l'informe del barreig de paràmetres, en ordre
+REPORT_FIELDS = ('n_tiles_x', 'n_tiles_y', 'quality', 'replaced_tiles', 'zip_size', 'compression_ratio',
+                 'psnr', 'decoded_psnr', 'encode_time', 'search_time')
+# Paràmetres de l'encoder amb què la cerca depèn de la qualitat: la memòria cau no es pot reaprofitar entre qualitats
+QUALITY_DEPENDENT_SEARCH = ('zeromotion', 'prefilter', 'annrecall')
+
+
+def main(images, input_size, qualities, tiles_list, metadata, parameters, target_psnr=None, cachedir=None) -> tuple[list, bytes or None]:
+    """
+    Codifica les mateixes imatges amb cada combinació de nombre de teselles i qualitat, i en mesura la mida del ZIP,
+    el PSNR i el temps de codificació. Les imatges d'entrada es llegeixen una sola vegada i, per a cada nombre de
+    teselles, la cerca de teselles es fa una sola vegada, abans de les qualitats, i se'n mesura el temps a part
+    ("search_time"): totes les qualitats en recuperen les correlacions de la memòria cau, de manera que els temps de
+    codificació de les files són comparables. Amb zeromotion, prefilter o annrecall la cerca depèn de la qualitat i
+    no es reaprofita: cada qualitat la torna a fer, dins del seu temps de codificació, i "search_time" queda buit.
+
+    Args:
+        images (dict): Imatges originals, que no es modifiquen.
+        input_size (int): Mida en bytes del fitxer d'entrada, per calcular la ràtio de compressió.
+        qualities (list): Valors de qualitat a provar.
+        tiles_list (list): Nombres de teselles (horitzontal, vertical) a provar.
+        metadata (dict): Metadades de partida, amb els paràmetres de l'encoder.
+        parameters (dict): La resta d'arguments de encoder.main (seekrange, gop, matcher...), amb els seus noms.
+        target_psnr (float): PSNR mínim (de les imatges descodificades) del punt escollit. Si és None, s'escull el de més PSNR.
+        cachedir (str): Directori de la memòria cau de correlacions. Si és None, se'n fa servir un de temporal.
+
+    Returns:
+        list: Una fila (diccionari amb les columnes REPORT_FIELDS) per a cada combinació, en ordre.
+        bytes: Contingut del ZIP del punt escollit, o None si cap punt arriba al PSNR mínim.
+    """
+    rows = []
+    chosen = None
+    reuse_search = not any(parameters.get(name) for name in QUALITY_DEPENDENT_SEARCH)
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        for ntiles in tiles_list:
+            search_time = search_point(images, ntiles, qualities[0], metadata, parameters, cachedir or temporary_dir) if reuse_search else None
+            for quality in qualities:
+                row, zip_bytes = encode_point(images, input_size, ntiles, quality, metadata, parameters, cachedir or temporary_dir)
+                row["search_time"] = search_time
+                rows.append(row)
+                if is_better_point(row, chosen[0] if chosen else None, target_psnr):
+                    chosen = (row, zip_bytes)
+    return rows, chosen[1] if chosen else None
+
+
+def search_point(images, ntiles, quality, metadata, parameters, cachedir) -> float:
+    """
+    Fa la cerca de teselles d'un nombre de teselles i en deixa les correlacions a la memòria cau.
+
+    Args:
+        images (dict): Imatges originals, que no es modifiquen.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        quality (float): Factor de qualitat (no afecta les correlacions guardades).
+        metadata (dict): Metadades de partida, amb els paràmetres de l'encoder.
+        parameters (dict): La resta d'arguments de encoder.main.
+        cachedir (str): Directori de la memòria cau de correlacions.
+
+    Returns:
+        float: Temps de la cerca, en segons.
+    """
+    search_images = {file_name: image.copy() for file_name, image in images.items()}
+    start_time = time.time()
+    encoder.main(search_images, ntiles, quality=quality, metadata=copy.deepcopy(metadata), cachedir=cachedir, **parameters)
+    return time.time() - start_time
+
+
+def encode_point(images, input_size, ntiles, quality, metadata, parameters, cachedir) -> tuple[dict, bytes]:
+    """
+    Codifica una còpia de les imatges amb un nombre de teselles i una qualitat, la descodifica i en genera el ZIP en memòria.
+
+    Args:
+        images (dict): Imatges originals, que no es modifiquen.
+        input_size (int): Mida en bytes del fitxer d'entrada.
+        ntiles (tuple): Nombre de teselles en els eixos horitzontal i vertical.
+        quality (float): Factor de qualitat.
+        metadata (dict): Metadades de partida, amb els paràmetres de l'encoder.
+        parameters (dict): La resta d'arguments de encoder.main.
+        cachedir (str): Directori de la memòria cau de correlacions.
+
+    Returns:
+        dict: Fila de l'informe.
+        bytes: Contingut del ZIP.
+    """
+    encoded_images = {file_name: image.copy() for file_name, image in images.items()}
+    point_metadata = copy.deepcopy(metadata)
+    point_metadata["encoder_parameters"].update(n_tiles_x=ntiles[0], n_tiles_y=ntiles[1], quality=quality)
+    start_time = time.time()
+    encoder.main(encoded_images, ntiles, quality=quality, metadata=point_metadata, cachedir=cachedir, **parameters)
+    encode_time = time.time() - start_time
+
+    decoded_images = {file_name: image.copy() for file_name, image in encoded_images.items()}
+    decoder.main(decoded_images, point_metadata)
+    buffer = io.BytesIO()
+    create_output.create_zip(buffer, encoded_images, point_metadata, False)
+    zip_bytes = buffer.getvalue()
+
+    row = {
+        "n_tiles_x": ntiles[0],
+        "n_tiles_y": ntiles[1],
+        "quality": quality,
+        "replaced_tiles": sum(len(frame.get("tiles", [])) for frame in point_metadata["frames"]),
+        "zip_size": len(zip_bytes),
+        "compression_ratio": input_size / len(zip_bytes),
+        "psnr": encoder.calculate_psnr(images, encoded_images),
+        "decoded_psnr": encoder.calculate_psnr(images, decoded_images),
+        "encode_time": encode_time,
+    }
+    return row, zip_bytes
+
+
+def is_better_point(row, best, target_psnr=None) -> bool:
+    """
+    Indica si un punt és millor que el millor trobat fins ara: amb un PSNR mínim, el ZIP més petit que hi arriba;
+    sense, el de més PSNR de les imatges descodificades.
+
+    Args:
+        row (dict): Fila del punt.
+        best (dict): Fila del millor punt fins ara, o None.
+        target_psnr (float): PSNR mínim, o None.
+
+    Returns:
+        bool: True si el punt passa a ser el millor.
+    """
+    # Sin diferencias respecto al original el PSNR no está definido: la calidad es la máxima
+    psnr = float('inf') if row["decoded_psnr"] is None else row["decoded_psnr"]
+    if target_psnr is not None:
+        return psnr >= target_psnr and (best is None or row["zip_size"] < best["zip_size"])
+    if best is None:
+        return True
+    best_psnr = float('inf') if best["decoded_psnr"] is None else best["decoded_psnr"]
+    return psnr > best_psnr
+
+
+def write_report(rows, report_path):
+    """
+    Guarda l'informe del barreig en format CSV o JSON, segons l'extensió del fitxer.
+
+    Args:
+        rows (list): Files de l'informe.
+        report_path (str): Ruta del fitxer (.csv o .json).
+    """
+    if Path(report_path).suffix.lower() == '.json':
+        with open(report_path, 'w') as file:
+            json.dump(rows, file, indent=4)
+    else:
+        with open(report_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)